@@ -94,49 +94,39 @@ class Dialog(FluxPlugin):
         init_rules = fontFeatures.Routine(name="Init")
         medi_rules = fontFeatures.Routine(name="Medi")
         fina_rules = fontFeatures.Routine(name="Fina")
-        # We know these are valid REs
-        arabic_glyphs = [
-            g
-            for g in glyphnames
-            if re.search(init_re, g) or re.search(medi_re, g) or re.search(fina_re, g)
-        ]
+        # We know these are valid REs. Work out the base name of each
+        # positional form once, keeping the first glyph for each base.
+        forms = {"init": {}, "medi": {}, "fina": {}}
+        searches = {
+            "init": re.compile(init_re).search,
+            "medi": re.compile(medi_re).search,
+            "fina": re.compile(fina_re).search,
+        }
+        for g in glyphnames:
+            for form, search in searches.items():
+                m = search(g)
+                if not m or not m.groups():
+                    continue
+                forms[form].setdefault(g.replace(m[1], ""), g)
+
+        isol_search = re.compile(isol_re).search
         for g in glyphnames:
-            m = re.search(isol_re, g)
+            m = isol_search(g)
             if not m:
                 continue
             if m.groups():
                 base_name = g.replace(m[1], "")
             else:
                 base_name = g
-            for g2 in arabic_glyphs:
-                m = re.search(init_re, g2)
-                if not m or not m.groups():
-                    continue
-                base_init = g2.replace(m[1], "")
-                if base_init == base_name:
-                    init_class.append(g2)
-                    init_rules.addRule(fontFeatures.Substitution([[g]], [[g2]]))
-                    break
-
-            for g2 in arabic_glyphs:
-                m = re.search(medi_re, g2)
-                if not m or not m.groups():
-                    continue
-                base_medi = g2.replace(m[1], "")
-                if base_medi == base_name:
-                    medi_class.append(g2)
-                    medi_rules.addRule(fontFeatures.Substitution([[g]], [[g2]]))
-                    break
-
-            for g2 in arabic_glyphs:
-                m = re.search(fina_re, g2)
-                if not m or not m.groups():
-                    continue
-                base_fina = g2.replace(m[1], "")
-                if base_fina == base_name:
-                    fina_class.append(g2)
-                    fina_rules.addRule(fontFeatures.Substitution([[g]], [[g2]]))
-                    break
+            for form, klass, rules in [
+                ("init", init_class, init_rules),
+                ("medi", medi_class, medi_rules),
+                ("fina", fina_class, fina_rules),
+            ]:
+                g2 = forms[form].get(base_name)
+                if g2:
+                    klass.append(g2)
+                    rules.addRule(fontFeatures.Substitution([[g]], [[g2]]))
 
         warnings = []
         if len(init_class) < 10 or len(init_class) > len(glyphnames) / 2:
@@ -182,18 +172,10 @@ class Dialog(FluxPlugin):
             }
 
         if self.doCursive.isChecked():
-            exitdict = {}
-            entrydict = {}
-            for g in glyphnames:
-                anchors = self.project.font[g].anchors
-                if not anchors:
-                    continue
-                entry = [a for a in anchors if a.name == "entry"]
-                exit = [a for a in anchors if a.name == "exit"]
-                if len(entry):
-                    entrydict[g] = (entry[0].x, entry[0].y)
-                if len(exit):
-                    exitdict[g] = (exit[0].x, exit[0].y)
+            # The project already has every glyph's anchors to hand
+            anchors = self.project.fontfeatures.anchors
+            entrydict = dict(anchors.get("entry", {}))
+            exitdict = dict(anchors.get("exit", {}))
             s = fontFeatures.Attachment(
                 base_name="entry",
                 mark_name="exit",
@@ -222,17 +204,18 @@ class Dialog(FluxPlugin):
                 "fina": "(f1)$",
             },
         }
+        searches = [
+            (schema_name, form, re.compile(regexp).search)
+            for schema_name, res in schemas.items()
+            for form, regexp in res.items()
+        ]
+        counts = {(schema_name, form): 0 for schema_name, form, _ in searches}
+        for g in glyphnames:
+            for schema_name, form, search in searches:
+                if search(g):
+                    counts[(schema_name, form)] += 1
         for schema_name, res in schemas.items():
-            match_isols = len([g for g in glyphnames if re.search(res["isol"], g)])
-            match_inits = len([g for g in glyphnames if re.search(res["init"], g)])
-            match_medis = len([g for g in glyphnames if re.search(res["medi"], g)])
-            match_finas = len([g for g in glyphnames if re.search(res["fina"], g)])
-            if (
-                match_isols > 1
-                and match_inits > 1
-                and match_medis > 1
-                and match_finas > 1
-            ):
+            if all(counts[(schema_name, form)] > 1 for form in res):
                 return schema_name, res
         return None, None
 
@@ -18,6 +18,7 @@ from Flux.UI.qglyphname import QGlyphName
 import re
 import fontFeatures
 from PyQt5.QtCore import Qt
+from functools import lru_cache
 import sys
 from Flux.computedroutine import ComputedRoutine
 
@@ -40,12 +41,44 @@ class REValidator(QValidator):
         # Trim multiple spaces?
         pass
 
+@lru_cache(maxsize=64)
+def compiled(pattern):
+    return re.compile(pattern)
+
+
+def glyphSlots(text, classes):
+    """Turns a list of glyphs and @classes into one slot for each."""
+    slots = []
+    for token in text.split():
+        if token.startswith("@"):
+            slots.append(list(classes[token[1:]]))
+        else:
+            slots.append([token])
+    return slots
+
+
+def substitute(glyphname, match, replace, glyphnames):
+    """Returns what a glyph becomes, or None if that isn't a glyph."""
+    try:
+        new = match.sub(replace, glyphname)
+    except Exception:
+        return None
+    if new not in glyphnames:
+        return None
+    return new
+
+
 class Dialog(FluxPlugin):
 
     def __init__(self, project):
         self.project = project
         self.glyphnames = self.project.font.keys()
+        self.glyphnameset = set(self.glyphnames)
         self.routine = None
+        self.last = {}
+        self.filtered = []  # Glyphs passing the filter
+        self.replacements = {}  # glyph: replacement, for the current match and replace
+        self.rows = {}  # glyph: preview line, for the current before and after
         super().__init__(project)
 
     def createForm(self):
@@ -115,7 +148,40 @@ class Dialog(FluxPlugin):
         self.routine.plugin = __name__
         self.routine.project = self.project
         self.routine.module = sys.modules[__name__]
-        self.preview.setText(self.routine.asFea())
+
+        # Only redo the work that depends on what was changed
+        changed = {k for k in p if p[k] != self.last.get(k)}
+        if "filter" in changed:
+            search = compiled(p["filter"]).search
+            self.filtered = [g for g in self.glyphnames if search(g)]
+        if changed & {"match", "replace"}:
+            self.replacements = {}
+            self.rows = {}
+        if changed & {"before", "after"}:
+            self.rows = {}
+            try:
+                classes = self.project.fontfeatures.namedClasses
+                self.precontext = glyphSlots(p["before"], classes)
+                self.postcontext = glyphSlots(p["after"], classes)
+            except KeyError as e:
+                self.preview.setText("Unknown class %s" % e)
+                self.last = {}
+                return
+        self.last = p
+
+        match = compiled(p["match"])
+        lines = []
+        for g in self.filtered:
+            if g not in self.replacements:
+                self.replacements[g] = substitute(g, match, p["replace"], self.glyphnameset)
+            new = self.replacements[g]
+            if new is None:
+                continue
+            if g not in self.rows:
+                sub = fontFeatures.Substitution([[g]], [[new]], precontext=self.precontext, postcontext=self.postcontext)
+                self.rows[g] = sub.asFea()
+            lines.append(self.rows[g])
+        self.preview.setPlainText("\n".join(lines))
 
 
     def accept(self):
@@ -132,21 +198,26 @@ class Dialog(FluxPlugin):
 def rulesFromComputedRoutine(routine):
     p = routine.parameters
     glyphnames = routine.project.font.keys()
+    glyphnameset = set(glyphnames)
+    classes = routine.project.fontfeatures.namedClasses
+    try:
+        precontext = glyphSlots(p["before"], classes)
+        postcontext = glyphSlots(p["after"], classes)
+    except KeyError as e:
+        print("Unknown class %s" % e)
+        return []
+    search = compiled(p["filter"]).search
+    match = compiled(p["match"])
     rules = []
     for g in glyphnames:
-        if not re.search(p["filter"], g):
-            continue
-        try:
-            new = re.sub(p["match"], p["replace"], g)
-        except:
+        if not search(g):
             continue
-        if new not in glyphnames:
+        new = substitute(g, match, p["replace"], glyphnameset)
+        if new is None:
             continue
-        sub = fontFeatures.Substitution( [[g]], [[new]])
-        # XXX classes
-        if p["before"]:
-            sub.input = [ [glyph] for glyph in p["before"].split() ] + sub.input
-        if p["after"]:
-            sub.input.extend([ [glyph] for glyph in p["after"].split() ])
-        rules.append(sub)
+        rules.append(fontFeatures.Substitution(
+            [[g]], [[new]],
+            precontext=[list(slot) for slot in precontext],
+            postcontext=[list(slot) for slot in postcontext],
+        ))
     return rules
@@ -1,6 +1,7 @@
-from dataclasses import dataclass
 from lxml import etree
+from Flux.glyphactions import GlyphAction
 from Flux.UI.qglyphname import QGlyphPicker, QGlyphBox
+from Flux.UI.qbufferrenderer import pathcache
 from PyQt5.QtWidgets import (
     QWidget,
     QDialog,
@@ -13,51 +14,6 @@ from PyQt5.QtWidgets import (
     QComboBox,
 )
 from PyQt5.QtCore import Qt
-from typing import Optional
-
-
-@dataclass
-class GlyphAction:
-    glyph: str
-    width: Optional[int] = None
-    category: Optional[str] = None
-    duplicate_from: Optional[str] = None
-
-    def toXML(self):
-        root = etree.Element("glyphaction")
-        root.attrib["glyph"] = self.glyph
-        if self.duplicate_from:
-            root.attrib["duplicate_from"] = self.duplicate_from
-        if self.width is not None:
-            root.attrib["width"] = str(self.width)
-        if self.category:
-            root.attrib["category"] = self.category
-        return root
-
-    @classmethod
-    def fromXML(klass, el):
-        return klass(
-            glyph=el.get("glyph"),
-            duplicate_from=el.get("duplicate_from"),
-            width=int(el.get("width")),
-            category=el.get("category"),
-        )
-
-    def perform(self, font):
-        if self.duplicate_from:
-            font[self.glyph] = font[self.duplicate_from].copy()
-        if self.width is not None:
-            font[self.glyph].width = self.width
-        if self.category:
-            font[self.glyph].set_category(self.category)
-
-    def doesSomething(self, font):
-        effect = self.duplicate_from is not None
-        if self.width is not None and self.width != font[self.glyph].width:
-            effect = True
-        if self.category is not None and self.category != font[self.glyph].category:
-            effect = True
-        return effect
 
 
 class QGlyphActionDialog(QDialog):
@@ -118,7 +74,9 @@ class QGlyphActionBox(QGlyphBox):
             if action.doesSomething(self.parent.project.font):
                 print(etree.tostring(action.toXML()))
                 action.perform(self.parent.project.font)
+                pathcache.invalidate(action.glyph)
                 self.parent.project.glyphactions[action.glyph] = action
+                self.parent.project.glyphChanged(action.glyph)
 
 
 class QGlyphActionPicker(QGlyphPicker):
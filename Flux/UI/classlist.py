@@ -8,7 +8,8 @@ from PyQt5.QtCore import (
     QRect
 )
 from PyQt5.QtWidgets import QTreeView, QMenu, QStyledItemDelegate, QLineEdit
-from .glyphpredicateeditor import AutomatedGlyphClassDialog, GlyphClassPredicateTester, GlyphClassPredicate
+from .glyphpredicateeditor import AutomatedGlyphClassDialog
+from Flux.glyphpredicates import GlyphClassPredicateTester, GlyphClassPredicate
 from .qglyphname import QGlyphName
 
 class GlyphNameDelegate(QStyledItemDelegate):
@@ -74,9 +75,7 @@ class GlyphClassModel(QAbstractTableModel):
     def setPredicates(self, index, predicates):
         name = self.order[index.row()]
         self.glyphclasses[name]["predicates"] = predicates
-        self.project.fontfeatures.namedClasses[name] = tuple(self.tester.test_all(
-            [GlyphClassPredicate(d) for d in predicates]
-        ))
+        self.project.classChanged(name)
 
     def data(self, index, role=Qt.DisplayRole):
         if not index.isValid():
@@ -126,6 +125,7 @@ class GlyphClassModel(QAbstractTableModel):
         if "" not in self.order:
             self.order.append("")
             self.glyphclasses[""] = {"type": "manual", "contents": []}
+            self.project.classChanged("")
 
         self.endInsertRows()
         return True
@@ -148,6 +148,7 @@ class GlyphClassModel(QAbstractTableModel):
         self.beginRemoveRows(QModelIndex(), position, position + rows - 1)
         assert rows == 1
         del self.glyphclasses[self.order[position]]
+        self.project.classChanged(self.order[position])
         # print("Deleting %s" % self.order[position])
         self.endRemoveRows()
         return True
@@ -164,8 +165,11 @@ class GlyphClassModel(QAbstractTableModel):
             if index.column() == 0 and name != value:
                 self.glyphclasses[value] = self.glyphclasses[name]
                 del self.glyphclasses[name]
+                self.project.classChanged(name)
+                self.project.classChanged(value)
             elif index.column() == 1:
                 self.glyphclasses[name]["contents"] = value.split(" ")
+                self.project.classChanged(name)
             else:
                 return False
 
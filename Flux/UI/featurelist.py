@@ -45,7 +45,9 @@ class FeatureList(QTreeView):
 
     def highlight(self, feature, routine=None):
         self.collapseAll()
-        featureRow = list(self.project.fontfeatures.features.keys()).index(feature)
+        featureRow = self.model().featureRow(feature)
+        if featureRow is None:
+            return
         index = self.model().index(featureRow, 0)
         if featureRow:
             self.scrollTo(self.model().index(featureRow + 1, 0))
@@ -129,12 +131,11 @@ class FeatureList(QTreeView):
             destination = self.indexAt(event.pos())
             if self.model().indexIsFeature(destination):
                 # Easy-peasy
-                destFeature = list(self.project.fontfeatures.features.keys())[
-                    destination.row()
-                ]
+                destFeature = self.model().featureKeys()[destination.row()]
                 routineList = self.project.fontfeatures.features[destFeature]
                 print(f"Dropping {routineName} to end of {destFeature}")
                 self.project.fontfeatures.features[destFeature].append(routine)
+                self.project.routinesChanged()
                 self.model().dataChanged.emit(destination, destination)
                 self.update()
                 self.setExpanded(destination, True)
@@ -199,6 +200,27 @@ class FeatureListModel(QAbstractItemModel):
         self.project = proj
         self.rootIndex = QModelIndex()
         self.retained_objects = {}
+        # Feature names in order, their rows, and routines by name, so that
+        # looking things up doesn't mean listing the whole project each time
+        self._features = None
+        self.featureOrder = []
+        self.featureRows = {}
+        self.modelReset.connect(self.forget)
+
+    def forget(self):
+        self._features = None
+
+    def featureKeys(self):
+        features = self.project.fontfeatures.features
+        if self._features is not features or len(self.featureOrder) != len(features):
+            self._features = features
+            self.featureOrder = list(features.keys())
+            self.featureRows = {k: row for row, k in enumerate(self.featureOrder)}
+        return self.featureOrder
+
+    def featureRow(self, feature):
+        self.featureKeys()
+        return self.featureRows.get(feature)
 
     # Horrific hack to avoid GC bug
     def makeSingleton(self, row):
@@ -222,12 +244,10 @@ class FeatureListModel(QAbstractItemModel):
         return 0
 
     def getFeatureNameAtRow(self, row):
-        keys = list(self.project.fontfeatures.features.keys())
-        return str(keys[row])
+        return str(self.featureKeys()[row])
 
     def getRoutinesAtRow(self, row):
-        values = list(self.project.fontfeatures.features.values())
-        return values[row]
+        return self.project.fontfeatures.features[self.featureKeys()[row]]
 
     def columnCount(self, index=QModelIndex()):
         return 1
@@ -263,9 +283,16 @@ class FeatureListModel(QAbstractItemModel):
         return ix
 
     def change_key(self, old, new):
-        for _ in range(len(self.project.fontfeatures.features)):
-            k, v = self.project.fontfeatures.features.popitem(False)
-            self.project.fontfeatures.features[new if old == k else k] = v
+        features = self.project.fontfeatures.features
+        keys = self.featureKeys()
+        row = self.featureRows[old]
+        # Put the new name at the end, then move the ones after it back behind it
+        features[new] = features.pop(old)
+        for k in keys[row + 1:]:
+            features.move_to_end(k)
+        keys[row] = new
+        del self.featureRows[old]
+        self.featureRows[new] = row
 
     def setData(self, index, value, role=Qt.EditRole):
         print("Set data called", index, index.row(), index.column())
@@ -282,9 +309,8 @@ class FeatureListModel(QAbstractItemModel):
         if self.indexIsFeature(index):
             print("Renaming a feature", index.internalPointer())
             self.dataChanged.emit(index, index)
-            self.change_key(
-                list(self.project.fontfeatures.features.keys())[index.row()], value
-            )
+            self.change_key(self.featureKeys()[index.row()], value)
+            self.project.routinesChanged()
             return True
         else:
             routines = self.getRoutinesAtRow(index.internalPointer()["row"])
@@ -300,6 +326,7 @@ class FeatureListModel(QAbstractItemModel):
                 self.parent(index),
             )
             routines[index.row()] = self.routineCalled(value)
+            self.project.routinesChanged()
             self.dataChanged.emit(index, index)
             print(
                 "Internal pointer of parent now", self.parent(index).internalPointer()
@@ -307,7 +334,7 @@ class FeatureListModel(QAbstractItemModel):
         return True
 
     def routineCalled(self, value):
-        return ([x for x in self.project.fontfeatures.routines if x.name == value])[0]
+        return self.project.routineRegistry.named(value)
 
     def indexIsRoutine(self, index):
         return index.isValid() and isinstance(index.internalPointer(), dict)
@@ -351,13 +378,15 @@ class FeatureListModel(QAbstractItemModel):
         """ Insert a row into the model. """
         print("Inserting a row at row ", row)
         print("Parent= ", self.describeIndex(parent))
-        self.beginInsertRows(parent, row, row + count)
+        self.beginInsertRows(parent, row, row + count - 1)
         if not parent.isValid():
             self.project.fontfeatures.features["<New Feature>"] = []
+            self._features = None
         else:
             parent.internalPointer().insert(row, None)
             print("Internal pointer of parent is now", parent.internalPointer())
         self.endInsertRows()
+        self.project.routinesChanged()
         return True
 
     def appendRow(self):
@@ -373,12 +402,14 @@ class FeatureListModel(QAbstractItemModel):
         print("Remove row called", index)
         self.beginRemoveRows(self.parent(index), index.row(), index.row())
         if self.indexIsFeature(index):
-            key = list(self.project.fontfeatures.features.keys())[index.row()]
+            key = self.featureKeys()[index.row()]
             del self.project.fontfeatures.features[key]
+            self._features = None
         else:
             routineList = self.getRoutinesAtRow(index.internalPointer()["row"])
             del routineList[index.row()]
         self.endRemoveRows()
+        self.project.routinesChanged()
         return True
 
     def addRule(self, ix, rule):
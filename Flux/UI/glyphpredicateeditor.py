@@ -1,8 +1,7 @@
 from PyQt5.QtCore import Qt, pyqtSlot, QModelIndex, QAbstractTableModel, QItemSelectionModel, pyqtSignal
 from PyQt5.QtGui import QStandardItem, QStandardItemModel
 from PyQt5.QtWidgets import QTreeView, QMenu,QComboBox, QHBoxLayout, QVBoxLayout, QPushButton, QLineEdit, QLabel, QDialog, QTextEdit, QDialogButtonBox
-import re
-from glyphtools import get_glyph_metrics
+from Flux.glyphpredicates import GlyphClassPredicate, GlyphClassPredicateTester
 
 
 PREDICATE_TYPES = {
@@ -20,89 +19,6 @@ PREDICATE_TYPES = {
   "Has anchor": {"textbox": True, "comparator": False}
 }
 
-class GlyphClassPredicate:
-    def __init__(self, predicate_dict = {}):
-        self.comparator = None
-        self.combiner = None
-        self.value = None
-        self.metric = None
-        if "type" in predicate_dict:
-          self.type = predicate_dict["type"]
-        if "comparator" in predicate_dict:
-            self.comparator = predicate_dict["comparator"]
-        if "value" in predicate_dict:
-            self.value = predicate_dict["value"]
-        if "metric" in predicate_dict: # Metric, really
-            self.metric = predicate_dict["metric"]
-        if "combiner" in predicate_dict:
-            self.combiner = predicate_dict["combiner"]
-
-    def test(self, glyphset, font, infocache):
-        matches = []
-        if self.type == "Name":
-          # print(self.comparator, self.value)
-          if self.comparator == "begins":
-            matches = [x for x in glyphset if x.startswith(self.value)]
-          elif self.comparator == "ends":
-            matches = [x for x in glyphset if x.endswith(self.value)]
-          elif self.comparator == "matches":
-            try:
-                matches = [x for x in glyphset if re.search(self.value,x)]
-            except Exception as e:
-                matches = []
-
-        # XXX HasAnchor
-        # XXX Is member of
-        # XXX Is Category
-
-        if self.metric:
-          matches = []
-          try:
-            for g in glyphset:
-              if g not in infocache:
-                infocache[g] = { "metrics": get_glyph_metrics(font, g) }
-
-              got = infocache[g]["metrics"][self.type]
-              expected, comp = int(self.value), self.comparator
-              if (comp == ">" and got > expected) or (comp == "<" and got < expected) or (comp == "=" and got == expected) or (comp == "<=" and got <= expected) or (comp == ">=" and got >= expected):
-                  matches.append(g)
-          except Exception as e:
-            print(e)
-            pass
-
-        return matches
-
-    def to_dict(self):
-        d = { "type": self.type }
-        if self.comparator:
-          d["comparator"] = self.comparator
-        if self.combiner:
-          d["combiner"] = self.combiner
-        if self.value is not None:
-          d["value"] = self.value
-        if self.metric:
-          d["metric"] = self.metric
-        return d
-
-class GlyphClassPredicateTester:
-    def __init__(self, project):
-        self.project = project
-        self.infocache = {}
-        self.allGlyphs = self.project.font.keys()
-
-    def test_all(self, predicates):
-        matches = self.allGlyphs
-        if len(predicates) > 0:
-          matches = predicates[0].test(matches, self.project.font, self.infocache)
-        for p in predicates[1:]:
-          if p.combiner == "and":
-            # Narrow down existing set
-            matches = p.test(matches, self.project.font, self.infocache)
-          else:
-            thisPredicateMatches = p.test(self.allGlyphs, self.project.font, self.infocache)
-            matches = set(matches) | set(thisPredicateMatches)
-        return matches
-
 class GlyphClassPredicateRow(QHBoxLayout):
     changed = pyqtSignal()
 
@@ -18,7 +18,8 @@ from PyQt5.QtCore import (
     QModelIndex,
     Qt,
     pyqtSlot,
-    QMimeData
+    QMimeData,
+    QThread
 )
 from PyQt5.QtGui import QValidator
 import sys
@@ -34,8 +35,13 @@ from fontFeatures import (
 from Flux.project import FluxProject
 import re
 from Flux.ThirdParty.HTMLDelegate import HTMLDelegate
-from Flux.computedroutine import ComputedRoutine
+from Flux.computedroutine import ComputedRoutine, ProjectSnapshot, computeWith
 from Flux.dividerroutine import DividerRoutine
+from Flux.lazyroutine import LazyRoutine
+from functools import partial
+
+BATCH = 1000  # Rules added to the list at a time
+PAGE = 50  # Rules described at a time
 
 
 class FeatureValidator(QValidator):
@@ -111,6 +117,30 @@ class AddToFeatureDialog(QDialog):
         return super().accept()
 
 
+class Placeholder:
+    """Stands in for the rules of a computed routine while they're worked out."""
+    def __init__(self, routine):
+        self.routine = routine
+
+
+class ComputeThread(QThread):
+    """Computes a routine's rules from a snapshot of the project taken on
+    the GUI thread, leaving the routine itself alone until they're
+    installed back there."""
+    def __init__(self, routine, parent=None):
+        super(ComputeThread, self).__init__(parent)
+        project = routine.project
+        self.snapshot = ProjectSnapshot(
+            list(project.font.keys()), dict(project.fontfeatures.namedClasses), project.plugins
+        )
+        self.args = (routine.plugin, routine.name, routine.flags, dict(routine.parameters),
+                     getattr(routine, "module", None))
+        self.result = None
+
+    def run(self):
+        self.result = computeWith(self.snapshot, *self.args)
+
+
 class LookupList(QTreeView):
     def __init__(self, project, parent):
         super(QTreeView, self).__init__()
@@ -118,6 +148,9 @@ class LookupList(QTreeView):
         self.parent = parent
         self.setModel(LookupListModel(project, parent=self))
         self.setItemDelegate(HTMLDelegate())
+        # Saves asking the delegate to lay out every row to find the size
+        # of the list, which matters for routines with thousands of rules
+        self.setUniformRowHeights(True)
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.setDragEnabled(True)
         self.setAcceptDrops(True)
@@ -129,11 +162,11 @@ class LookupList(QTreeView):
         self.doubleClicked.connect(self.doubleClickHandler)
 
     def highlight(self, routineName):
-        routineNames = [x.name for x in self.project.fontfeatures.routines]
-        if not routineName in routineNames:
+        routine = self.project.routineRegistry.named(routineName)
+        if routine is None:
             return
         self.collapseAll()
-        routineRow = routineNames.index(routineName)
+        routineRow = self.project.routineRegistry.row(routine)
         if routineRow:
             self.scrollTo(self.model().index(routineRow + 1, 0))
             self.setCurrentIndex(self.model().index(routineRow, 0))
@@ -142,6 +175,7 @@ class LookupList(QTreeView):
 
     def update(self, index=QModelIndex()):
         if index.isValid():
+            self.model().forgetDescription(index.internalPointer())
             self.model().dataChanged.emit(index, index)
         else:
             self.model().beginResetModel()
@@ -161,7 +195,7 @@ class LookupList(QTreeView):
         menu.addAction("Add routine", self.addRoutine)
         if indexes:
             thing = indexes[0].internalPointer()
-            if isinstance(thing, Rule) and hasattr(thing, "computed"):
+            if isinstance(thing, Rule) and hasattr(thing, "computed") or isinstance(thing, Placeholder):
                 pass
             elif isinstance(thing, Routine):
                 menu.addAction("Delete routine", self.deleteItem)
@@ -209,6 +243,7 @@ class LookupList(QTreeView):
         result = dialog.exec_()
         if result:
             self.project.fontfeatures.addFeature(dialog.feature, [routine])
+            self.project.routinesChanged()
             self.model().dataChanged.emit(index, index)
             self.parent.editor.setWindowModified(True)
             self.parent.editor.update()
@@ -220,6 +255,7 @@ class LookupList(QTreeView):
         dialog = LookupFlagEditor(routine)
         result = dialog.exec_()
         if result:
+            self.project.routineChanged(routine)
             self.model().dataChanged.emit(index, index)
             self.parent.editor.setWindowModified(True)
 
@@ -241,14 +277,16 @@ class LookupList(QTreeView):
         rindex = index.row()
         newroutine = oldroutine.reify()
         self.project.fontfeatures.routines[rindex] = newroutine
+        self.model().routineReplaced(oldroutine, newroutine)
         for k,v in self.project.fontfeatures.features.items():
             self.project.fontfeatures.features[k] = [ newroutine if r==oldroutine else r for r in v]
+        self.project.routinesChanged()
 
         self.parent.editor.setWindowModified(True)
         self.parent.editor.update()
 
     def doubleClickHandler(self, index):
-        if isinstance(index.internalPointer(), Routine):
+        if isinstance(index.internalPointer(), (Routine, Placeholder)):
             return
         if hasattr(index.internalPointer(), "computed"):
             index = index.parent()
@@ -285,6 +323,7 @@ class LookupList(QTreeView):
         index = self.selectedIndexes()[0]
         self.model().insertRows(index.row()+1, 1)
         self.project.fontfeatures.routines[index.row()+1] = DividerRoutine()
+        self.project.routinesChanged()
         self.parent.editor.setWindowModified(True)
 
     @pyqtSlot()
@@ -299,6 +338,20 @@ class LookupListModel(QAbstractItemModel):
         super(LookupListModel, self).__init__(parent)
         self._parent = parent
         self.project = proj
+        # Which routine each rule we've handed out an index for belongs to,
+        # so parent() needn't search, and which rules those are for each
+        # routine, so they can be let go of with it
+        self.ruleParents = {}
+        self.routineRules = {}
+        # How many rules of each routine are in the list so far; the rest
+        # are added by fetchMore as the list is scrolled
+        self.shown = {}
+        self.fetching = False
+        self.descriptions = {}
+        # Computed routines being worked out in the background
+        self.computing = {}
+        self.failed = {}
+        self.modelReset.connect(self.forget)
 
     def headerData(self, section, orientation, role):
         if role != Qt.DisplayRole:
@@ -312,9 +365,92 @@ class LookupListModel(QAbstractItemModel):
             item = index.internalPointer()
             if isinstance(item, Routine):
                 item.editor = self._parent.parent.editor
-                return len(item.rules)
+                if id(item) in self.computing:
+                    return 1
+                if self.needsComputing(item):
+                    self.compute(item)
+                    return 1
+                return self.rulesShown(item)
         return 0
 
+    def hasChildren(self, index=QModelIndex()):
+        # Don't read a routine in from the file, or compute it, just to
+        # draw its arrow
+        item = index.internalPointer() if index.isValid() else None
+        if item is not None and not isinstance(item, Routine):
+            return False  # Rules have no children
+        if isinstance(item, LazyRoutine) and not item.loaded:
+            return True
+        if isinstance(item, ComputedRoutine) and (id(item) in self.computing or self.needsComputing(item)):
+            return True
+        return super().hasChildren(index)
+
+    def rulesShown(self, routine):
+        entry = self.shown.get(id(routine))
+        if not entry or entry[0] is not routine:
+            entry = self.shown[id(routine)] = (routine, min(len(routine.rules), BATCH))
+        return min(entry[1], len(routine.rules))
+
+    def canFetchMore(self, index):
+        item = index.internalPointer() if index.isValid() else None
+        if not isinstance(item, Routine) or id(item) in self.computing or self.needsComputing(item):
+            return False
+        if self.fetching:
+            return False  # Views ask again while rows are going in
+        return self.rulesShown(item) < len(item.rules)
+
+    def fetchMore(self, index):
+        if not self.canFetchMore(index):
+            return
+        routine = index.internalPointer()
+        start = self.rulesShown(routine)
+        end = min(len(routine.rules), start + BATCH)
+        self.fetching = True
+        self.beginInsertRows(index, start, end - 1)
+        self.shown[id(routine)] = (routine, end)
+        self.endInsertRows()
+        self.fetching = False
+
+    def needsComputing(self, routine):
+        if not isinstance(routine, ComputedRoutine) or not routine.stale or not routine.okay:
+            return False
+        entry = self.failed.get(id(routine))
+        return not entry or entry[0] is not routine
+
+    def compute(self, routine):
+        # Work the rules out in the background, with a placeholder meanwhile
+        self.forgetRoutine(routine)  # Its old rules are done with
+        thread = ComputeThread(routine, self)
+        self.computing[id(routine)] = (routine, Placeholder(routine), thread)
+        thread.finished.connect(partial(self.computed, routine))
+        thread.finished.connect(thread.deleteLater)
+        thread.start()
+
+    def computed(self, routine):
+        thread = self.computing[id(routine)][2]
+        if not thread.result or not routine.install(*thread.result):
+            # The plugin wanted more of the project than the snapshot has
+            try:
+                routine.rules
+            except Exception as e:
+                print(e)
+        if routine.stale:
+            self.failed[id(routine)] = (routine, True)
+        row = self.project.routineRegistry.row(routine)
+        if row is None:
+            self.computing.pop(id(routine), None)
+            return
+        # Swap the placeholder for the rules
+        index = self.index(row, 0)
+        self.fetching = True
+        self.beginRemoveRows(index, 0, 0)
+        self.computing.pop(id(routine), None)
+        self.shown[id(routine)] = (routine, 0)
+        self.endRemoveRows()
+        self.fetching = False
+        self.forgetRoutine(routine)
+        self.fetchMore(index)
+
     def columnCount(self, index=QModelIndex()):
         return 1
 
@@ -325,12 +461,45 @@ class LookupListModel(QAbstractItemModel):
         if isinstance(index.internalPointer(), Routine):
             return QModelIndex()
         rule = index.internalPointer()
-        # Now go find it
-        for row, routine in enumerate(self.project.fontfeatures.routines):
-            routine.editor = self._parent.parent.editor
-            if rule in routine.rules:
-                return self.createIndex(row, 0, routine)
-        return QModelIndex()
+        entry = self.ruleParents.get(id(rule))
+        if not entry or entry[0] is not rule:
+            return QModelIndex()
+        routine = entry[1]
+        row = self.project.routineRegistry.row(routine)
+        if row is None:
+            return QModelIndex()
+        routine.editor = self._parent.parent.editor
+        return self.createIndex(row, 0, routine)
+
+    def routinesMoved(self):
+        self.project.routineRegistry.invalidate()
+
+    def forget(self):
+        self.ruleParents = {}
+        self.routineRules = {}
+        self.shown = {}
+        self.descriptions = {}
+        self.failed = {}
+
+    def forgetDescription(self, rule):
+        self.descriptions.pop(id(rule), None)
+
+    def rememberParent(self, rule, routine):
+        self.ruleParents[id(rule)] = (rule, routine)
+        self.routineRules.setdefault(id(routine), set()).add(id(rule))
+
+    def forgetRoutine(self, routine):
+        """Lets go of the rules we've handed out indexes for in a routine
+        which has gone, or whose rules have been replaced."""
+        for key in self.routineRules.pop(id(routine), ()):
+            entry = self.ruleParents.get(key)
+            if entry and entry[1] is routine:
+                del self.ruleParents[key]
+                self.descriptions.pop(key, None)
+
+    def routineReplaced(self, old, new):
+        self.project.routineRegistry.invalidate()
+        self.forgetRoutine(old)
 
     def index(self, row, column, index=QModelIndex()):
         """ Returns the index of the item in the model specified by the given row, column and parent index """
@@ -343,7 +512,14 @@ class LookupListModel(QAbstractItemModel):
         else:
             item = index.internalPointer()
             item.editor = self._parent.parent.editor
-            ix = self.createIndex(row, column, item.rules[row])
+            if id(item) in self.computing:
+                rule = self.computing[id(item)][1]
+            elif row < len(item.rules):
+                rule = item.rules[row]
+            else:
+                return QModelIndex()
+            self.rememberParent(rule, item)
+            ix = self.createIndex(row, column, rule)
         return ix
 
     def setData(self, index, value, role=Qt.EditRole):
@@ -357,6 +533,7 @@ class LookupListModel(QAbstractItemModel):
                 self.project.fontfeatures.routines[index.row()].comment = value
             else:
                 self.project.fontfeatures.routines[index.row()].name = value
+            self.project.routineChanged(self.project.fontfeatures.routines[index.row()])
             # self.dataChanged.emit(index, index)
             return True
 
@@ -399,24 +576,45 @@ class LookupListModel(QAbstractItemModel):
                     return f'<i style="color:#aaa">{item.comment or "————"}</i>'
                 else:
                     return (item.name or "")+ self.describeFlags(item)
-            elif hasattr(item, "computed"):
-                return f'<i style="color:#aaa">{item.asFea()}</i>'
-            elif isinstance(item, Attachment):
-                return (
-                    f'Attach {item.mark_name or "Nothing"} to {item.base_name or "Nothing"}'
-                    + self.describeFlags(item)
-                )
-            else:
-                fea = item.asFea() or "<New %s Rule>" % item.__class__.__name__
-                return fea.split("\n")[0]
+            elif isinstance(item, Placeholder):
+                return '<i style="color:#aaa">Computing...</i>'
+            entry = self.descriptions.get(id(item))
+            if not entry or entry[0] is not item:
+                # The view will want the rest of the page next, so describe
+                # that too while we're here
+                parent = self.ruleParents.get(id(item))
+                if not parent or parent[0] is not item:
+                    return None  # Its routine has gone
+                routine = parent[1]
+                if id(routine) in self.computing or self.needsComputing(routine):
+                    # Asking for its rules would work them out here and now
+                    return '<i style="color:#aaa">Computing...</i>'
+                for rule in routine.rules[index.row():index.row() + PAGE]:
+                    self.descriptions[id(rule)] = (rule, self.describeRule(rule))
+                entry = self.descriptions[id(item)]
+            return entry[1]
         return None
 
+    def describeRule(self, item):
+        if hasattr(item, "computed"):
+            return f'<i style="color:#aaa">{item.asFea()}</i>'
+        elif isinstance(item, Attachment):
+            return (
+                f'Attach {item.mark_name or "Nothing"} to {item.base_name or "Nothing"}'
+                + self.describeFlags(item)
+            )
+        else:
+            fea = item.asFea() or "<New %s Rule>" % item.__class__.__name__
+            return fea.split("\n")[0]
+
     def flags(self, index):
         if not index.isValid():
             return Qt.ItemIsDropEnabled
         flag = Qt.ItemFlags(QAbstractItemModel.flags(self, index))
         if self.indexIsRoutine(index):
             return flag | Qt.ItemIsEditable | Qt.ItemIsDragEnabled
+        if isinstance(index.internalPointer(), Placeholder):
+            return flag
         return flag | Qt.ItemIsDragEnabled | Qt.ItemIsDropEnabled
 
     def insertRows(self, position, rows=1, parent=QModelIndex()):
@@ -425,7 +623,9 @@ class LookupListModel(QAbstractItemModel):
         self.beginInsertRows(QModelIndex(), position, position + rows - 1)
 
         self.project.fontfeatures.routines.insert(position,Routine(name="", rules=[]))
+        self.routinesMoved()
         self.endInsertRows()
+        self.project.routinesChanged()
         return True
 
     def appendRow(self):
@@ -434,8 +634,10 @@ class LookupListModel(QAbstractItemModel):
 
     def removeRows(self, row, count, parent):
         self.beginRemoveRows(parent, row, row+1)
-        self.project.fontfeatures.routines.pop(row)
+        self.forgetRoutine(self.project.fontfeatures.routines.pop(row))
+        self.routinesMoved()
         self.endRemoveRows()
+        self.project.routinesChanged()
         return True
 
     def mimeData(self, indexes):
@@ -452,25 +654,47 @@ class LookupListModel(QAbstractItemModel):
         routines = self.project.fontfeatures.routines
         self.beginInsertRows(QModelIndex(), destrow, destrow)
         routines.insert(destrow, routines[rowid])
+        self.routinesMoved()
         self.endInsertRows()
+        # The routine's old row is removed afterwards, which records the move
         return True
 
     def removeRow(self, index):
         """ Remove a row from the model. """
+        self.fetching = True  # No fetching more while the rows change
         self.beginRemoveRows(self.parent(index), index.row(), index.row())
         if self.indexIsRoutine(index):
-            del self.project.fontfeatures.routines[index.row()]
+            self.forgetRoutine(self.project.fontfeatures.routines.pop(index.row()))
+            self.routinesMoved()
+            self.project.routinesChanged()
         else:
             lookup = self.parent(index).internalPointer()
-            del lookup.rules[index.row()]
+            shown = self.rulesShown(lookup)
+            rule = lookup.rules.pop(index.row())
+            self.shown[id(lookup)] = (lookup, shown - 1)
+            self.ruleParents.pop(id(rule), None)
+            self.routineRules.get(id(lookup), set()).discard(id(rule))
+            self.forgetDescription(rule)
+            self.project.routineChanged(lookup)
         self.endRemoveRows()
+        self.fetching = False
         return True
 
     def addRule(self, ix, rule):
         lookup = ix.internalPointer()
-        self.beginInsertRows(ix, ix.row(), ix.row())
-        lookup.rules.append(rule)
-        self.endInsertRows()
+        row = len(lookup.rules)
+        if self.rulesShown(lookup) < row:
+            # It'll turn up when the list gets that far
+            lookup.rules.append(rule)
+        else:
+            self.fetching = True
+            self.beginInsertRows(ix, row, row)
+            lookup.rules.append(rule)
+            self.shown[id(lookup)] = (lookup, row + 1)
+            self.rememberParent(rule, lookup)
+            self.endInsertRows()
+            self.fetching = False
+        self.project.routineChanged(lookup)
         return True
 
 
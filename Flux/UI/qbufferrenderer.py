@@ -3,11 +3,60 @@ from PyQt5.QtGui import QGlyphRun, QPainter, QRawFont, QColor, QTransform, QPain
 from PyQt5.QtWidgets import QWidget, QGraphicsScene, QGraphicsPathItem, QGraphicsView
 import glyphsLib
 import darkdetect
+from collections import OrderedDict
+from Flux.variations import glyphInterpolator
+import numpy as np
 
 inkcolor = (0,0,0)
 if darkdetect.isDark():
     inkcolor = (255,255,255)
 
+class GlyphPathCache:
+    """Decomposed glyph outlines as QPainterPaths, by glyph name and
+    normalized location. Shared by all renderers of a font."""
+    def __init__(self, size=2048):
+        self.size = size
+        self.font = None
+        self.paths = OrderedDict()
+        self.components = {}
+
+    def get(self, font, key):
+        if font is not self.font:
+            # New project or reloaded font
+            self.font = font
+            self.invalidate()
+        path = self.paths.get(key)
+        if path is not None:
+            self.paths.move_to_end(key)
+        return path
+
+    def put(self, key, path, components):
+        self.paths[key] = path
+        self.components[key[0]] = components
+        while len(self.paths) > self.size:
+            self.paths.popitem(last=False)
+
+    def invalidate(self, glyphname=None):
+        """Forgets a glyph, and any glyphs using it as a component; or
+        everything, if no glyph is given."""
+        if glyphname is None:
+            self.paths.clear()
+            self.components.clear()
+            return
+        changed = {glyphname}
+        while True:  # Composites of composites change too
+            users = {g for g, components in self.components.items() if components & changed}
+            if users <= changed:
+                break
+            changed |= users
+        stale = [key for key in self.paths if key[0] in changed]
+        for key in stale:
+            del self.paths[key]
+
+
+pathcache = GlyphPathCache()
+
+
 class QBufferRenderer(QGraphicsView):
     def __init__(self, project, buf=None):
         super(QBufferRenderer, self).__init__()
@@ -43,28 +92,34 @@ class QBufferRenderer(QGraphicsView):
                 xcursor = xcursor + g.position.xAdvance
         self.fitInView(self.scene.sceneRect(), Qt.KeepAspectRatio)
 
-    def getGlyphContours(self, glyphname):
+    def getGlyphContours(self, glyphname, transformation=None):
+        # Contours as lists of segments, each a list of (x, y) points
+        glyph = self.project.font[glyphname]
+        points = None
         if self.location:
-            vf = self.project.variations
-            interpolated_glyph = self.interpolate(glyphname)
-            paths = list(interpolated_glyph.contours)
-        else:
-            paths = list(self.project.font[glyphname].contours)
-        return paths
+            points = glyphInterpolator(self.project.variations).glyphPoints(glyphname, self.location)
+        if points is None or len(points) != sum(len(c.points) for c in glyph.contours):
+            points = np.array([(p.x, p.y) for c in glyph.contours for p in c.points], dtype=float).reshape(-1, 2)
+        if transformation is not None:
+            xx, xy, yx, yy, dx, dy = transformation
+            points = points @ np.array([[xx, xy], [yx, yy]]) + (dx, dy)
+        contours = []
+        start = 0
+        for c in glyph.contours:
+            index = {id(p): start + i for i, p in enumerate(c.points)}
+            contours.append([
+                [tuple(points[index[id(p)]]) for p in seg.points] for seg in c.segments
+            ])
+            start += len(c.points)
+        return contours
 
     def decomposedPaths(self, glyphname, item=None):
         paths = self.getGlyphContours(glyphname)
         for ix, c in enumerate(self.project.font[glyphname].components):
-
-            glyph = c.baseGlyph
-            componentPaths = [x.copy() for x in self.getGlyphContours(glyph)]
+            transformation = c.transformation
             if self.location:
-                transformation = self.interpolate_component_transformation(glyphname, ix)
-            else:
-                transformation = c.transformation
-            for cp in componentPaths:
-                cp.transformBy(transformation)
-                paths.append(cp)
+                transformation = self.interpolate_component_transformation(glyphname, ix, transformation)
+            paths.extend(self.getGlyphContours(c.baseGlyph, transformation))
         return paths
 
     def drawCross(self, scene, x, y, color):
@@ -86,34 +141,23 @@ class QBufferRenderer(QGraphicsView):
         self.location = self.project.variations.normalize(location)
         self.set_scene_from_buf()
 
-    def interpolate(self, glyphname):
-        vf = self.project.variations
-        glyphs = [vf.masters[master][glyphname] for master in vf.master_order]
-        glyph = self.project.font[glyphname]
-        for pid, paths in enumerate(zip(*[g.contours for g in glyphs])):
-            for pointid,points in enumerate(zip(*[p.points for p in paths])):
-                target_point = glyph.contours[pid].points[pointid]
-                pointset = {vf.master_order[i]: (points[i].x,points[i].y) for i in range(len(vf.masters))}
-                (interpolated) = vf.interpolate_tuples(pointset, self.location, normalized=True)
-                target_point.x, target_point.y = interpolated
-        return glyph
-
-    def interpolate_component_transformation(self, glyphname, ix):
-        vf = self.project.variations
-        transformations = {
-            master: vf.masters[master][glyphname].components[ix].transformation
-            for master in vf.master_order
-        }
-        return vf.interpolate_tuples(transformations, self.location, normalized=True)
-
-    def drawGlyph(self, scene, glyph, offsetX=0, offsetY=0, color=(255,255,255)):
+    def interpolate_component_transformation(self, glyphname, ix, default=None):
+        transformations = glyphInterpolator(self.project.variations).componentTransformations(glyphname, self.location)
+        if transformations is None or ix >= len(transformations):
+            return default
+        return transformations[ix]
+
+    def glyphPath(self, glyph):
+        location = tuple(sorted(self.location.items())) if self.location else None
+        key = (glyph, location)
+        path = pathcache.get(self.project.font, key)
+        if path is not None:
+            return path
         path = QPainterPath()
         path.setFillRule(Qt.WindingFill)
-        for c in self.decomposedPaths(glyph):
-            segs = c.segments
-            path.moveTo(segs[-1].points[-1].x, segs[-1].points[-1].y)
-            for seg in segs:
-                tuples = [(a.x, a.y) for a in seg.points]
+        for segs in self.decomposedPaths(glyph):
+            path.moveTo(*segs[-1][-1])
+            for tuples in segs:
                 flattuples = list(sum(tuples,()))
                 if len(tuples) == 2:
                     path.quadTo(*flattuples)
@@ -121,7 +165,12 @@ class QBufferRenderer(QGraphicsView):
                     path.cubicTo(*flattuples)
                 else:
                     path.lineTo(*flattuples)
+        components = set(c.baseGlyph for c in self.project.font[glyph].components)
+        pathcache.put(key, path, components)
+        return path
 
+    def drawGlyph(self, scene, glyph, offsetX=0, offsetY=0, color=(255,255,255)):
+        path = self.glyphPath(glyph)
         line = QGraphicsPathItem()
         line.setBrush( QColor(*color) )
         p = QPen()
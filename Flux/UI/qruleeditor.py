@@ -32,7 +32,7 @@ from fontFeatures import (
 )
 import sys
 import darkdetect
-from Flux.variations import VariationAwareBuffer, VariationAwareBufferItem
+from Flux.variations import VariationAwareBuffer, VariationAwareBufferItem, glyphInterpolator
 from fontFeatures.shaperLib.Buffer import Buffer, BufferItem
 
 
@@ -90,6 +90,7 @@ class QValueRecordEditor(QWidget):
 
         if self.master:
             self.valuerecord.set_value_for_master(self.vf, self.master, ValueRecord(**value))
+            glyphInterpolator(self.vf).forgetValueRecord(self.valuerecord)
         else:
             for attr, val in value.items():
                 setattr(self.valuerecord, attr, val)
@@ -186,6 +187,8 @@ class QRuleEditor(QDialog):
         return
 
     def accept(self):
+        if self.index is not None and self.index.isValid():
+            self.project.routineChanged(self.index.parent().internalPointer())
         self.editor.fontfeaturespanel.lookuplist.update(self.index)
         self.editor.setWindowModified(True)
         self.editor.showDebugger()
@@ -383,12 +386,7 @@ class QRuleEditor(QDialog):
     def lookupCombobox(self, current, warning):
         c = QComboBox()
         c.warning = warning
-        names = [
-            x.name
-            for x in self.project.fontfeatures.routines
-            if not hasattr(x, "comment")
-        ]
-        names = ["--- No lookup ---"] + names
+        names = ["--- No lookup ---"] + self.project.routineRegistry.lookups()
         for name in names:
             c.addItem(name)
         if current in names:
@@ -422,12 +420,7 @@ class QRuleEditor(QDialog):
     def setComboboxWarningIfNeeded(self, combobox):
         # Find routine
         rname = combobox.currentText()
-        warningNeeded = False
-        if rname:
-            routine = None
-            for r in self.project.fontfeatures.routines:
-                if r.name == rname:
-                    routine = r
+        routine = self.project.routineRegistry.named(rname) if rname else None
         if routine and self.changesGlyphstringLength(routine):
             stdicon = self.style().standardIcon(QStyle.SP_MessageBoxWarning)
             combobox.warning.setPixmap(stdicon.pixmap(stdicon.actualSize(QSize(16, 16))))
@@ -16,17 +16,94 @@ from PyQt5.QtWidgets import (
     QCheckBox,
     QWidget,
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThread
 from Flux.ThirdParty.QFlowLayout import QFlowLayout
 from fontFeatures.shaperLib.Shaper import Shaper
-from fontFeatures.shaperLib.BaseShaper import BaseShaper
-from Flux.variations import VariationAwareBuffer, VariationAwareBufferItem
-from copy import copy, deepcopy
+from Flux.variations import VariationAwareBuffer, VariationAwareBufferItem, glyphInterpolator
+from Flux.shapingtrace import ShapingTrace
+from fontFeatures import ValueRecord
 import re
 
+try:
+    from Flux.compiledfontcache import CompiledFontCache
+except ImportError:  # No uharfbuzz
+    CompiledFontCache = None
+
 
 valid_glyph_name_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789._-*:^|~"
 
+
+class FontCompileThread(QThread):
+    def __init__(self, cache, project, parent=None):
+        super(FontCompileThread, self).__init__(parent)
+        self.cache = cache
+        # Naming routines is an edit, so it happens here rather than there
+        project.compiler.nameRoutines()
+        self.fontfeatures = project.frozenFeatures()
+        self.result = None
+
+    def run(self):
+        try:
+            self.result = self.cache.compile(self.fontfeatures)
+        except Exception as e:
+            print(e)
+            self.result = None
+
+
+class ShapingCancelled(Exception):
+    pass
+
+
+def recordMessage(trace, msg, buffer=None, serialize_options=None):
+    """Returns (message, trace step, whether the buffer changed) for a
+    shaper message."""
+    if not buffer:
+        return (msg, None, False)
+    step, changed = trace.record(buffer, serialize_options)
+    return (msg, step, changed)
+
+
+class ShapingThread(QThread):
+    """Shapes one buffer with the Python shaper, collecting the trace as it
+    goes. Bails out as soon as a newer request interrupts it. Works from a
+    copy of the project's features, so that editing can carry on."""
+    def __init__(self, project, buf, features, parent=None):
+        super(ShapingThread, self).__init__(parent)
+        self.font = project.font
+        self.fontfeatures = project.frozenFeatures()
+        self.buf = buf
+        self.features = features
+        self.trace = ShapingTrace()
+        self.messages = []
+        self.result = None
+
+    def message(self, msg, buffer=None, serialize_options=None):
+        if self.isInterruptionRequested():
+            raise ShapingCancelled()
+        if msg.startswith("Before"):
+            return
+        self.messages.append(recordMessage(self.trace, msg, buffer, serialize_options))
+
+    def run(self):
+        try:
+            vf = getattr(self.buf, "vf", None)
+            if vf:
+                interpolator = glyphInterpolator(vf)
+                for routine in self.fontfeatures.routines:
+                    interpolator.resolveRoutine(routine, self.buf.location)
+            shaper = Shaper(
+                self.fontfeatures,
+                self.font,
+                message_function=self.message,
+            )
+            shaper.execute(self.buf, features=self.features)
+            self.result = self.buf
+        except ShapingCancelled:
+            pass
+        except Exception as e:
+            print(e)
+
+
 class QShapingDebugger(QSplitter):
     def __init__(self, editor, project):
         self.editor = editor
@@ -52,6 +129,23 @@ class QShapingDebugger(QSplitter):
         self.firstboxLayout.addWidget(textbox)
         self.firstboxLayout.addWidget(self.featuregroup)
 
+        # Shape with a compiled binary when we can, compiling it in the
+        # background whenever the features change
+        self.fontcache = None
+        self.compiledFont = None
+        self.compileThread = None
+        self.compileAgain = False
+        if CompiledFontCache:
+            self.fontcache = CompiledFontCache(self.project)
+            self.harfbuzzBox = QCheckBox("Shape with HarfBuzz")
+            self.harfbuzzBox.stateChanged.connect(self.shapeText)
+            self.firstboxLayout.addWidget(self.harfbuzzBox)
+
+        # Python shaping happens on a worker thread; while it runs, we only
+        # remember the latest request
+        self.shapeThread = None
+        self.pendingShape = None
+
         # Second box: Variations
         self.secondbox = QWidget()
         self.secondboxLayout = QHBoxLayout()
@@ -110,7 +204,7 @@ class QShapingDebugger(QSplitter):
         self.addWidget(self.thirdbox)
         self.addWidget(self.messageTable)
         self.fullBuffer = None
-        self.lastBuffer = None
+        self.clearTrace()
         self.shapeText()
 
     def clearLayout(self, layout):
@@ -139,6 +233,7 @@ class QShapingDebugger(QSplitter):
             self.featuregrouplayout.addWidget(box)
 
     def update(self):
+        self.compiledFont = None
         self.fillFeatureGroup()
         self.shapeText()
 
@@ -175,30 +270,129 @@ class QShapingDebugger(QSplitter):
 
         buf = self.buildBuffer()
 
-        self.messageTable.setRowCount(0)
         if not self.text:
+            self.cancelShaping()
+            self.clearTrace()
             buf.clear_mask()
             self.qbr.set_buf(buf)
             self.fullBuffer = buf
             self.shaperOutput.setText(buf.serialize())
             return
+        if self.canUseHarfbuzz(buf):
+            if self.compiledFont:
+                self.cancelShaping()
+                self.clearTrace()
+                self.shapeWithHarfbuzz(buf, features)
+                return
+            self.compileInBackground()
+        self.prep_shaper(buf)
+        self.shapeInBackground(buf, features)
+
+    def clearTrace(self):
+        self.messageTable.setRowCount(0)
         self.messageTable.clearSelection()
-        self.lastBuffer = None
+        self.trace = ShapingTrace()
         self.skipped = []
-        self.partialBuffers = {}
-        shaper = Shaper(
-            self.project.fontfeatures,
-            self.project.font,
-            message_function=self.addToTable,
+        self.traceRows = {}
+
+    def cancelShaping(self):
+        self.pendingShape = None
+        if self.shapeThread:
+            self.shapeThread.requestInterruption()
+
+    def shapeInBackground(self, buf, features):
+        self.pendingShape = (buf, features)
+        if self.shapeThread:
+            # Superseded; shapingFinished will pick up the latest request
+            self.shapeThread.requestInterruption()
+            return
+        self.startShaping()
+
+    def startShaping(self):
+        buf, features = self.pendingShape
+        self.pendingShape = None
+        # Qt owns the thread, and deletes it once it has quite finished
+        self.shapeThread = ShapingThread(self.project, buf, features, self)
+        self.shapeThread.finished.connect(self.shapingFinished)
+        self.shapeThread.finished.connect(self.shapeThread.deleteLater)
+        self.shapeThread.start()
+
+    def shapingFinished(self):
+        thread = self.shapeThread
+        self.shapeThread = None
+        if self.pendingShape:
+            self.startShaping()
+            return
+        if thread.isInterruptionRequested() or not thread.result:
+            return
+        self.clearTrace()
+        self.trace = thread.trace
+        for entry in thread.messages:
+            self.addTraceEntry(*entry)
+        self.qbr.set_buf(thread.result)
+        self.fullBuffer = thread.result
+        self.shaperOutput.setText(thread.result.serialize())
+
+    def canUseHarfbuzz(self, buf):
+        # The compiled font is a static instance, and HarfBuzz only
+        # takes text, not glyph names
+        return (
+            self.fontcache and self.harfbuzzBox.isChecked() and not self.sliders
+            and all(item.codepoint for item in buf.items)
         )
-        self.prep_shaper(shaper, buf, features)
-        shaper.execute(buf, features=features)
 
-        self.qbr.set_buf(buf)
-        self.fullBuffer = buf
-        self.shaperOutput.setText(buf.serialize())
+    def compileInBackground(self):
+        if self.compileThread:
+            self.compileAgain = True
+            return
+        self.compileThread = FontCompileThread(self.fontcache, self.project, self)
+        self.compileThread.finished.connect(self.compileFinished)
+        self.compileThread.finished.connect(self.compileThread.deleteLater)
+        self.compileThread.start()
+
+    def compileFinished(self):
+        result = self.compileThread.result
+        self.compileThread = None
+        if self.compileAgain:
+            # The features changed while we were compiling
+            self.compileAgain = False
+            self.compileInBackground()
+            return
+        self.compiledFont = result
+        if result:
+            self.shapeText()
 
-    def prep_shaper(self, shaper, buf, features):
+    def harfbuzzBuffer(self, glyphs, direction, positioned):
+        buf = VariationAwareBuffer(self.project.font)
+        buf.direction = direction
+        for name, cluster, position in glyphs:
+            item = VariationAwareBufferItem.new_glyph(name, self.project.font, buf)
+            if positioned:
+                item.position = ValueRecord(
+                    xPlacement=position[0], yPlacement=position[1], xAdvance=position[2], yAdvance=position[3]
+                )
+            buf.items.append(item)
+        return buf
+
+    def shapeWithHarfbuzz(self, buf, features):
+        compiled = self.compiledFont
+        text = "".join(chr(item.codepoint) for item in buf.items)
+
+        def onchange(vharfbuzz, stage, lookupid, glyphs, feature):
+            msg = "After %s (%s)" % (compiled.routine_name(stage, lookupid), feature or stage)
+            self.addToTable(msg, self.harfbuzzBuffer(glyphs, buf.direction, stage == "GPOS"))
+
+        hbbuf = compiled.vharfbuzz.shape(text, onchange, {f["tag"]: f["value"] for f in features})
+        glyphs = compiled.vharfbuzz._copy_buf(hbbuf)
+        if buf.direction == "RTL":
+            # HarfBuzz hands back visual order; we draw from logical order
+            glyphs = list(reversed(glyphs))
+        result = self.harfbuzzBuffer(glyphs, buf.direction, True)
+        self.qbr.set_buf(result)
+        self.fullBuffer = result
+        self.shaperOutput.setText(result.serialize())
+
+    def prep_shaper(self, buf):
         if not self.sliders:
             return
         buf.vf = self.project.variations
@@ -211,21 +405,17 @@ class QShapingDebugger(QSplitter):
     def addToTable(self, msg, buffer=None, serialize_options=None):
         if msg.startswith("Before"):
             return
-        if not buffer:  # Easy one
+        self.addTraceEntry(*recordMessage(self.trace, msg, buffer, serialize_options))
+
+    def addTraceEntry(self, msg, step, changed):
+        if step is None:  # Easy one
             rowPosition = self.messageTable.rowCount()
             self.messageTable.insertRow(rowPosition)
             message_item = QTableWidgetItem(msg)
             self.messageTable.setItem(rowPosition, 0, message_item)
             return
 
-        # Urgh
-        b = BaseShaper(None, None, buffer)
-        for i in range(0,len(buffer.items)):
-            b.propagate_attachment_offsets(i)
-
-        ser = buffer.serialize(additional=serialize_options)
-
-        if self.lastBuffer == ser:
+        if not changed:
             m = re.match(r"After (\w+ \(\w+\))", msg)
             if m:
                 self.skipped.append(m[1])
@@ -238,14 +428,12 @@ class QShapingDebugger(QSplitter):
             )
             self.messageTable.setItem(rowPosition, 0, message_item)
             self.skipped = []
-        self.lastBuffer = ser
         rowPosition = self.messageTable.rowCount()
         self.messageTable.insertRow(rowPosition)
         message_item = QTableWidgetItem(msg)
         self.messageTable.setItem(rowPosition, 0, message_item)
-        self.partialBuffers[rowPosition] = (copy(buffer), msg)
-        self.partialBuffers[rowPosition][0].items = deepcopy(buffer.items)
-        buffer_item = QTableWidgetItem(ser)
+        self.traceRows[rowPosition] = step
+        buffer_item = QTableWidgetItem(self.trace.serialize(step))
         self.messageTable.setItem(rowPosition, 1, buffer_item)
 
     def renderPartialTrace(self):
@@ -253,8 +441,9 @@ class QShapingDebugger(QSplitter):
         if len(indexes) != 2:
             return
         row = indexes[0].row()
-        if row in self.partialBuffers:
-            buf, msg = self.partialBuffers[row]
+        if row in self.traceRows:
+            buf = self.trace.buffer(self.traceRows[row], self.project.font)
+            msg = self.messageTable.item(row, 0).text()
             self.qbr.set_buf(buf)
             m = re.match(r"After (\w+) \((\w+)\)", msg)
             if m and self.editor:
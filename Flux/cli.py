@@ -0,0 +1,131 @@
+"""Headless batch compilation of Flux projects.
+
+    python3 flux.py build [-o DIR] [-j JOBS] [--fea] [--report FILE] INPUT...
+
+Each input is a ``.fluxml`` project or a font source (``.designspace``,
+``.glyphs``, ``.ufo``...); one compiled font is written per input.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import json
+import os
+import sys
+import time
+
+BUILTIN_PLUGINS = os.path.join(os.path.dirname(__file__), "Plugins")
+
+
+def load_project(filename, pluginpaths, jobs=1):
+    from Flux.project import FluxProject
+    from Flux.computedroutine import ComputedRoutine, load_plugins, materialize
+
+    if filename.endswith(".fluxml"):
+        project = FluxProject(filename)
+    else:
+        project = FluxProject.new(filename)
+    # Plugin modules carry their dialogs too, so only load them if
+    # something is actually going to be computed.
+    if any(isinstance(r, ComputedRoutine) for r in project.fontfeatures.routines):
+        project.plugins = load_plugins(pluginpaths)
+        materialize(project, jobs)
+    return project
+
+
+def build_one(filename, output, pluginpaths, fea=False, jobs=1):
+    report = {"input": filename, "output": output, "error": None}
+    start = time.perf_counter()
+    try:
+        project = load_project(filename, pluginpaths, jobs)
+        loaded = time.perf_counter()
+        report["load"] = loaded - start
+        report["error"] = project.saveOTF(output, fea and os.path.splitext(output)[0] + ".fea")
+        report["compile"] = time.perf_counter() - loaded
+    except Exception as e:
+        report["error"] = str(e)
+    report["total"] = time.perf_counter() - start
+    return report
+
+
+def output_filename(filename, outdir, extension):
+    base = os.path.splitext(os.path.basename(filename.rstrip(os.sep)))[0]
+    return os.path.join(outdir or os.path.dirname(filename), base + "." + extension)
+
+
+def format_report(reports):
+    lines = ["%-40s %8s %8s %8s  %s" % ("input", "load", "compile", "total", "result")]
+    for r in reports:
+        timing = ["%8.2f" % r[k] if k in r else "%8s" % "-" for k in ("load", "compile", "total")]
+        lines.append("%-40s %s  %s" % (
+            os.path.basename(r["input"]), " ".join(timing), r["error"] or r["output"]
+        ))
+    return "\n".join(lines)
+
+
+def build(args):
+    from Flux.computedroutine import poolContext
+
+    parser = argparse.ArgumentParser(prog="flux build", description="Compile Flux projects to binary fonts")
+    parser.add_argument("inputs", nargs="+", metavar="INPUT", help=".fluxml projects or font sources")
+    parser.add_argument("-o", "--output-dir", help="directory for compiled fonts (default: next to each input)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-e", "--extension", default="ttf", help="extension of compiled fonts (default: ttf)")
+    parser.add_argument("--plugins", action="append", default=[], help="additional plugin directory")
+    parser.add_argument("--fea", action="store_true", help="also write each project's features as a .fea file")
+    parser.add_argument("--report", help="also write the timing report to this file as JSON")
+    args = parser.parse_args(args)
+    outputs = [output_filename(f, args.output_dir, args.extension) for f in args.inputs]
+    seen = {}
+    for f, output in zip(args.inputs, outputs):
+        key = os.path.normcase(os.path.abspath(output))
+        if key in seen:
+            parser.error("%s and %s would both be built to %s" % (seen[key], f, output))
+        seen[key] = f
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    pluginpaths = [BUILTIN_PLUGINS] + args.plugins
+
+    start = time.perf_counter()
+    reports = []
+    context = poolContext()
+    if len(args.inputs) < 2 or args.jobs < 2 or context is None:
+        # Build here, leaving the workers for computing routines
+        for f, output in zip(args.inputs, outputs):
+            report = build_one(f, output, pluginpaths, args.fea, args.jobs)
+            reports.append(report)
+            print("%s: %s" % (report["input"], report["error"] or "ok"), file=sys.stderr)
+    else:
+        # Routines are computed within each worker
+        with ProcessPoolExecutor(max_workers=args.jobs, mp_context=context) as pool:
+            futures = [
+                pool.submit(build_one, f, output, pluginpaths, args.fea)
+                for f, output in zip(args.inputs, outputs)
+            ]
+            for future in as_completed(futures):
+                report = future.result()
+                reports.append(report)
+                print("%s: %s" % (report["input"], report["error"] or "ok"), file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    reports.sort(key=lambda r: args.inputs.index(r["input"]))
+    print(format_report(reports))
+    print("Built %i of %i fonts in %.2fs" % (
+        len([r for r in reports if not r["error"]]), len(reports), elapsed
+    ))
+    if args.report:
+        with open(args.report, "w") as out:
+            json.dump({"elapsed": elapsed, "fonts": reports}, out, indent=2)
+    return 1 if any(r["error"] for r in reports) else 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] != "build":
+        print("usage: flux build [-h] INPUT...", file=sys.stderr)
+        return 2
+    return build(argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
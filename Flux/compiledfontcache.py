@@ -0,0 +1,47 @@
+"""Compiled binaries of a project, for shaping with HarfBuzz.
+
+Fonts are kept by a hash of their glyph data and features, so flicking a
+feature back and forth (or undoing an edit) finds the binary it compiled
+before. Needs uharfbuzz.
+"""
+
+from Flux.vharfbuzz import Vharfbuzz
+from collections import OrderedDict
+from io import BytesIO
+
+
+class CompiledFont:
+    def __init__(self, key, vharfbuzz, lookupNames):
+        self.key = key
+        self.vharfbuzz = vharfbuzz
+        self.lookupNames = lookupNames
+
+    def routine_name(self, stage, lookupid):
+        return self.lookupNames.get(stage, {}).get(lookupid, "lookup%i" % lookupid)
+
+
+class CompiledFontCache:
+    def __init__(self, project, size=8):
+        self.project = project
+        self.size = size
+        self.fonts = OrderedDict()
+
+    def compile(self, fontfeatures=None):
+        """Returns a CompiledFont for the project as it is now, compiling it
+        if we haven't seen this version before. To call it from a worker
+        thread, pass the features as the compiler's prepare() describes."""
+        compiler = self.project.compiler
+        with compiler.lock:
+            key = compiler.prepare(fontfeatures)
+            if key in self.fonts:
+                self.fonts.move_to_end(key)
+                return self.fonts[key]
+            ttfont = compiler.build()
+            data = BytesIO()
+            ttfont.save(data)
+            lookupNames = {tag: dict(names) for tag, names in compiler.lookupNames.items()}
+        font = CompiledFont(key, Vharfbuzz(fontdata=data.getvalue(), glyphOrder=ttfont.getGlyphOrder()), lookupNames)
+        self.fonts[key] = font
+        while len(self.fonts) > self.size:
+            self.fonts.popitem(last=False)
+        return font
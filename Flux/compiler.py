@@ -0,0 +1,395 @@
+"""Incremental compilation of a project's layout features.
+
+Exporting a font used to save the whole font, serialize every routine to
+AFDKO syntax and run feaLib over the lot. `FontCompiler` instead caches the
+binary font produced from the font source, and builds each routine's lookups
+directly with otlLib (see `Flux.lookupbuilder`), caching them by a hash of
+everything that goes into them. On each export only routines whose hash has
+changed are built again; the GSUB, GPOS and GDEF tables are then reassembled
+around the cached lookups, and tables whose lookups haven't changed at all
+are reused as they were compiled last time. Feature file output is now only
+written on request, for debugging.
+"""
+
+from Flux.lookupbuilder import RoutineBuilder, collectMarkClasses
+from fontFeatures import RoutineReference
+from fontFeatures.feaLib.Chaining import gensym
+from fontTools.feaLib.builder import Builder
+from fontTools.misc.loggingTools import Timer
+from fontTools.otlLib.maxContextCalc import maxCtxFont
+from fontTools.ttLib import TTFont, newTable
+from fontTools.ttLib.tables import otTables
+from fontTools.ttLib.tables.DefaultTable import DefaultTable
+from io import BytesIO, StringIO
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+log = logging.getLogger(__name__)
+timer = Timer(logger=log)
+
+CATEGORIES = {"base": 1, "ligature": 2, "mark": 3, "component": 4}
+
+# Lookup flags which need shared GDEF state (mark attachment classes and
+# mark filtering sets) that we don't track per routine.
+SHARED_GDEF_FLAGS = 0xFF10
+
+CONTEXTUAL = {"GSUB": (5, 6), "GPOS": (7, 8)}
+
+
+class CompiledRoutine:
+    def __init__(self, fingerprint, table, lookups, references):
+        self.fingerprint = fingerprint
+        self.table = table
+        self.count = len(lookups)
+        # Saving a font can rewrite its lookups (to extension lookups, on
+        # overflow), so we keep ours pickled and hand out fresh copies;
+        # that is also a good deal quicker than deep-copying them.
+        self.data = pickle.dumps(lookups, protocol=pickle.HIGHEST_PROTOCOL)
+        # Lookup indices used in chaining records beyond our own lookups
+        # are calls to other routines; maps them to the routine's name.
+        self.references = references
+
+    def lookups(self):
+        return pickle.loads(self.data)
+
+
+class FontCompiler:
+    def __init__(self, project):
+        self.project = project
+        self.baseKey = None
+        self.baseFont = None
+        self.routines = {}  # fingerprint -> CompiledRoutine
+        self.tables = {}  # tag -> (contents, binary table, max context)
+        self.recompiled = []
+        self.builders = []
+        self.lookupNames = {}  # tag -> {lookup index: routine name}
+        self.fontfeatures = None  # what the last prepare() looked at
+        self.lock = threading.Lock()
+
+    def compile(self, filename, fea=None):
+        with self.lock:
+            if fea:
+                with open(fea, "w") as out:
+                    out.write(self.project.fontfeatures.asFea())
+            self.prepare()
+            self.build(os.path.splitext(filename)[1]).save(filename)
+
+    def nameRoutines(self, ff=None):
+        """Gives unnamed routines the names their lookups need. Renaming
+        the project's routines is an edit, so call this from the thread
+        which edits the project."""
+        own = ff is None
+        if own:
+            ff = self.project.fontfeatures
+        for routine in ff.routines:
+            if not routine.name:
+                routine.name = "ChainedRoutine" + gensym(ff)
+                if own:
+                    self.project.routineChanged(routine)
+
+    def prepare(self, fontfeatures=None):
+        """Works out what needs compiling, and returns a hash of everything
+        that goes into the compiled font. To compile on another thread, pass
+        a copy of the features from the project's frozenFeatures(), having
+        called nameRoutines() first."""
+        ff = self.fontfeatures = self.project.fontfeatures if fontfeatures is None else fontfeatures
+        ff.resolveAllRoutines()
+        # Resolving may have pulled in routines without names
+        self.nameRoutines(fontfeatures)
+        markClasses = collectMarkClasses(ff.routines)
+        self.builders = []
+        routines = self.routinesInUse()
+        # Lookups are found by their routine's name, so names must be unique
+        names = {}
+        for routine in routines:
+            if names.setdefault(routine.name, routine) is not routine:
+                raise ValueError('Lookup "%s" has already been defined' % routine.name)
+        for routine in routines:
+            builder = RoutineBuilder(routine, None, ff.namedClasses, markClasses)
+            fingerprint = hashlib.sha1(builder.fingerprint().encode("utf-8")).hexdigest()
+            self.builders.append((builder, fingerprint))
+        contents = (
+            self.baseFontKey(),
+            [(b.routine.name, b.routine.languages, fingerprint) for b, fingerprint in self.builders],
+            [(k, [self.resolve(r).name for r in v]) for k, v in ff.features.items()],
+            [(g.name, g.category) for g in self.project.font],
+        )
+        return hashlib.sha1(repr(contents).encode("utf-8")).hexdigest()
+
+    def build(self, extension=".ttf"):
+        """Returns a TTFont of the project's font and the features, as
+        found by the last call to prepare()."""
+        ttfont = self.loadBaseFont(extension)
+        self.lookupNames = {}
+        if any((b.routine.flags or 0) & SHARED_GDEF_FLAGS for b, _ in self.builders):
+            log.info("Mark filtering sets in use, doing a full build")
+            self.buildFull(ttfont)
+            return ttfont
+
+        scratch = TTFont()
+        scratch.setGlyphOrder(ttfont.getGlyphOrder())
+        compiled = {}
+        self.recompiled = []
+        with timer("compile routines"):
+            for builder, fingerprint in self.builders:
+                builder.font = scratch
+                compiled[builder.routine.name] = self.compileRoutine(builder, fingerprint)
+        # Forget routines which are no longer part of the project
+        live = set(id(c) for c in compiled.values())
+        self.routines = {k: v for k, v in self.routines.items() if id(v) in live}
+        with timer("assemble layout tables"):
+            self.assemble(ttfont, [b.routine for b, _ in self.builders], compiled)
+        return ttfont
+
+    def buildFull(self, ttfont):
+        featurefile = StringIO(self.fontfeatures.asFea())
+        builder = Builder(ttfont, featurefile)
+        for g in self.project.font:
+            if g.category in CATEGORIES:
+                builder.setGlyphClass_(None, g.name, CATEGORIES[g.category])
+        builder.build()
+
+    # The binary font from the source only changes when the source files
+    # do or a glyph action is applied; nothing else in Flux edits glyphs.
+    def baseFontKey(self):
+        return (
+            tuple((path, _modified(path)) for path in self.project.sourcefiles),
+            tuple(sorted(repr(ga) for ga in self.project.glyphactions.values())),
+        )
+
+    def loadBaseFont(self, extension=".ttf"):
+        key = self.baseFontKey() + (extension,)
+        if key != self.baseKey:
+            with timer("save base font"):
+                fd, filename = tempfile.mkstemp(suffix=extension)
+                os.close(fd)
+                try:
+                    self.project.font.save(filename)
+                    with open(filename, "rb") as f:
+                        self.baseFont = f.read()
+                finally:
+                    os.remove(filename)
+            self.baseKey = key
+        return TTFont(BytesIO(self.baseFont))
+
+    def resolve(self, reference):
+        if not isinstance(reference, RoutineReference):
+            return reference
+        if not reference.routine:
+            reference.resolve(self.fontfeatures)
+        return reference.routine
+
+    def routinesInUse(self):
+        # Every routine with rules gets a lookup, as with feaLib
+        return [r for r in self.fontfeatures.routines if r.rules]
+
+    def compileRoutine(self, builder, fingerprint):
+        if fingerprint in self.routines:
+            return self.routines[fingerprint]
+        log.debug("Compiling routine %s", builder.routine.name)
+        self.recompiled.append(builder.routine.name)
+        table, lookups, references = builder.build()
+        compiled = CompiledRoutine(fingerprint, table, lookups, {ix: r.name for ix, r in references.items()})
+        self.routines[fingerprint] = compiled
+        return compiled
+
+    def assemble(self, ttfont, routines, compiled):
+        maxContext = 0
+        for tag in ("GSUB", "GPOS"):
+            members = [(r, compiled[r.name]) for r in routines if compiled[r.name].table == tag]
+            start, count = {}, 0
+            self.lookupNames[tag] = {}
+            for routine, c in members:
+                start[routine.name] = count
+                for ix in range(count, count + c.count):
+                    self.lookupNames[tag][ix] = routine.name
+                count += c.count
+            featurelookups = self.featureLookups(tag, compiled, start)
+            key = (
+                [(routine.name, c.fingerprint) for routine, c in members],
+                sorted((k, sorted(v.items())) for k, v in featurelookups.items()),
+            )
+            if tag not in self.tables or self.tables[tag][0] != key:
+                with timer("build %s" % tag):
+                    self.tables[tag] = (key,) + self.buildTable(ttfont, tag, members, start, featurelookups)
+            _, data, tableMaxContext = self.tables[tag]
+            maxContext = max(maxContext, tableMaxContext)
+            if data:
+                # Already compiled, so hand the font the binary table
+                ttfont[tag] = DefaultTable(tag)
+                ttfont[tag].data = data
+            elif tag in ttfont:
+                del ttfont[tag]
+        if "OS/2" in ttfont:
+            ttfont["OS/2"].usMaxContext = maxContext
+
+        gdef = self.buildGDEF()
+        if gdef:
+            ttfont["GDEF"] = gdef
+        elif "GDEF" in ttfont:
+            del ttfont["GDEF"]
+
+    def buildTable(self, ttfont, tag, members, start, featurelookups):
+        lookups = []
+        for routine, c in members:
+            here = start[routine.name]
+
+            def relocate(ix):
+                if ix in c.references:
+                    return start[c.references[ix]]
+                return here + ix
+
+            for lookup in c.lookups():
+                if lookup.LookupType in CONTEXTUAL[tag]:
+                    _relocateLookupRecords(lookup, relocate)
+                lookups.append(lookup)
+        table = buildLayoutTable(tag, lookups, featurelookups)
+        if not (table.LookupList.LookupCount or table.FeatureList.FeatureCount):
+            return None, 0
+        result = newTable(tag)
+        result.table = table
+        maxContext = maxCtxFont({tag: result})
+        # Overflow resolution looks the table up in the font
+        ttfont[tag] = result
+        return result.compile(ttfont), maxContext
+
+    def featureLookups(self, tag, compiled, start):
+        """Returns {(script, language): {feature: [lookup indices]}}"""
+        features = []
+        for feature, references in self.fontfeatures.features.items():
+            for reference in references:
+                routine = self.resolve(reference)
+                c = compiled.get(routine.name)
+                if c and c.table == tag:
+                    features.append((feature, routine, start[routine.name]))
+
+        languagesystems = set()
+        for _, routine, _ in features:
+            languagesystems |= set(_languages(routine))
+        languagesystems = languagesystems or set([("DFLT", "dflt")])
+
+        result = {}
+        for feature, routine, index in features:
+            for langsys in _languages(routine) or languagesystems:
+                result.setdefault(langsys, {}).setdefault(feature, []).append(index)
+        return result
+
+    def buildGDEF(self):
+        classes = {}
+        for glyph, category in self.fontfeatures.glyphclasses.items():
+            if category in CATEGORIES:
+                classes[glyph] = CATEGORIES[category]
+        for g in self.project.font:
+            if g.category in CATEGORIES:
+                classes[g.name] = CATEGORIES[g.category]
+        if not classes:
+            return None
+        gdef = otTables.GDEF()
+        gdef.Version = 0x00010000
+        gdef.GlyphClassDef = otTables.GlyphClassDef()
+        gdef.GlyphClassDef.classDefs = classes
+        gdef.AttachList = None
+        gdef.LigCaretList = None
+        gdef.MarkAttachClassDef = None
+        result = newTable("GDEF")
+        result.table = gdef
+        return result
+
+
+def _modified(path):
+    """Returns when a source was last changed. A UFO is a directory whose
+    own mtime doesn't change when a glyph is edited, so look inside."""
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    latest = os.path.getmtime(path)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+    return latest
+
+
+def _languages(routine):
+    languages = []
+    for script, language in routine.languages or []:
+        if language == "*":
+            language = "dflt"
+        languages.append((script.ljust(4), language.ljust(4)))
+    return languages
+
+
+def _relocateLookupRecords(table, relocate):
+    """Rewrite the lookup indices of every (Subst|Pos)LookupRecord
+    found in this lookup's subtables."""
+    for name, value in vars(table).items():
+        if name in ("SubstLookupRecord", "PosLookupRecord"):
+            for record in value:
+                record.LookupListIndex = relocate(record.LookupListIndex)
+        elif isinstance(value, otTables.BaseTable):
+            _relocateLookupRecords(value, relocate)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, otTables.BaseTable):
+                    _relocateLookupRecords(item, relocate)
+
+
+def buildLayoutTable(tag, lookups, featurelookups):
+    table = getattr(otTables, tag)()
+    table.Version = 0x00010000
+    table.LookupList = otTables.LookupList()
+    table.LookupList.Lookup = lookups
+    table.LookupList.LookupCount = len(lookups)
+
+    # Feature records are sorted by tag, and shared between language
+    # systems which use the same lookups for them.
+    keys = set()
+    for features in featurelookups.values():
+        for feature, indices in features.items():
+            keys.add((feature, tuple(indices)))
+    featureIndices = {}
+    table.FeatureList = otTables.FeatureList()
+    table.FeatureList.FeatureRecord = []
+    for feature, indices in sorted(keys):
+        frec = otTables.FeatureRecord()
+        frec.FeatureTag = feature
+        frec.Feature = otTables.Feature()
+        frec.Feature.FeatureParams = None
+        frec.Feature.LookupListIndex = list(indices)
+        frec.Feature.LookupCount = len(indices)
+        featureIndices[(feature, indices)] = len(table.FeatureList.FeatureRecord)
+        table.FeatureList.FeatureRecord.append(frec)
+    table.FeatureList.FeatureCount = len(table.FeatureList.FeatureRecord)
+
+    scripts = {}
+    for (script, language), features in featurelookups.items():
+        scripts.setdefault(script, {})[language] = sorted(
+            featureIndices[(feature, tuple(indices))] for feature, indices in features.items()
+        )
+    table.ScriptList = otTables.ScriptList()
+    table.ScriptList.ScriptRecord = []
+    for script, languages in sorted(scripts.items()):
+        srec = otTables.ScriptRecord()
+        srec.ScriptTag = script
+        srec.Script = otTables.Script()
+        srec.Script.DefaultLangSys = None
+        srec.Script.LangSysRecord = []
+        for language, indices in sorted(languages.items()):
+            langsys = otTables.LangSys()
+            langsys.LookupOrder = None
+            langsys.ReqFeatureIndex = 0xFFFF
+            langsys.FeatureIndex = indices
+            langsys.FeatureCount = len(indices)
+            if language == "dflt":
+                srec.Script.DefaultLangSys = langsys
+            else:
+                langrec = otTables.LangSysRecord()
+                langrec.LangSysTag = language
+                langrec.LangSys = langsys
+                srec.Script.LangSysRecord.append(langrec)
+        srec.Script.LangSysCount = len(srec.Script.LangSysRecord)
+        table.ScriptList.ScriptRecord.append(srec)
+    table.ScriptList.ScriptCount = len(table.ScriptList.ScriptRecord)
+    return table
@@ -1,12 +1,134 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from fontFeatures import Routine
 from lxml import etree
+import multiprocessing
+import os
+import pkgutil
+import sys
+
+
+def load_plugins(paths):
+    plugins = {}
+    for loader, module_name, is_pkg in pkgutil.iter_modules(paths):
+        if is_pkg:
+            continue
+        _module = loader.find_module(module_name).load_module(module_name)
+        _module.module_name = module_name
+        plugins[module_name] = _module
+    return plugins
+
+
+class Dependencies:
+    """What a plugin looked at while computing a routine's rules."""
+    def __init__(self, routine):
+        self.font = routine.project.font
+        self.parameters = dict(routine.parameters)
+        self.glyphs = set()
+        self.allGlyphs = False
+        self.classes = set()
+        self.allClasses = False
+
+    def uses_glyph(self, glyphname):
+        return self.allGlyphs or glyphname in self.glyphs
+
+    def uses_class(self, classname):
+        return self.allClasses or classname in self.classes
+
+
+class RecordingFont:
+    def __init__(self, font, deps):
+        self._font = font
+        self._deps = deps
+
+    def __getitem__(self, glyphname):
+        self._deps.glyphs.add(glyphname)
+        return self._font[glyphname]
+
+    def __contains__(self, glyphname):
+        self._deps.glyphs.add(glyphname)
+        return glyphname in self._font
+
+    def keys(self):
+        self._deps.allGlyphs = True
+        return self._font.keys()
+
+    def __iter__(self):
+        self._deps.allGlyphs = True
+        return iter(self._font)
+
+    def __getattr__(self, attr):
+        return getattr(self._font, attr)
+
+
+class RecordingClasses:
+    def __init__(self, classes, deps):
+        self._classes = classes
+        self._deps = deps
+
+    def __getitem__(self, classname):
+        self._deps.classes.add(classname)
+        return self._classes[classname]
+
+    def __contains__(self, classname):
+        self._deps.classes.add(classname)
+        return classname in self._classes
+
+    def get(self, classname, default=None):
+        self._deps.classes.add(classname)
+        return self._classes.get(classname, default)
+
+    def keys(self):
+        self._deps.allClasses = True
+        return self._classes.keys()
+
+    def items(self):
+        self._deps.allClasses = True
+        return self._classes.items()
+
+    def __iter__(self):
+        self._deps.allClasses = True
+        return iter(self._classes)
+
+    def __getattr__(self, attr):
+        return getattr(self._classes, attr)
+
+
+class RecordingFontFeatures:
+    def __init__(self, fontfeatures, deps):
+        self._fontfeatures = fontfeatures
+        self.namedClasses = RecordingClasses(fontfeatures.namedClasses, deps)
+
+    def __getattr__(self, attr):
+        return getattr(self._fontfeatures, attr)
+
+
+class RecordingProject:
+    def __init__(self, project, deps):
+        self._project = project
+        self.font = RecordingFont(project.font, deps)
+        self.fontfeatures = RecordingFontFeatures(project.fontfeatures, deps)
+
+    def __getattr__(self, attr):
+        return getattr(self._project, attr)
+
+
+class RecordingRoutine:
+    """What a plugin sees of the routine it is computing: the routine
+    itself, except that reads from the project are noted down."""
+    def __init__(self, routine, deps):
+        self._routine = routine
+        self.project = RecordingProject(routine.project, deps)
+
+    def __getattr__(self, attr):
+        return getattr(self._routine, attr)
 
 
 class ComputedRoutine(Routine):
     def __init__(self,  **kwargs):
         self.parameters = {}
         self.plugin = ""
-        self._rules = []
+        self._rules = None
+        self.dependencies = None
         if "parameters" in kwargs:
             self.parameters = kwargs["parameters"]
             del kwargs["parameters"]
@@ -16,25 +138,56 @@ class ComputedRoutine(Routine):
     def okay(self):
         if hasattr(self, "module"):
             return True
-        assert self.project.editor
-        return self.plugin in self.project.editor.plugins
+        return self.plugin in self.project.plugins
+
+    @property
+    def stale(self):
+        deps = self.dependencies
+        return (
+            self._rules is None
+            or deps.font is not self.project.font
+            or deps.parameters != self.parameters
+        )
 
     @property
     def rules(self):
-        if not self._rules:
+        if self.stale:
             assert self.project
             if not self.okay:
                 return []
             if not hasattr(self, "module"):
-                mod = self.project.editor.plugins[self.plugin]
+                mod = self.project.plugins[self.plugin]
             else:
                 mod = self.module
-            rules = mod.rulesFromComputedRoutine(self)
+            deps = Dependencies(self)
+            rules = mod.rulesFromComputedRoutine(RecordingRoutine(self, deps))
             for r in rules:
                 r.computed = True
             self._rules = rules
+            self.dependencies = deps
         return self._rules
 
+    def invalidate(self):
+        self._rules = None
+
+    def install(self, rules, dependencies):
+        """Takes rules computed elsewhere, unless the routine has been
+        changed in the meantime."""
+        if dependencies.parameters != self.parameters:
+            return False
+        dependencies.font = self.project.font
+        self._rules = rules
+        self.dependencies = dependencies
+        return True
+
+    def glyphChanged(self, glyphname):
+        if self.dependencies and self.dependencies.uses_glyph(glyphname):
+            self.invalidate()
+
+    def classChanged(self, classname):
+        if self.dependencies and self.dependencies.uses_class(classname):
+            self.invalidate()
+
     @rules.setter
     def rules(self, value):
         pass
@@ -80,3 +233,133 @@ class ComputedRoutine(Routine):
         for p in el:
             routine.parameters[p.attrib["key"]] = p.attrib["value"]
         return routine
+
+
+class NeedsProject(Exception):
+    pass
+
+
+class SnapshotFont:
+    """The glyph names of a font, which is all most plugins look at."""
+    def __init__(self, glyphnames):
+        self.glyphnames = dict.fromkeys(glyphnames)
+
+    def keys(self):
+        return self.glyphnames.keys()
+
+    def __contains__(self, glyphname):
+        return glyphname in self.glyphnames
+
+    def __len__(self):
+        return len(self.glyphnames)
+
+    def __getitem__(self, glyphname):
+        raise NeedsProject(glyphname)
+
+    def __iter__(self):
+        raise NeedsProject()
+
+
+class SnapshotFontFeatures:
+    def __init__(self, namedClasses):
+        self.namedClasses = namedClasses
+
+
+class ProjectSnapshot:
+    """As much of a project as we send to worker processes. A plugin which
+    wants anything else fails there and is run again at home."""
+    def __init__(self, glyphnames, namedClasses, plugins):
+        self.font = SnapshotFont(glyphnames)
+        self.fontfeatures = SnapshotFontFeatures(namedClasses)
+        self.plugins = plugins
+
+
+_snapshot = None
+
+
+def _init_worker(pluginpaths, glyphnames, namedClasses):
+    global _snapshot
+    _snapshot = ProjectSnapshot(glyphnames, namedClasses, load_plugins(pluginpaths))
+
+
+def computeWith(snapshot, plugin, name, flags, parameters, module=None):
+    """Computes a routine's rules from a ProjectSnapshot, returning the
+    (rules, dependencies) to install() in the real routine, or None if the
+    plugin wanted more than the snapshot has."""
+    routine = ComputedRoutine(name=name, flags=flags, parameters=parameters)
+    routine.plugin = plugin
+    if module:
+        routine.module = module
+    routine.project = snapshot
+    try:
+        if not routine.okay:
+            return None
+        rules = routine.rules
+    except Exception:
+        return None
+    routine.dependencies.font = None
+    return rules, routine.dependencies
+
+
+def _compute(plugin, name, flags, parameters):
+    return computeWith(_snapshot, plugin, name, flags, parameters)
+
+
+def pending(project):
+    """Returns the computed routines whose rules need computing."""
+    return [
+        r for r in project.fontfeatures.routines
+        if isinstance(r, ComputedRoutine) and r.okay and r.stale
+    ]
+
+
+def poolContext():
+    """Returns the multiprocessing context to start worker processes with,
+    or None if work should stay in this process: frozen apps can't be
+    relied on to start a copy of themselves, and a worker starting a pool
+    of its own would multiply the processes."""
+    if getattr(sys, "frozen", False) or multiprocessing.parent_process() is not None:
+        return None
+    # Not fork: the GUI starts pools from a QThread
+    return multiprocessing.get_context("spawn")
+
+
+def materialize(project, jobs=None, progress=None):
+    """Computes the rules of all computed routines which need it, several
+    at a time in a pool of processes. If given, progress is called with
+    (done, total) as each routine finishes."""
+    todo = pending(project)
+    total = len(todo)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    context = poolContext()
+    if total < 2 or jobs < 2 or context is None:
+        for done, routine in enumerate(todo, 1):
+            routine.rules
+            if progress:
+                progress(done, total)
+        return
+
+    pluginpaths = []
+    for module in project.plugins.values():
+        path = os.path.dirname(module.__file__)
+        if path not in pluginpaths:
+            pluginpaths.append(path)
+    initargs = (pluginpaths, list(project.font.keys()), dict(project.fontfeatures.namedClasses))
+    with ProcessPoolExecutor(max_workers=min(jobs, total), mp_context=context,
+                             initializer=_init_worker, initargs=initargs) as pool:
+        futures = {
+            pool.submit(_compute, r.plugin, r.name, r.flags, dict(r.parameters)): r
+            for r in todo
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            routine = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(e)
+                result = None
+            if not result or not routine.install(*result):
+                routine.rules
+            if progress:
+                progress(done, total)
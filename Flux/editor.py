@@ -9,20 +9,39 @@ from PyQt5.QtWidgets import (
     QAction,
     QFileDialog,
     QSplitter,
-    QMessageBox
+    QMessageBox,
+    QProgressDialog
 )
-from PyQt5.QtCore import Qt, QSettings, QStandardPaths
+from PyQt5.QtCore import Qt, QSettings, QStandardPaths, QThread, QEventLoop, QTimer, pyqtSignal
 from Flux.UI.qfontfeatures import QFontFeaturesPanel
 from Flux.UI.qshapingdebugger import QShapingDebugger
 from Flux.UI.qruleeditor import QRuleEditor
 from Flux.UI.qattachmenteditor import QAttachmentEditor
 from Flux.project import FluxProject
+from Flux.computedroutine import load_plugins, materialize, pending
+from Flux.journal import Journal
 from Flux.ThirdParty.qtoaster import QToaster
 import Flux.Plugins
-import os.path, pkgutil, sys
+import os.path, sys
 from functools import partial
 from Flux.UI.GlyphActions import QGlyphActionPicker
 
+AUTOSAVE_INTERVAL = 5 * 60 * 1000  # ms
+
+
+class MaterializeThread(QThread):
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, project):
+        super(MaterializeThread, self).__init__()
+        self.project = project
+
+    def run(self):
+        try:
+            materialize(self.project, progress=self.progress.emit)
+        except Exception as e:
+            print(e)
+
 
 class FluxEditor(QSplitter):
     def __init__(self, proj):
@@ -33,11 +52,17 @@ class FluxEditor(QSplitter):
             self.restoreGeometry(geometry)
 
         self.mainMenu = QMenuBar(self)
+        self.loadPlugins()
         self.project = proj
-        if not proj:
+        if proj:
+            self.useProject(proj)
+        else:
             self.openFluxOrFont() # Exits if there still isn't one
-        self.project.editor = self
-        self.loadPlugins()
+        self.journal = None
+        self.startJournal()
+        self.autosaveTimer = QTimer(self)
+        self.autosaveTimer.timeout.connect(self.autosave)
+        self.autosaveTimer.start(AUTOSAVE_INTERVAL)
         self.setWindowTitle("Flux - %s" % (self.project.filename or self.project.fontfile))
         self.setupFileMenu()
         self.setupEditMenu()
@@ -76,15 +101,62 @@ class FluxEditor(QSplitter):
         if hasattr(sys, "frozen"):
             pluginpath = "lib/python3.8/flux/Plugins"
         pluginpath2 = os.path.join(QStandardPaths.standardLocations(QStandardPaths.AppDataLocation)[0], "Plugins")
-        plugin_loaders = pkgutil.iter_modules([pluginpath, pluginpath2])
-        self.plugins = {}
-        for loader, module_name, is_pkg in plugin_loaders:
-            if is_pkg:
-                continue
-            _module = loader.find_module(module_name).load_module(module_name)
-            _module.module_name = module_name
-            self.plugins[module_name] = _module
+        self.plugins = load_plugins([pluginpath, pluginpath2])
 
+    def useProject(self, project):
+        """Makes this the project being edited, ready for the editor."""
+        self.project = project
+        self.project.editor = self
+        self.project.plugins = self.plugins
+        self.materializeComputedRoutines()
+
+    def materializeComputedRoutines(self):
+        # Compute all the computed routines up front, in parallel, rather
+        # than one by one as the lookup list asks for them
+        if not pending(self.project):
+            return
+        dialog = QProgressDialog("Computing routines...", None, 0, 0, self)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(500)
+        thread = MaterializeThread(self.project)
+
+        def progress(done, total):
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+
+        thread.progress.connect(progress)
+        loop = QEventLoop()
+        thread.finished.connect(loop.quit)
+        thread.start()
+        loop.exec_()
+        dialog.close()
+
+    def startJournal(self):
+        # Keep a journal of edits so they can be recovered after a crash
+        if self.journal:
+            self.journal.close()
+        self.journal = self.project.journal = None
+        if not self.project.filename:
+            return
+        journal = Journal(self.project)
+        recovered = False
+        if journal.hasEntries():
+            reply = QMessageBox.question(self, "Flux",
+                "Flux didn't shut down properly while editing this project. Recover the changes which weren't saved?",
+                QMessageBox.Yes, QMessageBox.No)
+            if reply == QMessageBox.Yes:
+                recovered = journal.replay()
+        journal.start(keep=recovered)
+        self.journal = self.project.journal = journal
+        if recovered:
+            self.setWindowModified(True)
+
+    def autosave(self):
+        # Fold the journal into the project file every so often
+        if self.journal and self.journal.dirty:
+            self.project.save(self.project.filename, snapshot=True)
+            self.journal.saved()
+            self.setWindowModified(False)
 
     def setupFileMenu(self):
         openFile = QAction("&New Project", self)
@@ -156,7 +228,8 @@ class FluxEditor(QSplitter):
         )
         if not glyphs:
             return
-        self.project = FluxProject.new(glyphs[0], editor=self)
+        self.useProject(FluxProject.new(glyphs[0], editor=self))
+        self.startJournal()
         self.setWindowTitle("Flux - %s" % (self.project.filename or self.project.fontfile))
         self.rebuild_ui()
 
@@ -177,9 +250,9 @@ class FluxEditor(QSplitter):
                 sys.exit(0)
             return
         if filename[0].endswith(".fluxml"):
-            self.project = FluxProject(filename[0], editor=self)
+            self.useProject(FluxProject(filename[0], editor=self))
         else:
-            self.project = FluxProject.new(filename[0], editor=self)
+            self.useProject(FluxProject.new(filename[0], editor=self))
         self.setWindowTitle("Flux - %s" % (self.project.filename or self.project.fontfile))
 
     def file_save_as(self):
@@ -188,7 +261,11 @@ class FluxEditor(QSplitter):
         )
         if filename and filename[0]:
             self.project.filename = filename[0]
-            self.project.save(filename[0])
+            self.project.save(filename[0], snapshot=True)
+            if self.journal:
+                self.journal.saved()
+            else:
+                self.startJournal()
             QToaster.showMessage(self, "Saved successfully", desktop=True)
             self.setWindowTitle("Flux - %s" % (self.project.filename or "New Project"))
             self.saveFile.setEnabled(True)
@@ -197,7 +274,11 @@ class FluxEditor(QSplitter):
     def file_save(self):
         if not self.project.filename:
             return self.file_save_as()
-        self.project.save(self.project.filename)
+        self.project.save(self.project.filename, snapshot=True)
+        if self.journal:
+            self.journal.saved()
+        else:
+            self.startJournal()
         QToaster.showMessage(self, "Saved successfully", desktop=True)
         self.setWindowModified(False)
 
@@ -264,6 +345,7 @@ class FluxEditor(QSplitter):
         geometry = self.saveGeometry()
         self.settings.setValue('mainwindowgeometry', geometry)
         if not self.isWindowModified():
+            self.closeJournal()
             event.accept()
             return
         quit_msg = "You have unsaved changes. Are you sure you want to exit the program?"
@@ -271,10 +353,17 @@ class FluxEditor(QSplitter):
                          quit_msg, QMessageBox.Yes, QMessageBox.No)
 
         if reply == QMessageBox.Yes:
+            self.closeJournal()
             event.accept()
         else:
             event.ignore()
 
+    def closeJournal(self):
+        # A clean exit, so nothing to recover next time
+        if self.journal:
+            self.journal.close(remove=True)
+            self.journal = self.project.journal = None
+
     def showError(self, message):
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Critical)
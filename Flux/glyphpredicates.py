@@ -0,0 +1,193 @@
+import re
+from bisect import bisect_left
+from Flux.metricscache import MetricsCache, glyphHash
+import numpy as np
+
+
+class GlyphIndex:
+    """Glyph names and metrics of a font, indexed for the class predicates.
+
+    Names are kept sorted, forwards and backwards, so that prefix and
+    suffix searches are a pair of binary searches. Each metric is a NumPy
+    column with its sort order, so comparisons are binary searches too.
+    Results are boolean arrays over the font's glyph order."""
+    def __init__(self, font, cache=None):
+        self.font = font
+        self.cache = cache or MetricsCache()
+        self.metrics = {}
+        self.hashes = {}
+        self.reindex()
+
+    def reindex(self):
+        self.glyphs = list(self.font.keys())
+        self.position = {g: i for i, g in enumerate(self.glyphs)}
+        self.byName = sorted(self.glyphs)
+        self.byReversedName = sorted(g[::-1] for g in self.glyphs)
+        self.columns = {}
+        self.users = None
+
+    def componentUsers(self):
+        """Returns {glyph: glyphs which use it as a component}."""
+        if self.users is None:
+            self.users = {}
+            for g in self.glyphs:
+                for c in self.font[g].components:
+                    self.users.setdefault(c.baseGlyph, set()).add(g)
+        return self.users
+
+    def forget(self, glyphname):
+        """Call when a glyph has been added or changed."""
+        users = self.componentUsers()
+        todo = [glyphname]
+        seen = set()
+        while todo:  # Composites change with their components
+            g = todo.pop()
+            if g in seen:
+                continue
+            seen.add(g)
+            self.metrics.pop(g, None)
+            self.hashes.pop(g, None)
+            todo.extend(users.get(g, ()))
+        if glyphname in self.position:
+            self.columns = {}
+            self.users = None  # Its components may have changed
+        else:
+            self.reindex()
+
+    def save(self, filename=None):
+        """Saves the metrics cache, dropping the metrics of outlines
+        which are no longer in the font."""
+        self.cache.save(filename, set(glyphHash(self.font, g, self.hashes) for g in self.font.keys()))
+
+    def empty(self):
+        return np.zeros(len(self.glyphs), dtype=bool)
+
+    def everything(self):
+        return np.ones(len(self.glyphs), dtype=bool)
+
+    def toNames(self, bits):
+        return [self.glyphs[i] for i in np.flatnonzero(bits)]
+
+    def _prefixRange(self, names, prefix):
+        # Everything starting with prefix sorts between prefix and prefix+U+10FFFF
+        return names[bisect_left(names, prefix):bisect_left(names, prefix + "\U0010ffff")]
+
+    def beginning(self, prefix):
+        bits = self.empty()
+        bits[[self.position[g] for g in self._prefixRange(self.byName, prefix)]] = True
+        return bits
+
+    def ending(self, suffix):
+        bits = self.empty()
+        bits[[self.position[g[::-1]] for g in self._prefixRange(self.byReversedName, suffix[::-1])]] = True
+        return bits
+
+    def matching(self, regex):
+        bits = self.empty()
+        regex = re.compile(regex)
+        bits[[i for i, g in enumerate(self.glyphs) if regex.search(g)]] = True
+        return bits
+
+    def glyphMetrics(self, glyphname):
+        if glyphname not in self.metrics:
+            self.metrics[glyphname] = self.cache.metrics(self.font, glyphname, self.hashes)
+        return self.metrics[glyphname]
+
+    def column(self, metric):
+        if metric not in self.columns:
+            values = np.array([self.glyphMetrics(g)[metric] for g in self.glyphs], dtype=float)
+            order = np.argsort(values, kind="stable")
+            order = order[~np.isnan(values[order])]  # Glyphs without this metric match nothing
+            self.columns[metric] = (values[order], order)
+        return self.columns[metric]
+
+    def compare(self, metric, comparator, value):
+        values, order = self.column(metric)
+        lower = np.searchsorted(values, value, side="left")
+        upper = np.searchsorted(values, value, side="right")
+        selected = {
+            "<": order[:lower],
+            "<=": order[:upper],
+            "=": order[lower:upper],
+            ">=": order[lower:],
+            ">": order[upper:],
+        }.get(comparator, order[:0])
+        bits = self.empty()
+        bits[selected] = True
+        return bits
+
+
+class GlyphClassPredicate:
+    def __init__(self, predicate_dict = {}):
+        self.comparator = None
+        self.combiner = None
+        self.value = None
+        self.metric = None
+        if "type" in predicate_dict:
+          self.type = predicate_dict["type"]
+        if "comparator" in predicate_dict:
+            self.comparator = predicate_dict["comparator"]
+        if "value" in predicate_dict:
+            self.value = predicate_dict["value"]
+        if "metric" in predicate_dict: # Metric, really
+            self.metric = predicate_dict["metric"]
+        if "combiner" in predicate_dict:
+            self.combiner = predicate_dict["combiner"]
+
+    def test(self, index):
+        """Returns the glyphs matching this predicate, as a boolean array
+        over the index's glyphs."""
+        matches = index.empty()
+        if self.type == "Name":
+          # print(self.comparator, self.value)
+          if self.comparator == "begins":
+            matches = index.beginning(self.value)
+          elif self.comparator == "ends":
+            matches = index.ending(self.value)
+          elif self.comparator == "matches":
+            try:
+                matches = index.matching(self.value)
+            except Exception as e:
+                matches = index.empty()
+
+        # XXX HasAnchor
+        # XXX Is member of
+        # XXX Is Category
+
+        if self.metric:
+          try:
+            matches = index.compare(self.type, self.comparator, int(self.value))
+          except Exception as e:
+            print(e)
+            matches = index.empty()
+
+        return matches
+
+    def to_dict(self):
+        d = { "type": self.type }
+        if self.comparator:
+          d["comparator"] = self.comparator
+        if self.combiner:
+          d["combiner"] = self.combiner
+        if self.value is not None:
+          d["value"] = self.value
+        if self.metric:
+          d["metric"] = self.metric
+        return d
+
+class GlyphClassPredicateTester:
+    def __init__(self, project):
+        self.project = project
+        self.index = project.getGlyphIndex()
+
+    def test_all(self, predicates):
+        if len(predicates) == 0:
+          return list(self.index.glyphs)
+        matches = predicates[0].test(self.index)
+        for p in predicates[1:]:
+          if p.combiner == "and":
+            # Narrow down existing set
+            matches = matches & p.test(self.index)
+          else:
+            matches = matches | p.test(self.index)
+        return self.index.toNames(matches)
@@ -0,0 +1,257 @@
+"""An append-only log of edits to a project, kept next to the .fluxml.
+
+Each edit is written as the new state of whatever changed: a routine, the
+order of the routines and features, a glyph class or a glyph action.
+Routines are identified by a number, which starts as their position in the
+project as it was last saved. Writing happens on a background thread, and
+the journal is emptied whenever the project is saved. If Flux doesn't get
+as far as that, the journal is replayed over the saved project the next
+time it is opened. An edit which can't be written (say, a plugin's own
+objects in a routine) stops the journal where it is until the next save.
+"""
+
+from fontFeatures import Routine, RoutineReference
+from Flux.computedroutine import ComputedRoutine
+from Flux.glyphactions import GlyphAction
+from Flux.snapshot import encodeRoutine, decodeRoutine
+import marshal
+import os
+import queue
+import struct
+import threading
+
+LENGTH = struct.Struct("<I")
+
+
+def journalFilename(projectfile):
+    return os.path.splitext(projectfile)[0] + ".fluxjournal"
+
+
+def readRecords(filename):
+    """Yields the records in a journal, stopping quietly at a record which
+    didn't get completely written."""
+    with open(filename, "rb") as f:
+        while True:
+            header = f.read(LENGTH.size)
+            if len(header) < LENGTH.size:
+                return
+            data = f.read(LENGTH.unpack(header)[0])
+            try:
+                yield marshal.loads(data)
+            except (EOFError, ValueError, TypeError):
+                return
+
+
+class Journal:
+    def __init__(self, project):
+        self.project = project
+        self.filename = journalFilename(project.filename)
+        self.queue = queue.Queue()
+        self.file = None
+        self.thread = None
+        self.dirty = False
+        self.stopped = False
+        self._rekey()
+
+    def _rekey(self):
+        self.routines = dict(enumerate(self.project.fontfeatures.routines))
+        self.keys = {id(r): k for k, r in self.routines.items()}
+
+    def _header(self):
+        return ("base", [r.name for r in self.project.fontfeatures.routines])
+
+    def hasEntries(self):
+        """Is there a journal left over with edits in it?"""
+        try:
+            records = readRecords(self.filename)
+            return next(records)[0] == "base" and next(records, None) is not None
+        except (OSError, StopIteration, IndexError, TypeError):
+            return False
+
+    def replay(self):
+        """Applies a left over journal to the project. Returns False if it
+        was written against a different version of the project."""
+        project = self.project
+        records = readRecords(self.filename)
+        if next(records, None) != self._header():
+            print("Journal %s doesn't match the project, ignoring it" % self.filename)
+            return False
+        for record in records:
+            kind = record[0]
+            if kind == "routine":
+                _, key, encoded = record
+                routine = decodeRoutine(encoded)
+                if isinstance(routine, ComputedRoutine):
+                    routine.project = project
+                old = self.routines.get(key)
+                if old is not None:
+                    routines = project.fontfeatures.routines
+                    routines[:] = [routine if r is old else r for r in routines]
+                    for rs in project.fontfeatures.features.values():
+                        for ref in rs:
+                            if ref is not None and ref.routine is old:
+                                ref.routine = routine
+                self.routines[key] = routine
+            elif kind == "order":
+                _, keys, features = record
+                project.fontfeatures.routines[:] = [self.routines[k] for k in keys]
+                project.fontfeatures.features.clear()
+                for feature, fkeys in features:
+                    project.fontfeatures.features[feature] = [self._reference(k) for k in fkeys]
+            elif kind == "class":
+                _, name, value = record
+                if value is None:
+                    project.glyphclasses.pop(name, None)
+                else:
+                    project.glyphclasses[name] = value
+                project.classChanged(name)
+            elif kind == "glyphaction":
+                _, glyph, value = record
+                if value is None:
+                    project.glyphactions.pop(glyph, None)
+                else:
+                    action = project.glyphactions[glyph] = GlyphAction(*value)
+                    action.perform(project.font)
+                project.glyphChanged(glyph)
+        self.keys = {id(r): k for k, r in self.routines.items()}
+        self.dirty = True
+        return True
+
+    def start(self, keep=False):
+        """Starts writing edits to the journal, emptying it first unless
+        keep is set (after a replay)."""
+        self.file = open(self.filename, "ab" if keep else "wb")
+        self.stopped = False
+        if not keep:
+            self._write(self._header())
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def _writer(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                self.queue.task_done()
+                return
+            self.file.write(data)
+            self.file.flush()
+            self.queue.task_done()
+
+    def _write(self, record):
+        if self.stopped:
+            return
+        try:
+            data = marshal.dumps(record)
+        except ValueError as e:
+            self._stop(e)
+            return
+        data = LENGTH.pack(len(data)) + data
+        if self.thread:
+            self.queue.put(data)
+        else:
+            self.file.write(data)
+            self.file.flush()
+
+    def _stop(self, reason):
+        # Later records may depend on the one we couldn't write, so what is
+        # there stays a consistent prefix; the next save picks up the rest.
+        print("Can't journal this edit (%s), waiting for the project to be saved" % reason)
+        self.stopped = True
+        self.dirty = True
+
+    def _writeRoutine(self, key, routine):
+        try:
+            encoded = encodeRoutine(routine)
+        except ValueError as e:
+            self._stop(e)
+            return
+        self._write(("routine", key, encoded))
+
+    def _key(self, routine):
+        if routine is None:
+            return None
+        key = self.keys.get(id(routine))
+        if key is None:
+            key = len(self.routines)
+            self.routines[key] = routine
+            self.keys[id(routine)] = key
+            self._writeRoutine(key, routine)
+        return key
+
+    def _featureKey(self, ref):
+        # Features hold references to routines, which may not be resolved,
+        # or (after a drag and drop) the routines themselves
+        if ref is None:
+            return None
+        if isinstance(ref, Routine):
+            return self._key(ref)
+        if ref.routine is None:
+            return ref.name
+        return self._key(ref.routine)
+
+    def _reference(self, key):
+        if key is None:
+            return None
+        if isinstance(key, str):
+            return RoutineReference(name=key)
+        return RoutineReference(routine=self.routines[key])
+
+    def routineChanged(self, routine):
+        if not self.file:
+            return
+        self.dirty = True
+        key = self.keys.get(id(routine))
+        if key is None:
+            self._key(routine)
+        else:
+            self._writeRoutine(key, routine)
+
+    def routinesChanged(self):
+        if not self.file:
+            return
+        self.dirty = True
+        fontfeatures = self.project.fontfeatures
+        self._write((
+            "order",
+            [self._key(r) for r in fontfeatures.routines],
+            [(str(k), [self._featureKey(r) for r in v]) for k, v in fontfeatures.features.items()],
+        ))
+
+    def classChanged(self, name):
+        if not self.file:
+            return
+        self.dirty = True
+        self._write(("class", name, self.project.glyphclasses.get(name)))
+
+    def glyphChanged(self, glyph):
+        if not self.file:
+            return
+        self.dirty = True
+        ga = self.project.glyphactions.get(glyph)
+        if ga:
+            ga = (ga.glyph, ga.width, ga.category, ga.duplicate_from)
+        self._write(("glyphaction", glyph, ga))
+
+    def flush(self):
+        if self.thread:
+            self.queue.join()
+
+    def saved(self):
+        """Call once the project has been saved: the journal starts again
+        from the saved project."""
+        self.close(remove=True)
+        self.filename = journalFilename(self.project.filename)
+        self._rekey()
+        self.dirty = False
+        self.start()
+
+    def close(self, remove=False):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.file:
+            self.file.close()
+            self.file = None
+        if remove and os.path.exists(self.filename):
+            os.remove(self.filename)
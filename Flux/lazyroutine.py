@@ -0,0 +1,113 @@
+"""Routines whose rules stay in the project file until somebody asks for
+them, so that opening a very large project only has to read the routine
+headers."""
+
+from fontFeatures import Routine
+from lxml import etree
+import mmap
+import os
+import re
+import threading
+
+ROUTINE_TAG = re.compile(rb"<(/?)routine(?=[\s/>])[^>]*>")
+PARSER = etree.XMLParser(remove_blank_text=True)
+# Held while a project file is being replaced under its routines
+LOCK = threading.Lock()
+
+
+class SourceChanged(Exception):
+    pass
+
+
+def fileStamp(f):
+    """Size and modification time of an open file, to tell if it has been
+    rewritten since we found our way around it."""
+    st = os.fstat(f.fileno())
+    return (st.st_size, st.st_mtime_ns)
+
+
+def routineOffsets(filename):
+    """Returns (start, end) byte offsets of each routine in the <routines>
+    element of a project file, and the file's stamp."""
+    offsets = []
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        stamp = fileStamp(f)
+        start = data.find(b"<routines")
+        end = data.find(b"</routines>", start)
+        if start == -1 or end == -1:
+            return offsets, stamp
+        depth = 0
+        for m in ROUTINE_TAG.finditer(data, start, end):
+            if m[1]:
+                depth -= 1
+                if depth == 0:
+                    offsets.append((routinestart, m.end()))
+            elif m[0].endswith(b"/>"):
+                if depth == 0:
+                    offsets.append((m.start(), m.end()))
+            else:
+                if depth == 0:
+                    routinestart = m.start()
+                depth += 1
+    return offsets, stamp
+
+
+class LazyRoutine(Routine):
+    def __init__(self, source=None, offsets=None, data=None, stamp=None, **kwargs):
+        self.source = source
+        self.offsets = offsets
+        self.stamp = stamp
+        self.data = data  # or the XML itself, if it isn't in a file
+        super().__init__(**kwargs)
+        self._rules = None
+
+    @property
+    def loaded(self):
+        return self._rules is not None
+
+    def raw(self):
+        """Returns the routine's XML as bytes."""
+        if self.data is not None:
+            return self.data
+        with LOCK:
+            # A save may be moving us to a new file
+            start, end = self.offsets
+            with open(self.source, "rb") as f:
+                if self.stamp and fileStamp(f) != self.stamp:
+                    # Something else has written to it since it was opened,
+                    # and our routine could be anywhere in it now
+                    raise SourceChanged(
+                        "%s has been changed outside Flux since it was opened; "
+                        "reopen it to read routine %s" % (self.source, self.name)
+                    )
+                f.seek(start)
+                return f.read(end - start)
+
+    def _read(self):
+        return etree.fromstring(self.raw(), PARSER)
+
+    @property
+    def rules(self):
+        if self._rules is None:
+            self._rules = Routine.fromXML(self._read()).rules
+        return self._rules
+
+    @rules.setter
+    def rules(self, value):
+        self._rules = value
+
+    def toXML(self):
+        if not self.loaded:
+            return self._read()
+        return super().toXML()
+
+    @classmethod
+    def fromHeader(klass, el, source, offsets, stamp=None):
+        return klass(
+            source=source,
+            offsets=offsets,
+            stamp=stamp,
+            address=(el.get("address") or "").split("|"),
+            name=el.get("name"),
+            flags=(int(el.get("flags") or 0)),
+        )
@@ -0,0 +1,310 @@
+"""Builds OpenType lookups straight from fontFeatures routines.
+
+This follows what feaLib's Builder does with the statements fontFeatures
+would have written for each rule, but hands glyph lists, value records and
+anchors to the otlLib lookup builders directly instead of going through
+feature file syntax and parsing it back in.
+"""
+
+from fontFeatures import Substitution, Positioning, Attachment, Chaining
+from fontFeatures.feaLib.Attachment import sortByAnchor
+from fontFeatures.feaLib.Substitution import is_paired, has_classes, all_classes_equal
+from fontFeatures.ttLib.Substitution import lookup_type
+from fontTools.feaLib.builder import makeOpenTypeValueRecord
+from fontTools.otlLib import builder as otl
+from glyphtools import categorize_glyph
+from itertools import cycle, product
+
+
+class LookupReference:
+    """Stands in for another routine's lookup in chaining rules. The index
+    is local to the routine being built and relocated on assembly."""
+
+    def __init__(self, routine, lookup_index):
+        self.routine = routine
+        self.lookup_index = lookup_index
+
+
+class RoutineBuilder:
+    def __init__(self, routine, font, namedClasses, markClasses):
+        self.routine = routine
+        self.font = font
+        self.namedClasses = namedClasses
+        self.markClasses = markClasses
+        self.main = None
+        self.chained = []
+        self.references = []
+
+    def build(self):
+        """Returns the routine's lookups (its own one first, followed by any
+        anonymous lookups its contextual rules needed), and the routines its
+        chaining rules call, indexed by the lookup index used for them."""
+        for rule in self.routine.rules:
+            if isinstance(rule, Chaining):
+                self.addChaining(rule)
+            elif isinstance(rule, Substitution):
+                self.addSubstitution(rule)
+            elif isinstance(rule, Positioning):
+                self.addPositioning(rule)
+            elif isinstance(rule, Attachment):
+                self.addAttachment(rule)
+            else:
+                raise ValueError("Can't compile a %s rule" % type(rule).__name__)
+        if not self.main:
+            return None, [], {}
+        own = [self.main] + self.chained
+        for ix, lookup in enumerate(own):
+            lookup.lookup_index = ix
+        references = {}
+        for ix, reference in enumerate(self.references):
+            reference.lookup_index = len(own) + ix
+            references[reference.lookup_index] = reference.routine
+        return self.main.table, [l.build() for l in own], references
+
+    def fingerprint(self):
+        """Everything that goes into this routine's lookups, so that an
+        unchanged routine need not be built again."""
+        rules = []
+        for rule in self.routine.rules:
+            if isinstance(rule, Chaining):
+                rules.append(("chain", rule.stage, self.contexts(rule, rule.input), [
+                    l and [r.routine.name for r in l] for l in rule.lookups
+                ]))
+            elif isinstance(rule, Substitution):
+                rules.append(("sub", self.contexts(rule, rule.input),
+                    [self.glyphs(x) for x in rule.replacement], rule.reverse))
+            elif isinstance(rule, Positioning):
+                rules.append(("pos", self.contexts(rule, rule.glyphs), [
+                    vr and (vr.xPlacement, vr.yPlacement, vr.xAdvance, vr.yAdvance, vr.vertical)
+                    for vr in rule.valuerecords
+                ]))
+            elif isinstance(rule, Attachment):
+                bases = sorted(rule.bases.items())
+                if rule.font:
+                    bases = [(g, a, categorize_glyph(rule.font, g)[0]) for g, a in bases]
+                rules.append(("attach", rule.base_name, bases, rule.is_cursive and sorted(rule.marks.items())
+                    or sorted(self.markClasses.get(rule.base_name, {}).items())))
+            else:
+                rules.append(repr(rule))
+        flags = (self.routine.flags, self.routine.markFilteringSet, self.routine.markAttachmentSet)
+        return repr((flags, rules))
+
+    def contexts(self, rule, glyphs):
+        return (
+            [self.glyphs(x) for x in rule.precontext],
+            [self.glyphs(x) for x in glyphs],
+            [self.glyphs(x) for x in rule.postcontext],
+        )
+
+    def glyphs(self, glyphs):
+        result = []
+        for g in glyphs:
+            if g.startswith("@"):
+                result.extend(self.namedClasses[g[1:]])
+            else:
+                result.append(g)
+        return result
+
+    def getLookup(self, klass):
+        if self.main is None:
+            self.main = klass(self.font, None)
+            self.main.lookupflag = self.routine.flags or 0
+        elif type(self.main) != klass:
+            raise ValueError(
+                "Within routine %s, all rules must be of the same lookup type" % self.routine.name
+            )
+        return self.main
+
+    def getChainedLookup(self, klass):
+        lookup = klass(self.font, None)
+        lookup.lookupflag = self.routine.flags or 0
+        self.chained.append(lookup)
+        return lookup
+
+    def reference(self, routine):
+        for r in self.references:
+            if r.routine is routine:
+                return r
+        self.references.append(LookupReference(routine, None))
+        return self.references[-1]
+
+    def addChaining(self, rule):
+        klass = otl.ChainContextSubstBuilder if rule.stage == "sub" else otl.ChainContextPosBuilder
+        chain = self.getLookup(klass)
+        lookups = []
+        if any(x is not None for x in rule.lookups):
+            for lookuplist in rule.lookups:
+                if lookuplist is None:
+                    lookups.append(None)
+                else:
+                    lookups.append([self.reference(r.routine) for r in lookuplist])
+        chain.rules.append(otl.ChainContextualRule(
+            [self.glyphs(x) for x in rule.precontext],
+            [self.glyphs(x) for x in rule.input],
+            [self.glyphs(x) for x in rule.postcontext],
+            lookups,
+        ))
+
+    def addSubstitution(self, rule):
+        lut = lookup_type(rule)
+        inputs = [self.glyphs(x) for x in rule.input]
+        replacement = [self.glyphs(x) for x in rule.replacement]
+        prefix = [self.glyphs(x) for x in rule.precontext]
+        suffix = [self.glyphs(x) for x in rule.postcontext]
+
+        if lut == 1:
+            originals, replaces = inputs[0], replacement[0]
+            if len(replaces) == 1:
+                replaces = replaces * len(originals)
+            mapping = dict(zip(originals, replaces))
+            if prefix or suffix:
+                chain = self.getLookup(otl.ChainContextSubstBuilder)
+                sub = chain.find_chainable_single_subst(set(mapping.keys()))
+                if sub is None:
+                    sub = self.getChainedLookup(otl.SingleSubstBuilder)
+                sub.mapping.update(mapping)
+                chain.rules.append(otl.ChainContextualRule(prefix, [list(mapping.keys())], suffix, [sub]))
+                return
+            lookup = self.getLookup(otl.SingleSubstBuilder)
+            for original, replace in mapping.items():
+                if lookup.mapping.get(original, replace) != replace:
+                    raise ValueError('Already defined rule for replacing glyph "%s" by "%s"' % (
+                        original, lookup.mapping[original]
+                    ))
+                lookup.mapping[original] = replace
+        elif lut == 2:
+            if is_paired(rule):
+                glyphclass = next((i for i, v in enumerate(replacement) if len(v) > 1), 0)
+                mappings = [
+                    (original, [r[0] for r in replacement[:glyphclass]] + [target]
+                        + [r[0] for r in replacement[glyphclass + 1:]])
+                    for original, target in zip(inputs[0], replacement[glyphclass])
+                ]
+            else:
+                mappings = [(original, [r[0] for r in replacement]) for original in inputs[0]]
+            for original, replaces in mappings:
+                if prefix or suffix:
+                    chain = self.getLookup(otl.ChainContextSubstBuilder)
+                    sub = self.getChainedLookup(otl.MultipleSubstBuilder)
+                    sub.mapping[original] = replaces
+                    chain.rules.append(otl.ChainContextualRule(prefix, [[original]], suffix, [sub]))
+                    continue
+                lookup = self.getLookup(otl.MultipleSubstBuilder)
+                if lookup.mapping.get(original, replaces) != replaces:
+                    raise ValueError('Already defined substitution for glyph "%s"' % original)
+                lookup.mapping[original] = replaces
+        elif lut == 3:
+            glyph = inputs[0][0]
+            if prefix or suffix:
+                chain = self.getLookup(otl.ChainContextSubstBuilder)
+                lookup = self.getChainedLookup(otl.AlternateSubstBuilder)
+                chain.rules.append(otl.ChainContextualRule(prefix, [[glyph]], suffix, [lookup]))
+            else:
+                lookup = self.getLookup(otl.AlternateSubstBuilder)
+            if glyph in lookup.alternates:
+                raise ValueError('Already defined alternates for glyph "%s"' % glyph)
+            lookup.alternates[glyph] = replacement[0]
+        elif lut == 4:
+            if has_classes(rule) and all_classes_equal(rule) and not len(replacement[0]) == 1:
+                # Paired ligatures, [f f.ss01] i -> [f_i f_i.ss01]
+                lhs = zip(*[cycle(i) if len(i) == 1 else i for i in inputs])
+                rhs = zip(*[cycle(j) if len(j) == 1 else j for j in replacement])
+                ligatures = [([[g] for g in l], r[0]) for l, r in zip(lhs, rhs)]
+            else:
+                ligatures = [(inputs, replacement[0][0])]
+            for glyphs, ligature in ligatures:
+                if prefix or suffix:
+                    chain = self.getLookup(otl.ChainContextSubstBuilder)
+                    lookup = self.getChainedLookup(otl.LigatureSubstBuilder)
+                    chain.rules.append(otl.ChainContextualRule(prefix, glyphs, suffix, [lookup]))
+                else:
+                    lookup = self.getLookup(otl.LigatureSubstBuilder)
+                for g in sorted(product(*glyphs)):
+                    lookup.ligatures[g] = ligature
+        elif lut == 8:
+            originals, replaces = inputs[0], replacement[0]
+            if len(replaces) == 1:
+                replaces = replaces * len(originals)
+            lookup = self.getLookup(otl.ReverseChainSingleSubstBuilder)
+            lookup.rules.append((prefix, suffix, dict(zip(originals, replaces))))
+        elif lut:
+            raise ValueError("Can't compile substitution %s" % rule.asFea())
+
+    def addPositioning(self, rule):
+        glyphs = [sorted(self.glyphs(x)) for x in rule.glyphs]
+        prefix = [self.glyphs(x) for x in rule.precontext]
+        suffix = [self.glyphs(x) for x in rule.postcontext]
+
+        if len(glyphs) == 2 and not rule.has_context:
+            lookup = self.getLookup(otl.PairPosBuilder)
+            v1 = makeOpenTypeValueRecord(rule.valuerecords[0], pairPosContext=True)
+            v2 = makeOpenTypeValueRecord(rule.valuerecords[1], pairPosContext=True)
+            if len(glyphs[0]) == 1 and len(glyphs[1]) == 1:
+                lookup.addGlyphPair(None, glyphs[0][0], v1, glyphs[1][0], v2)
+            else:
+                lookup.addClassPair(None, tuple(glyphs[0]), v1, tuple(glyphs[1]), v2)
+        elif len(glyphs) == 1 and not (prefix or suffix):
+            lookup = self.getLookup(otl.SinglePosBuilder)
+            value = makeOpenTypeValueRecord(rule.valuerecords[0], pairPosContext=False)
+            for glyph in glyphs[0]:
+                lookup.add_pos(None, glyph, value)
+        else:
+            chain = self.getLookup(otl.ChainContextPosBuilder)
+            targets = []
+            for _, _, _, lookups in chain.rules:
+                targets.extend(lookups)
+            subs = []
+            for position, vr in zip(glyphs, rule.valuerecords):
+                if vr is None:
+                    subs.append(None)
+                    continue
+                value = makeOpenTypeValueRecord(vr, pairPosContext=False)
+                sub = chain.find_chainable_single_pos(targets, position, value)
+                if sub is None:
+                    sub = self.getChainedLookup(otl.SinglePosBuilder)
+                    targets.append(sub)
+                for glyph in position:
+                    sub.add_pos(None, glyph, value)
+                subs.append(sub)
+            chain.rules.append(otl.ChainContextualRule(prefix, glyphs, suffix, subs))
+
+    def addAttachment(self, rule):
+        if rule.is_cursive:
+            lookup = self.getLookup(otl.CursivePosBuilder)
+            for g in set(rule.bases.keys()) | set(rule.marks.keys()):
+                entry = g in rule.bases and otl.buildAnchor(*rule.bases[g]) or None
+                exit = g in rule.marks and otl.buildAnchor(*rule.marks[g]) or None
+                lookup.add_attachment(None, [g], entry, exit)
+            return
+
+        sortByAnchor(rule)
+        for bases, anchor in rule.baseslist:
+            if rule.font and categorize_glyph(rule.font, bases[0])[0] == "mark":
+                lookup = self.getLookup(otl.MarkMarkPosBuilder)
+                targets = lookup.baseMarks
+            else:
+                lookup = self.getLookup(otl.MarkBasePosBuilder)
+                targets = lookup.bases
+            for mark, markAnchor in self.markClasses.get(rule.base_name, {}).items():
+                if mark not in lookup.marks:
+                    lookup.marks[mark] = (rule.base_name, otl.buildAnchor(*markAnchor))
+                elif lookup.marks[mark][0] != rule.base_name:
+                    raise ValueError("Glyph %s cannot be in both @%s and @%s" % (
+                        mark, lookup.marks[mark][0], rule.base_name
+                    ))
+            otAnchor = otl.buildAnchor(*anchor)
+            for base in bases:
+                targets.setdefault(base, {})[rule.base_name] = otAnchor
+
+
+def collectMarkClasses(routines):
+    """Mark classes are shared between attachment rules with the same
+    anchor name; the first anchor given for a mark wins."""
+    markClasses = {}
+    for routine in routines:
+        for rule in routine.rules:
+            if isinstance(rule, Attachment) and not rule.is_cursive:
+                marks = markClasses.setdefault(rule.base_name, {})
+                for mark, anchor in rule.marks.items():
+                    marks.setdefault(mark, anchor)
+    return markClasses
@@ -0,0 +1,118 @@
+"""Glyph metrics kept in a file next to the project, so that reopening a
+project doesn't measure every glyph again.
+
+Entries are keyed by a hash of the glyph's outline, width, anchors (which
+give the rise) and (recursively) components, so a changed glyph simply
+misses the cache.
+The file is memory-mapped on load and rows are decoded when asked for.
+It is only written when the project is saved, and then only with the
+glyphs as they are at the time.
+"""
+
+from glyphtools import get_glyph_metrics
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+MAGIC = b"FLUXMET2"
+HEADER = struct.Struct("<8sII")  # magic, glyph count, metric count
+DIGEST_SIZE = 20
+METRICS = ["width", "lsb", "rsb", "xMin", "yMin", "xMax", "yMax", "rise", "run", "fullwidth"]
+
+
+def metricsFilename(projectfile):
+    return os.path.splitext(projectfile)[0] + ".fluxmetrics"
+
+
+def glyphHash(font, glyphname, memo):
+    if glyphname in memo:
+        return memo[glyphname]
+    glyph = font[glyphname]
+    h = hashlib.sha1()
+    h.update(repr(glyph.width).encode())
+    for c in glyph.contours:
+        h.update(repr([(p.x, p.y, p.type) for p in c.points]).encode())
+    for a in glyph.anchors:
+        h.update(repr((a.name, a.x, a.y)).encode())
+    for c in glyph.components:
+        h.update(repr(tuple(c.transformation)).encode())
+        h.update(glyphHash(font, c.baseGlyph, memo))
+    memo[glyphname] = h.digest()
+    return memo[glyphname]
+
+
+class MetricsCache:
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.rows = {}
+        self.new = {}
+        self.values = None
+        if filename:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, "rb") as f:
+                buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            magic, count, width = HEADER.unpack_from(buf)
+            if magic != MAGIC or width != len(METRICS):
+                return
+            pos = HEADER.size
+            digests = buf[pos:pos + DIGEST_SIZE * count]
+            pos += DIGEST_SIZE * count
+            self.values = buf[pos:pos + 8 * width * count].cast("d")
+            self.rows = {bytes(digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]): i for i in range(count)}
+        except (OSError, ValueError, TypeError, struct.error):
+            self.rows = {}
+
+    def get(self, digest):
+        """Returns the metrics for a glyph hash, or None."""
+        if digest in self.new:
+            return self.new[digest]
+        if digest not in self.rows:
+            return None
+        row = self.rows[digest]
+        values = self.values[row * len(METRICS):(row + 1) * len(METRICS)]
+        return {k: (None if math.isnan(v) else v) for k, v in zip(METRICS, values)}
+
+    def put(self, digest, metrics):
+        self.new[digest] = metrics
+
+    def metrics(self, font, glyphname, memo):
+        """Returns the metrics of a glyph, measuring it if we haven't seen
+        this version of it before."""
+        digest = glyphHash(font, glyphname, memo)
+        metrics = self.get(digest)
+        if metrics is None:
+            metrics = get_glyph_metrics(font, glyphname)
+            self.put(digest, metrics)
+        return metrics
+
+    def save(self, filename=None, keep=None):
+        """Writes the cache out, if there is anything new. If keep is
+        given, only those digests are written."""
+        moved = filename and filename != self.filename
+        if moved:
+            self.filename = filename
+        if not self.filename or not (self.new or moved):
+            return
+        entries = {digest: self.get(digest) for digest in self.rows}
+        entries.update(self.new)
+        if keep is not None:  # Outlines which have since been edited
+            entries = {digest: m for digest, m in entries.items() if digest in keep}
+        digests = list(entries.keys())
+        values = []
+        for digest in digests:
+            metrics = entries[digest]
+            values.extend(math.nan if metrics.get(k) is None else float(metrics[k]) for k in METRICS)
+        tmp = self.filename + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(digests), len(METRICS)))
+            f.write(b"".join(digests))
+            f.write(struct.pack("<%id" % len(values), *values))
+        self.rows, self.values = {}, None
+        os.replace(tmp, self.filename)
+        self.new = {}
+        self.load()
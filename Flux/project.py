@@ -2,16 +2,22 @@ from lxml import etree
 from fontFeatures import FontFeatures, Routine, Substitution
 from babelfont import Babelfont
 from fontFeatures.feaLib import FeaUnparser
-from fontTools.feaLib.builder import Builder
 from fontTools.ttLib import TTFont
 from fontFeatures.ttLib import unparse
 from Flux.computedroutine import ComputedRoutine
 from Flux.dividerroutine import DividerRoutine
-from io import StringIO as UnicodeIO
-from Flux.UI.GlyphActions import GlyphAction
-from Flux.UI.glyphpredicateeditor import GlyphClassPredicateTester, GlyphClassPredicate
+from Flux.lazyroutine import LazyRoutine, routineOffsets, LOCK
+from Flux.compiler import FontCompiler
+from Flux.glyphactions import GlyphAction
+from Flux.glyphpredicates import GlyphClassPredicateTester, GlyphClassPredicate, GlyphIndex
+from Flux.metricscache import MetricsCache, metricsFilename
+from Flux.routineregistry import RoutineRegistry
+from Flux.snapshot import snapshotFilename, encodeProject, decodeProject, writeSnapshot, markWritten, readSnapshot
 from babelfont.variablefont import VariableFont
+from collections import OrderedDict
+import copy
 import os
+import threading
 
 class FluxProject:
 
@@ -44,47 +50,127 @@ class FluxProject:
         return self
 
     def __init__(self, file=None):
+        self.editor = None
+        self.plugins = {}
+        self.compiler = FontCompiler(self)
+        self.glyphIndex = None
+        self.routineRegistry = RoutineRegistry(self)
+        self.journal = None
+        self._saving = threading.Lock()
+        self._saveGeneration = 0
         if not file:
             return
         self.filename = file
-        self.xml = etree.parse(file).getroot()
+        snapshot = readSnapshot(file)
+        if snapshot:
+            self.xml = None
+            source = snapshot["source"]
+        else:
+            self.xml = self._parse(file)
+            source = self.xml.find("source").get("file")
         dirname = os.path.dirname(file)
-        self.fontfile = os.path.join(dirname,self.xml.find("source").get("file"))
+        self.fontfile = os.path.join(dirname,source)
         self.fontfeatures = FontFeatures()
         if not self._load_fontfile():
             return
         self.glyphactions = {}
-        self.xmlToFontFeatures()
-        text = self.xml.find("debuggingText")
-        if text is not None:
-            self.debuggingText = text.text
+        if snapshot:
+            self._load_snapshot(snapshot)
         else:
-            self.debuggingText = ""
-
-        self.glyphclasses = {}  # Will sync to fontFeatures when building
-        # XXX will it?
-
-        glyphclasses = self.xml.find("glyphclasses")
-        if glyphclasses is not None:
-            for c in glyphclasses:
-                thisclass = self.glyphclasses[c.get("name")] = {}
-                if c.get("automatic") == "true":
-                    thisclass["type"] = "automatic"
-                    thisclass["predicates"] = [ dict(p.items()) for p in c.findall("predicate") ]
-                    self.fontfeatures.namedClasses[c.get("name")] = tuple(GlyphClassPredicateTester(self).test_all([
-                        GlyphClassPredicate(x) for x in thisclass["predicates"]
-                    ]))
-                else:
-                    thisclass["type"] = "manual"
-                    thisclass["contents"] = [g.text for g in c]
-                    self.fontfeatures.namedClasses[c.get("name")] = tuple([g.text for g in c])
+            self.xmlToFontFeatures()
+            text = self.xml.find("debuggingText")
+            if text is not None:
+                self.debuggingText = text.text
+            else:
+                self.debuggingText = ""
+
+            self.glyphclasses = {}  # Will sync to fontFeatures when building
+            # XXX will it?
+
+            glyphclasses = self.xml.find("glyphclasses")
+            if glyphclasses is not None:
+                for c in glyphclasses:
+                    thisclass = self.glyphclasses[c.get("name")] = {}
+                    if c.get("automatic") == "true":
+                        thisclass["type"] = "automatic"
+                        thisclass["predicates"] = [ dict(p.items()) for p in c.findall("predicate") ]
+                    else:
+                        thisclass["type"] = "manual"
+                        thisclass["contents"] = [g.text for g in c]
 
         # The font file is the authoritative source of the anchors, so load them
         # from the font file on load, in case they have changed.
         self._load_anchors()
+        # Before the classes, which may pick out the glyphs these change
         self._load_glyphactions()
 
+        for name in self.glyphclasses:
+            self.computeClass(name)
+
+    def computeClass(self, name):
+        thisclass = self.glyphclasses[name]
+        if thisclass["type"] == "automatic":
+            self.fontfeatures.namedClasses[name] = tuple(GlyphClassPredicateTester(self).test_all([
+                GlyphClassPredicate(x) for x in thisclass["predicates"]
+            ]))
+        else:
+            self.fontfeatures.namedClasses[name] = tuple(thisclass["contents"])
+
+    def glyphChanged(self, glyphname):
+        """Call when a glyph has been added or edited."""
+        if self.glyphIndex:
+            self.glyphIndex.forget(glyphname)
+        for r in self.fontfeatures.routines:
+            if isinstance(r, ComputedRoutine):
+                r.glyphChanged(glyphname)
+        if self.journal:
+            self.journal.glyphChanged(glyphname)
+
+    def classChanged(self, classname):
+        """Call when a glyph class has been added, edited or removed."""
+        if classname in self.glyphclasses:
+            self.computeClass(classname)
+        else:
+            self.fontfeatures.namedClasses.pop(classname, None)
+        for r in self.fontfeatures.routines:
+            if isinstance(r, ComputedRoutine):
+                r.classChanged(classname)
+        if self.journal:
+            self.journal.classChanged(classname)
+
+    def routineChanged(self, routine):
+        """Call when a routine's rules, name or flags have been edited."""
+        self.routineRegistry.changed(routine)
+        if self.journal:
+            self.journal.routineChanged(routine)
+
+    def routinesChanged(self):
+        """Call when routines have been added, removed or moved, or the
+        features have changed."""
+        self.routineRegistry.invalidate()
+        if self.journal:
+            self.journal.routinesChanged()
+
+    def frozenFeatures(self):
+        """Returns a copy of the fontfeatures whose routine list, features
+        and classes a worker thread can go through while editing carries
+        on. The routines themselves are shared."""
+        ff = copy.copy(self.fontfeatures)
+        ff.routines = list(ff.routines)
+        ff.features = OrderedDict((k, list(v)) for k, v in ff.features.items())
+        ff.namedClasses = ff.namedClasses.copy()
+        ff.anchors = {k: dict(v) for k, v in ff.anchors.items()}
+        ff.glyphclasses = dict(ff.glyphclasses)
+        return ff
+
+    def getGlyphIndex(self):
+        if not self.glyphIndex or self.glyphIndex.font is not self.font:
+            cache = MetricsCache(self.filename and metricsFilename(self.filename))
+            self.glyphIndex = GlyphIndex(self.font, cache)
+        return self.glyphIndex
+
     def _load_fontfile(self):
+        self.sourcefiles = [self.fontfile]  # what the font is built from
         try:
             if self.fontfile.endswith(".ufo") or self.fontfile.endswith("tf"):
                 # Single master workflow
@@ -92,6 +178,10 @@ class FluxProject:
                 self.variations = None
             else:
                 self.variations = VariableFont(self.fontfile)
+                if self.variations.designspace:
+                    self.sourcefiles.extend(
+                        s.path for s in self.variations.designspace.sources if s.path
+                    )
                 # We need a "scratch copy" because we will be trashing the
                 # glyph data with our interpolations
                 if len(self.variations.masters.keys()) == 1:
@@ -119,26 +209,70 @@ class FluxProject:
                 self.fontfeatures.anchors[a.name][g.name] = (a.x, a.y)
 
     def _load_glyphactions(self):
-        glyphactions = self.xml.find("glyphactions")
-        if not glyphactions:
-            return
-        for xmlaction in glyphactions:
-            g = GlyphAction.fromXML(xmlaction)
-            self.glyphactions[g.glyph] = g
+        if self.xml is not None:
+            glyphactions = self.xml.find("glyphactions")
+            if not glyphactions:
+                return
+            for xmlaction in glyphactions:
+                g = GlyphAction.fromXML(xmlaction)
+                self.glyphactions[g.glyph] = g
+        for g in self.glyphactions.values():
             g.perform(self.font)
 
+    def _load_snapshot(self, snapshot):
+        self.debuggingText = snapshot["debuggingText"]
+        self.glyphclasses = snapshot["glyphclasses"]
+        self.glyphactions = {g.glyph: g for g in snapshot["glyphactions"]}
+        routines = {}
+        for r in snapshot["routines"]:
+            if isinstance(r, ComputedRoutine):
+                r.project = self
+            routines[r.name] = r
+            self.fontfeatures.routines.append(r)
+        for featurename, routinenames in snapshot["features"]:
+            self.fontfeatures.features[featurename] = []
+            for routinename in routinenames:
+                if routinename in routines:
+                    self.fontfeatures.addFeature(featurename, [routines[routinename]])
+
+    def _parse(self, file):
+        # Routine bodies can be most of a big project, so we only keep their
+        # headers and come back for the rules when they're wanted.
+        self.routineOffsets, self.routineStamp = routineOffsets(file)
+        count = 0
+        parser = etree.iterparse(file, events=("end",), tag="routine")
+        for _, el in parser:
+            parent = el.getparent()
+            if parent is None or parent.tag != "routines":
+                continue
+            count = count + 1
+            if "computed" in el.attrib or "divider" in el.attrib:
+                continue
+            attrib = dict(el.attrib)
+            el.clear(keep_tail=True)
+            el.attrib.update(attrib)
+        if count != len(self.routineOffsets):
+            # Couldn't find our way around the file, so read it properly
+            self.routineOffsets = None
+            return etree.parse(file).getroot()
+        return parser.root
+
     def _slotArray(self, el):
         return [[g.text for g in slot.findall("glyph")] for slot in list(el)]
 
     def xmlToFontFeatures(self):
         routines = {}
         warnings = []
-        for xmlroutine in self.xml.find("routines"):
+        xmlroutines = self.xml.find("routines")
+        lazy = self.routineOffsets is not None
+        for xmlroutine, offsets in zip(xmlroutines, self.routineOffsets or [None] * len(xmlroutines)):
             if "computed" in xmlroutine.attrib:
                 r = ComputedRoutine.fromXML(xmlroutine)
                 r.project = self
             elif "divider" in xmlroutine.attrib:
                 r = DividerRoutine.fromXML(xmlroutine)
+            elif lazy:
+                r = LazyRoutine.fromHeader(xmlroutine, self.filename, offsets, self.routineStamp)
             else:
                 r = Routine.fromXML(xmlroutine)
             routines[r.name] = r
@@ -155,9 +289,7 @@ class FluxProject:
                     warnings.append("Lost routine %s referenced in feature %s" % (routinename, featurename))
         return warnings # We don't do anything with them yet
 
-    def save(self, filename=None):
-        if not filename:
-            filename = self.filename
+    def toXML(self):
         flux = etree.Element("flux")
         etree.SubElement(flux, "source").set("file", self.fontfile)
         etree.SubElement(flux, "debuggingText").text = self.debuggingText
@@ -183,11 +315,70 @@ class FluxProject:
             f = etree.SubElement(flux, "glyphactions")
             for ga in self.glyphactions.values():
                 f.append(ga.toXML())
+        return flux
+
+    def save(self, filename=None, snapshot=False):
+        """Saves the project. With snapshot, a binary snapshot is saved
+        next to it and the XML is written from that on a background thread,
+        which is returned."""
+        if not filename:
+            filename = self.filename
+        if self.glyphIndex:
+            self.glyphIndex.save(metricsFilename(filename))
+        if snapshot:
+            try:
+                payload, unread = encodeProject(self)
+            except ValueError as e:
+                print("Couldn't snapshot project, saving XML only: %s" % e)
+                snapshot = False
+        if snapshot:
+            writeSnapshot(snapshotFilename(filename), payload)
+            self._saveGeneration = self._saveGeneration + 1
+            thread = threading.Thread(
+                target=self._saveFromSnapshot,
+                args=(payload, filename, unread, self._saveGeneration),
+            )
+            thread.start()
+            return thread
+        unread = [
+            (ix, r) for ix, r in enumerate(self.fontfeatures.routines)
+            if isinstance(r, LazyRoutine) and not r.loaded
+        ]
+        self._saveGeneration = self._saveGeneration + 1
+        with self._saving:
+            self._writeXML(self.toXML(), filename, unread)
 
-        et = etree.ElementTree(flux)
-        with open(filename, "wb") as out:
-            et.write(out, pretty_print=True)
+    def _saveFromSnapshot(self, payload, filename, unread, generation):
+        with self._saving:
+            if generation != self._saveGeneration:
+                return  # A later save will write it
+            # Work from a copy, so that editing can carry on meanwhile
+            shadow = FluxProject()
+            snapshot = decodeProject(payload)
+            shadow.fontfile = snapshot["source"]
+            shadow.fontfeatures = FontFeatures()
+            shadow._load_snapshot(snapshot)
+            self._writeXML(shadow.toXML(), filename, unread)
+            if generation == self._saveGeneration:
+                markWritten(snapshotFilename(filename), filename)
 
+    def _writeXML(self, flux, filename, unread):
+        tmp = filename + ".tmp"
+        with open(tmp, "wb") as out:
+            etree.ElementTree(flux).write(out, pretty_print=True)
+        offsets, stamp = routineOffsets(tmp)
+        if len(offsets) != len(flux.find("routines")):
+            # Read routines in while the file they're in is still there
+            for ix, r in unread:
+                r.rules
+        with LOCK:
+            os.replace(tmp, filename)
+            # Routines we haven't read yet now live in the new file
+            for ix, r in unread:
+                if not r.loaded:
+                    r.source = filename
+                    r.offsets = offsets[ix]
+                    r.stamp = stamp
 
     def serializeGlyphClass(self, element, name, value):
         c = etree.SubElement(element, "class")
@@ -230,18 +421,9 @@ class FluxProject:
             except Exception as e:
                 print("Could not load feature file: %s" % e)
 
-    def saveOTF(self, filename):
+    def saveOTF(self, filename, fea=None):
         try:
-            self.font.save(filename)
-            ttfont = TTFont(filename)
-            featurefile = UnicodeIO(self.fontfeatures.asFea())
-            builder = Builder(ttfont, featurefile)
-            catmap = { "base": 1, "ligature": 2, "mark": 3, "component": 4 }
-            for g in self.font:
-                if g.category in catmap:
-                    builder.setGlyphClass_(None, g.name, catmap[g.category])
-            builder.build()
-            ttfont.save(filename)
+            self.compiler.compile(filename, fea)
         except Exception as e:
             print(e)
             return str(e)
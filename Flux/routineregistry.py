@@ -0,0 +1,65 @@
+"""Looks routines up by name, and finds the row each routine is in, without
+going through the whole routine list every time.
+
+The maps are rebuilt when the routine list is replaced or changes length,
+when the project says routines have moved, or when a lookup finds them out
+of date, so code which edits the routine list directly still gets the right
+answers."""
+
+
+class RoutineRegistry:
+    def __init__(self, project):
+        self.project = project
+        self.invalidate()
+
+    def invalidate(self):
+        self.routines = None
+
+    def _build(self):
+        routines = self.project.fontfeatures.routines
+        self.routines = routines
+        self.length = len(routines)
+        self.rows = {}
+        self.names = {}
+        self.lookupRoutines = []
+        for row, r in enumerate(routines):
+            self.rows[id(r)] = row
+            if hasattr(r, "comment"):
+                continue  # Dividers aren't lookups
+            self.names.setdefault(r.name, r)
+            self.lookupRoutines.append(r)
+
+    def _check(self):
+        routines = self.project.fontfeatures.routines
+        if self.routines is not routines or self.length != len(routines):
+            self._build()
+
+    def row(self, routine):
+        """Returns the row a routine is in, or None if it isn't in the project."""
+        self._check()
+        row = self.rows.get(id(routine))
+        if row is None or self.routines[row] is not routine:
+            self._build()
+            row = self.rows.get(id(routine))
+        return row
+
+    def named(self, name):
+        """Returns the first routine with a given name, or None."""
+        self._check()
+        routine = self.names.get(name)
+        if routine is None or routine.name != name or self.routines[self.rows[id(routine)]] is not routine:
+            # It may have been renamed without our hearing about it
+            self._build()
+            routine = self.names.get(name)
+        return routine
+
+    def lookups(self):
+        """Returns the names of all routines other than dividers, in order."""
+        self._check()
+        return [r.name for r in self.lookupRoutines]
+
+    def changed(self, routine):
+        # A routine may have been renamed
+        self._check()
+        if self.names.get(routine.name) is not routine:
+            self.invalidate()
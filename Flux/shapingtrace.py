@@ -0,0 +1,193 @@
+"""A compact record of a shaping run, for the shaping debugger.
+
+Rather than copying the whole buffer after every routine, we keep glyphs,
+clusters and positions in flat arrays: a full keyframe every so often, and
+in between only the slots which changed. Buffers are put back together
+when somebody actually wants to look at one.
+"""
+
+from array import array
+from Flux.variations import VariationAwareBuffer, VariationAwareBufferItem
+
+KEYFRAME_INTERVAL = 32
+NO_CLUSTER = -1
+
+
+class TraceState:
+    __slots__ = ["indices", "glyphs", "clusters", "positions", "extra"]
+
+    def __init__(self, indices, glyphs, clusters, positions, extra):
+        self.indices = indices  # None for a keyframe
+        self.glyphs = glyphs
+        self.clusters = clusters
+        self.positions = positions  # four per glyph
+        self.extra = extra
+
+
+class ShapingTrace:
+    def __init__(self, direction=None):
+        self.direction = direction
+        self.names = []
+        self.nameIndex = {}
+        self.states = []
+        self.keyframes = []
+        self.last = None
+        self._cursor = None
+
+    def glyphNumber(self, item):
+        # Glyphs are numbered by name; unmapped items by -(codepoint+1)
+        if not getattr(item, "glyph", None):
+            return -(item.codepoint + 1)
+        if item.glyph not in self.nameIndex:
+            self.nameIndex[item.glyph] = len(self.names)
+            self.names.append(item.glyph)
+        return self.nameIndex[item.glyph]
+
+    def flatten(self, buffer):
+        items = buffer.items
+        glyphs = array("l", [self.glyphNumber(i) for i in items])
+        clusters = array("l", [getattr(i, "syllable_index", NO_CLUSTER) for i in items])
+        positions = array("d")
+        for i in items:
+            pos = getattr(i, "position", None)
+            if pos:
+                positions.extend((pos.xPlacement or 0, pos.yPlacement or 0, pos.xAdvance or 0, pos.yAdvance or 0))
+            else:
+                positions.extend((0, 0, 0, 0))
+        self.propagate(buffer, positions)
+        return glyphs, clusters, positions
+
+    def propagate(self, buffer, positions):
+        # As BaseShaper.propagate_attachment_offsets, but on our copy of the
+        # positions so we don't disturb the buffer being shaped
+        items = buffer.items
+        done = set()
+
+        def propagate_one(i):
+            if i in done:
+                return
+            done.add(i)
+            chain = getattr(items[i], "attach_chain", None)
+            if not chain:
+                return
+            j = i + chain
+            if j < 0 or j >= len(items):
+                return
+            propagate_one(j)
+            if items[i].attach_type == "cursive":
+                positions[i*4+1] += positions[j*4+1]
+                return
+            positions[i*4] += positions[j*4]
+            positions[i*4+1] += positions[j*4+1]
+            if buffer.direction == "LTR":
+                for k in range(j, i):
+                    positions[i*4] -= positions[k*4+2]
+                    positions[i*4+1] -= positions[k*4+3]
+            else:
+                for k in range(j+1, i+1):
+                    positions[i*4] += positions[k*4+2]
+                    positions[i*4+1] += positions[k*4+3]
+
+        for i in range(len(items)):
+            propagate_one(i)
+
+    def record(self, buffer, serialize_options=None):
+        """Records the state of the buffer. Returns the step number for this
+        state, and whether it differs from the previous one."""
+        glyphs, clusters, positions = self.flatten(buffer)
+        extra = None
+        if serialize_options:
+            if not isinstance(serialize_options, list):
+                serialize_options = [serialize_options]
+            extra = [
+                tuple(str(getattr(i, a)) for a in serialize_options if hasattr(i, a))
+                for i in buffer.items
+            ]
+        if self.direction is None:
+            self.direction = buffer.direction
+
+        last = self.last
+        same = last is not None and (glyphs, clusters, positions) == last
+        if same and self.states[-1].extra == extra:
+            return len(self.states) - 1, False
+
+        if (
+            last and len(glyphs) == len(last[0])
+            and len(self.states) - self.keyframes[-1] < KEYFRAME_INTERVAL
+        ):
+            indices = array("l", [
+                i for i in range(len(glyphs))
+                if glyphs[i] != last[0][i] or clusters[i] != last[1][i]
+                or positions[i*4:i*4+4] != last[2][i*4:i*4+4]
+            ])
+            state = TraceState(
+                indices,
+                array("l", [glyphs[i] for i in indices]),
+                array("l", [clusters[i] for i in indices]),
+                array("d", [p for i in indices for p in positions[i*4:i*4+4]]),
+                extra,
+            )
+        else:
+            self.keyframes.append(len(self.states))
+            state = TraceState(None, glyphs, clusters, positions, extra)
+        self.states.append(state)
+        self.last = (glyphs, clusters, positions)
+        return len(self.states) - 1, not same
+
+    def __len__(self):
+        return len(self.states)
+
+    def arrays(self, step):
+        """Returns the glyphs, clusters and positions at the given step."""
+        cursor = self._cursor
+        start = max(k for k in self.keyframes if k <= step)
+        if cursor and start <= cursor[0] <= step:
+            # Carry on from where we were; the table asks in order
+            current, glyphs, clusters, positions = cursor
+        else:
+            current = start
+            key = self.states[start]
+            glyphs, clusters, positions = array("l", key.glyphs), array("l", key.clusters), array("d", key.positions)
+        for s in range(current + 1, step + 1):
+            state = self.states[s]
+            for n, i in enumerate(state.indices):
+                glyphs[i] = state.glyphs[n]
+                clusters[i] = state.clusters[n]
+                positions[i*4:i*4+4] = state.positions[n*4:n*4+4]
+        self._cursor = (step, glyphs, clusters, positions)
+        return array("l", glyphs), array("l", clusters), array("d", positions)
+
+    def serialize(self, step):
+        """Serializes the buffer at the given step, as Buffer.serialize would."""
+        glyphs, clusters, positions = self.arrays(step)
+        extra = self.states[step].extra
+        outs = []
+        for ix, g in enumerate(glyphs):
+            if g < 0:
+                outs.append("U+%04x" % (-g - 1))
+            else:
+                xPlacement, yPlacement, xAdvance, _ = positions[ix*4:ix*4+4]
+                cluster = clusters[ix] if clusters[ix] != NO_CLUSTER else ix
+                outs.append("%s=%i" % (self.names[g], cluster))
+                if xPlacement or yPlacement:
+                    outs[-1] = outs[-1] + "@%i,%i" % (xPlacement, yPlacement)
+                outs[-1] = outs[-1] + "+%i" % xAdvance
+            if extra and extra[ix]:
+                outs[-1] = outs[-1] + "(%s)" % ",".join(extra[ix])
+        return "|".join(outs)
+
+    def buffer(self, step, font):
+        """Rebuilds a buffer as it was at the given step."""
+        glyphs, clusters, positions = self.arrays(step)
+        buf = VariationAwareBuffer(font)
+        buf.direction = self.direction
+        for ix, g in enumerate(glyphs):
+            if g < 0:
+                buf.items.append(VariationAwareBufferItem.new_unicode(-g - 1, buf))
+                continue
+            item = VariationAwareBufferItem.new_glyph(self.names[g], font, buf)
+            item.position.xPlacement, item.position.yPlacement, item.position.xAdvance, item.position.yAdvance = positions[ix*4:ix*4+4]
+            if clusters[ix] != NO_CLUSTER:
+                item.syllable_index = clusters[ix]
+            buf.items.append(item)
+        return buf
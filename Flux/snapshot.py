@@ -0,0 +1,208 @@
+"""A binary copy of a project, saved next to the .fluxml.
+
+The XML stays the interchange format, but building and pretty-printing it
+takes seconds for a big project. The snapshot is the same information as
+plain tuples, lists and strings dumped with marshal, so it can be written
+quickly and the XML written from it afterwards in the background. Routines
+are only turned back into rules when somebody asks for them.
+
+The header records the size and modification time of the XML written from
+the snapshot, so that a snapshot is only used while the XML is the one it
+describes (or the XML hasn't been written since it was taken).
+"""
+
+from fontFeatures import Routine, RoutineReference, Substitution, Chaining, Positioning, Attachment, ValueRecord
+from Flux.computedroutine import ComputedRoutine
+from Flux.dividerroutine import DividerRoutine
+from Flux.glyphactions import GlyphAction
+from Flux.lazyroutine import LazyRoutine
+import gc
+import marshal
+import os
+import struct
+
+MAGIC = b"FLUXSNP1"
+HEADER = struct.Struct("<8sqq")  # magic, size and mtime of the matching XML
+
+
+def snapshotFilename(projectfile):
+    return os.path.splitext(projectfile)[0] + ".fluxsnapshot"
+
+
+class SnapshotRoutine(LazyRoutine):
+    """A routine whose rules are decoded from a snapshot when asked for."""
+    def __init__(self, encoded=None, **kwargs):
+        self.encoded = encoded
+        super().__init__(**kwargs)
+
+    @property
+    def rules(self):
+        if self._rules is None:
+            self._rules = [decodeRule(r) for r in self.encoded]
+        return self._rules
+
+    @rules.setter
+    def rules(self, value):
+        self._rules = value
+
+    def toXML(self):
+        return Routine.toXML(self)
+
+
+def encodeLookups(lookups):
+    return [
+        slot and [("ref", lu.name) if isinstance(lu, RoutineReference) else ("routine", encodeRoutine(lu)) for lu in slot]
+        for slot in lookups
+    ]
+
+
+def encodeRule(rule):
+    if isinstance(rule, Attachment):
+        return ("A", (rule.address, None, rule.flags, None, None), rule.base_name, rule.mark_name,
+                [(g, tuple(a)) for g, a in rule.bases.items()],
+                [(g, tuple(a)) for g, a in rule.marks.items()])
+    common = (rule.address, rule.languages, rule.flags, rule.precontext, rule.postcontext)
+    if isinstance(rule, Substitution):
+        return ("S", common, rule.input, rule.replacement, rule.reverse, encodeLookups(rule.lookups))
+    if isinstance(rule, Chaining):
+        return ("C", common, rule.input, encodeLookups(rule.lookups))
+    if isinstance(rule, Positioning):
+        return ("P", common, rule.glyphs, [
+            (v.xPlacement, v.yPlacement, v.xAdvance, v.yAdvance) for v in rule.valuerecords
+        ])
+    raise ValueError("Can't snapshot a %s" % type(rule).__name__)
+
+
+def encodeRoutine(routine):
+    if isinstance(routine, ComputedRoutine):
+        return ("computed", routine.name, routine.address, routine.flags,
+                routine.plugin, dict(routine.parameters))
+    if isinstance(routine, DividerRoutine):
+        return ("divider", routine.comment)
+    if isinstance(routine, SnapshotRoutine) and not routine.loaded:
+        return ("routine", routine.name, routine.address, routine.flags, routine.encoded)
+    if isinstance(routine, LazyRoutine) and not routine.loaded:
+        # Keep it as the XML it is rather than reading it in
+        return ("xml", routine.name, routine.address, routine.flags, routine.raw())
+    return ("routine", routine.name, routine.address, routine.flags,
+            [encodeRule(r) for r in routine.rules])
+
+
+def decodeLookups(lookups):
+    return [
+        slot and [RoutineReference(name=lu) if kind == "ref" else decodeRoutine(lu) for kind, lu in slot]
+        for slot in lookups
+    ]
+
+
+def decodeRule(data):
+    kind, (address, languages, flags, precontext, postcontext) = data[:2]
+    if kind == "S":
+        _, _, input_, replacement, reverse, lookups = data
+        return Substitution(input_, replacement, precontext=precontext, postcontext=postcontext,
+                            address=address, languages=languages, lookups=decodeLookups(lookups),
+                            reverse=reverse, flags=flags)
+    if kind == "C":
+        _, _, input_, lookups = data
+        return Chaining(input_, precontext=precontext, postcontext=postcontext, address=address,
+                        languages=languages, lookups=decodeLookups(lookups), flags=flags)
+    if kind == "P":
+        _, _, glyphs, valuerecords = data
+        return Positioning(glyphs, [ValueRecord(*v) for v in valuerecords], precontext=precontext,
+                           postcontext=postcontext, address=address, languages=languages, flags=flags)
+    if kind == "A":
+        _, _, base_name, mark_name, bases, marks = data
+        return Attachment(base_name, mark_name, bases=dict(bases), marks=dict(marks),
+                          flags=flags, address=address)
+    raise ValueError("Unknown rule type %s in snapshot" % kind)
+
+
+def decodeRoutine(data):
+    kind = data[0]
+    if kind == "computed":
+        _, name, address, flags, plugin, parameters = data
+        r = ComputedRoutine(name=name, address=address, flags=flags, parameters=parameters)
+        r.plugin = plugin
+        return r
+    if kind == "divider":
+        return DividerRoutine(comment=data[1])
+    if kind == "xml":
+        _, name, address, flags, raw = data
+        return LazyRoutine(data=raw, name=name, address=address, flags=flags)
+    _, name, address, flags, rules = data
+    return SnapshotRoutine(encoded=rules, name=name, address=address, flags=flags)
+
+
+def encodeProject(project):
+    """Returns the snapshot of a project as bytes, and the (index, routine)
+    pairs of routines which went in still unread from the XML."""
+    routines = []
+    unread = []
+    for ix, r in enumerate(project.fontfeatures.routines):
+        routines.append(encodeRoutine(r))
+        if isinstance(r, LazyRoutine) and not isinstance(r, SnapshotRoutine) and not r.loaded:
+            unread.append((ix, r))
+    data = {
+        "source": project.fontfile,
+        "debuggingText": project.debuggingText,
+        "glyphclasses": project.glyphclasses,
+        "features": [(str(k), [r.name for r in v]) for k, v in project.fontfeatures.features.items()],
+        "routines": routines,
+        "glyphactions": [
+            (ga.glyph, ga.width, ga.category, ga.duplicate_from) for ga in project.glyphactions.values()
+        ],
+    }
+    return marshal.dumps(data), unread
+
+
+def decodeProject(payload):
+    # Unmarshalling makes a great many small lists and tuples, and the
+    # garbage collector would otherwise keep stopping to look at them all
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        data = marshal.loads(payload)
+    finally:
+        if enabled:
+            gc.enable()
+    data["routines"] = [decodeRoutine(r) for r in data["routines"]]
+    data["glyphactions"] = [GlyphAction(*ga) for ga in data["glyphactions"]]
+    return data
+
+
+def writeSnapshot(filename, payload):
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        f.write(payload)
+    os.replace(tmp, filename)
+
+
+def markWritten(filename, xmlfile):
+    """Records that xmlfile now holds the same project as the snapshot."""
+    st = os.stat(xmlfile)
+    with open(filename, "r+b") as f:
+        f.write(HEADER.pack(MAGIC, st.st_size, st.st_mtime_ns))
+
+
+def readSnapshot(projectfile):
+    """Returns the decoded snapshot for a project file, or None if there
+    isn't one we can trust."""
+    filename = snapshotFilename(projectfile)
+    try:
+        with open(filename, "rb") as f:
+            magic, size, mtime = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                return None
+            snapst = os.fstat(f.fileno())
+            xmlst = os.stat(projectfile)
+            if size or mtime:
+                if (size, mtime) != (xmlst.st_size, xmlst.st_mtime_ns):
+                    return None
+            elif xmlst.st_mtime_ns > snapst.st_mtime_ns:
+                # The XML never got written from this snapshot, and has
+                # been changed by something else since
+                return None
+            return decodeProject(f.read())
+    except (OSError, ValueError, EOFError, TypeError, KeyError, IndexError, struct.error):
+        return None
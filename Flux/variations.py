@@ -1,4 +1,7 @@
 from fontFeatures.shaperLib.Buffer import Buffer, BufferItem, _add_value_records
+from fontFeatures import ValueRecord, Positioning
+import numpy as np
+import threading
 import weakref
 
 
@@ -10,6 +13,10 @@ class VariationAwareBufferItem(BufferItem):
             return
         vf = self.buffer().vf
         if vf:
+            width = glyphInterpolator(vf).advanceWidth(self.glyph, self.buffer().location)
+            if width is not None:
+                self.position.xAdvance = width
+                return
             glyphs = [vf.masters[master][self.glyph] for master in vf.master_order]
             widthset = {vf.master_order[i]: glyphs[i].width for i in range(len(vf.masters))}
             self.position.xAdvance = vf.interpolate_tuples(widthset, self.buffer().location)
@@ -38,7 +45,7 @@ class VariationAwareBufferItem(BufferItem):
             return super().add_position(vr2)
         vf = self.buffer().vf
         if vf:
-            vr2 = vr2.get_value_for_location(vf, self.buffer().location)
+            vr2 = glyphInterpolator(vf).valueRecord(vr2, self.buffer().location)
         _add_value_records(self.position, vr2)
 
 class VariationAwareBuffer(Buffer):
@@ -49,3 +56,161 @@ class VariationAwareBuffer(Buffer):
 
     def store_unicode(self, unistring):
         self.items = [self.itemclass.new_unicode(ord(char), self) for char in unistring ]
+
+
+class GlyphInterpolator:
+    """Master data (outlines, widths, value records) stacked into arrays,
+    so that getting a value at a location is one matrix multiply. Returns
+    fresh values; the masters and the project's scratch font are left
+    alone."""
+    def __init__(self, vf):
+        self.vf = vf
+        model = vf.variation_model
+        count = len(vf.master_order)
+        # getDeltas is linear, so running it over the identity gives us
+        # a matrix turning master values into deltas
+        self.deltaMatrix = np.array([
+            model.getDeltas([float(i == j) for i in range(count)]) for j in range(count)
+        ]).T
+        self.points = {}
+        self.transformations = {}
+        self.glyphIndex = None
+        self.widthDeltas = None
+        self.widths = {}
+        self.resolved = {}  # location -> {id(vr): (vr, resolved vr)}
+        self.resolvedLock = threading.Lock()
+
+    def masterGlyphs(self, glyphname):
+        return [self.vf.masters[master][glyphname] for master in self.vf.master_order]
+
+    def deltas(self, mastervalues):
+        if any(len(v) != len(mastervalues[0]) for v in mastervalues):
+            return None  # Incompatible masters
+        return self.deltaMatrix @ np.array(mastervalues, dtype=float)
+
+    def scalars(self, location):
+        return np.array(self.vf.variation_model.getScalars(location))
+
+    def glyphPoints(self, glyphname, location):
+        """Returns the glyph's points at a normalized location as an (n, 2)
+        array, or None if the masters aren't compatible."""
+        if glyphname not in self.points:
+            self.points[glyphname] = self.deltas([
+                [coord for c in g.contours for p in c.points for coord in (p.x, p.y)]
+                for g in self.masterGlyphs(glyphname)
+            ])
+        deltas = self.points[glyphname]
+        if deltas is None:
+            return None
+        return (self.scalars(location) @ deltas).reshape(-1, 2)
+
+    def componentTransformations(self, glyphname, location):
+        """Returns the glyph's component transformations at a normalized
+        location as an (n, 6) array, or None if the masters aren't
+        compatible."""
+        if glyphname not in self.transformations:
+            self.transformations[glyphname] = self.deltas([
+                [value for c in g.components for value in c.transformation]
+                for g in self.masterGlyphs(glyphname)
+            ])
+        deltas = self.transformations[glyphname]
+        if deltas is None:
+            return None
+        return (self.scalars(location) @ deltas).reshape(-1, 6)
+
+    def advanceWidths(self, location):
+        """Returns an array of every glyph's advance width at a user space
+        location, indexed by glyphIndex. Computed once per location."""
+        key = tuple(sorted(location.items()))
+        if key in self.widths:
+            return self.widths[key]
+        if self.widthDeltas is None:
+            masters = [self.vf.masters[master] for master in self.vf.master_order]
+            names = [g for g in masters[0].keys() if all(g in m for m in masters)]
+            self.glyphIndex = {g: i for i, g in enumerate(names)}
+            self.widthDeltas = self.deltas([[m[g].width for g in names] for m in masters])
+        if len(self.widths) >= 16:  # Slider positions come and go
+            del self.widths[next(iter(self.widths))]
+        self.widths[key] = self.scalars(self.vf.normalize(location)) @ self.widthDeltas
+        return self.widths[key]
+
+    def advanceWidth(self, glyphname, location):
+        widths = self.advanceWidths(location)
+        if glyphname not in self.glyphIndex:
+            return None
+        return float(widths[self.glyphIndex[glyphname]])
+
+    def _resolvedAt(self, location):
+        # The shaping thread and the GUI may each be at their own location,
+        # so everything works on the dict for its location it got from here
+        key = tuple(sorted(location.items()))
+        with self.resolvedLock:
+            if key not in self.resolved:
+                if len(self.resolved) >= 16:  # Slider positions come and go
+                    del self.resolved[next(iter(self.resolved))]
+                self.resolved[key] = {}
+            return self.resolved[key]
+
+    def valueRecord(self, vr, location):
+        """Returns a variable ValueRecord resolved at a user space location.
+        Results are kept, by location and value record."""
+        if not hasattr(vr, "masters"):
+            return vr
+        resolved = self._resolvedAt(location)
+        entry = resolved.get(id(vr))
+        if not entry or entry[0] is not vr:
+            self._resolve([vr], location, resolved)
+            entry = resolved[id(vr)]
+        return entry[1]
+
+    def resolveValueRecords(self, vrs, location):
+        """Resolves a batch of value records at a location in one go."""
+        self._resolve(vrs, location, self._resolvedAt(location))
+
+    def _resolve(self, vrs, location, resolved):
+        vrs = [
+            vr for vr in vrs
+            if hasattr(vr, "masters") and resolved.get(id(vr), (None,))[0] is not vr
+        ]
+        if not vrs:
+            return
+        deltas = self.deltas([
+            [
+                getattr(vr.masters[master], attr) or 0
+                for vr in vrs
+                for attr in ("xPlacement", "yPlacement", "xAdvance", "yAdvance")
+            ]
+            for master in self.vf.master_order
+        ])
+        values = (self.scalars(self.vf.normalize(location)) @ deltas).reshape(-1, 4)
+        for vr, (xPlacement, yPlacement, xAdvance, yAdvance) in zip(vrs, values):
+            resolved[id(vr)] = (vr, ValueRecord(
+                xPlacement=float(xPlacement),
+                yPlacement=float(yPlacement),
+                xAdvance=float(xAdvance),
+                yAdvance=float(yAdvance),
+            ))
+
+    def resolveRoutine(self, routine, location):
+        """Resolves every variable value record in a routine."""
+        self.resolveValueRecords([
+            vr
+            for rule in routine.rules if isinstance(rule, Positioning)
+            for vr in rule.valuerecords
+        ], location)
+
+    def forgetValueRecord(self, vr):
+        """Call when a value record's master values are edited."""
+        with self.resolvedLock:
+            for resolved in self.resolved.values():
+                resolved.pop(id(vr), None)
+
+
+_interpolators = weakref.WeakKeyDictionary()
+
+
+def glyphInterpolator(vf):
+    """Returns the GlyphInterpolator for a VariableFont, making it if needed."""
+    if vf not in _interpolators:
+        _interpolators[vf] = GlyphInterpolator(vf)
+    return _interpolators[vf]
@@ -2,17 +2,22 @@
 
 import uharfbuzz as hb
 from fontTools.ttLib import TTFont
+from io import BytesIO
 import re
 
 
 class Vharfbuzz:
-    def __init__(self, filename):
-        """Opens a font file and gets ready to shape text."""
+    def __init__(self, filename=None, fontdata=None, glyphOrder=None):
+        """Opens a font file, or a font already in memory, and gets ready
+        to shape text."""
         self.filename = filename
-        with open(self.filename, "rb") as fontfile:
-            self.fontdata = fontfile.read()
-        self.ttfont = TTFont(filename)
-        self.glyphOrder = self.ttfont.getGlyphOrder()
+        if fontdata is None:
+            with open(self.filename, "rb") as fontfile:
+                fontdata = fontfile.read()
+        self.fontdata = fontdata
+        if glyphOrder is None:
+            glyphOrder = TTFont(BytesIO(fontdata)).getGlyphOrder()
+        self.glyphOrder = glyphOrder
         self.prepare_shaper()
         self.shapers = None
         self.drawfuncs = None
@@ -27,28 +32,18 @@ class Vharfbuzz:
         self.hbfont = font
 
     def make_message_handling_function(self, buf, onchange):
-        self.history = {"GSUB": [], "GPOS": []}
-        self.lastLookupID = None
-        def handle_message(msg, buf2):
-            print(msg)
-            m = re.match("start lookup (\\d+)", msg)
+        def handle_message(msg, buf2=buf):
+            m = re.match("end lookup (\\d+)(?: feature '(.*)')?", msg)
             if m:
                 lookupid = int(m[1])
-                self.history[self.stage].append(self.serialize_buf(buf2))
-
-            m = re.match("end lookup (\\d+)", msg)
-            if m:
-                lookupid = int(m[1])
-                # if self.serialize_buf(buf2) != self.history[self.stage][-1]:
-                onchange(self, self.stage, lookupid, self._copy_buf(buf2))
-                self.history[self.stage].pop()
-            if msg.startswith("start GPOS stage"):
+                onchange(self, self.stage, lookupid, self._copy_buf(buf2), m[2])
+            if msg.startswith("start GPOS stage") or msg.startswith("start table GPOS"):
                 self.stage = "GPOS"
             return True
 
         return handle_message
 
-    def shape(self, text, onchange=None):
+    def shape(self, text, onchange=None, features=None):
         """Shapes a text
 
     This shapes a piece of text, return a uharfbuzz `Buffer` object.
@@ -60,9 +55,11 @@ class Vharfbuzz:
     - ``stage``: either "GSUB" or "GPOS"
     - ``lookupid``: the current lookup ID
     - ``buffer``: a copy of the buffer as a list of lists (glyphname, cluster, position)
+    - ``feature``: the feature the lookup was applied for, if HarfBuzz says
+
+    `features` is a dictionary of feature tags to turn on or off.
     """
 
-        self.prepare_shaper()
         buf = hb.Buffer()
         buf.add_str(text)
         buf.guess_segment_properties()
@@ -70,16 +67,18 @@ class Vharfbuzz:
         if onchange:
             f = self.make_message_handling_function(buf, onchange)
             buf.set_message_func(f)
-        hb.shape(self.hbfont, buf, shapers=self.shapers)
+        hb.shape(self.hbfont, buf, features, shapers=self.shapers)
         self.stage = "GPOS"
         return buf
 
     def _copy_buf(self, buf):
         # Or at least the bits we care about
         outs = []
-        for info, pos in zip(buf.glyph_infos, buf.glyph_positions):
+        # Positions aren't allocated until GPOS starts
+        positions = buf.glyph_positions or [None] * len(buf.glyph_infos)
+        for info, pos in zip(buf.glyph_infos, positions):
             l = [self.glyphOrder[info.codepoint], info.cluster]
-            if self.stage == "GPOS":
+            if self.stage == "GPOS" and pos:
                 l.append(pos.position)
             else:
                 l.append(None)
@@ -1,6 +1,6 @@
 from collections import namedtuple
 from fontFeatures.ttLib import unparse
-from vharfbuzz import Vharfbuzz
+from Flux.vharfbuzz import Vharfbuzz
 import fontFeatures
 from fontTools.ttLib import TTFont
 
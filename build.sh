@@ -1,4 +1,5 @@
 #!/bin/sh
+python3 -m Flux.ucd
 python3 setup.py py2app
 rm -rf dist/flux.app/Contents/Resources/lib/python3.8/PyQt5/Qt/lib/Qt{WebEngine,Designer,Quick}*
 rm -rf dist/Flux.app/Contents/Resources/lib/python3.8/PyQt5/Qt/qml/
@@ -1,34 +1,49 @@
 import sys, os
+import multiprocessing
 
 if "RESOURCEPATH" in os.environ:
     sys.path = [os.path.join(os.environ['RESOURCEPATH'], 'lib', 'python3.8', 'lib-dynload')] + sys.path
 
-import Flux.ucd
 
-from Flux.project import FluxProject
-from Flux.editor import FluxEditor
-from PyQt5.QtWidgets import QApplication
+def main():
+    # Worker processes (for 'flux build' and computed routines) import this
+    # file again, so nothing may happen until we know we're the main one
+    multiprocessing.freeze_support()
 
-import qcrash.api as qcrash
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        from Flux.cli import main
+        return main()
 
-app = QApplication(sys.argv)
-app.setApplicationName("Flux")
-app.setOrganizationDomain("corvelsoftware.co.uk")
-# app.setOrganizationName("Corvel Software")
+    import Flux.ucd
 
-email = qcrash.backends.EmailBackend('simon@simon-cozens.org', 'flux')
-github = qcrash.backends.GithubBackend('simoncozens', 'flux')
-qcrash.install_backend(github)
-qcrash.install_backend(email)
-qcrash.install_except_hook()
+    from Flux.project import FluxProject
+    from Flux.editor import FluxEditor
+    from PyQt5.QtWidgets import QApplication
 
-proj = None
-if len(sys.argv) > 1:
-    if sys.argv[1].endswith(".fluxml"):
-        proj = FluxProject(sys.argv[1])
-    else:
-        proj = FluxProject.new(sys.argv[1])
-f = FluxEditor(proj)
-f.show()
+    import qcrash.api as qcrash
 
-sys.exit(app.exec_())
+    app = QApplication(sys.argv)
+    app.setApplicationName("Flux")
+    app.setOrganizationDomain("corvelsoftware.co.uk")
+    # app.setOrganizationName("Corvel Software")
+
+    email = qcrash.backends.EmailBackend('simon@simon-cozens.org', 'flux')
+    github = qcrash.backends.GithubBackend('simoncozens', 'flux')
+    qcrash.install_backend(github)
+    qcrash.install_backend(email)
+    qcrash.install_except_hook()
+
+    proj = None
+    if len(sys.argv) > 1:
+        if sys.argv[1].endswith(".fluxml"):
+            proj = FluxProject(sys.argv[1])
+        else:
+            proj = FluxProject.new(sys.argv[1])
+    f = FluxEditor(proj)
+    f.show()
+
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
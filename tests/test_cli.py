@@ -0,0 +1,44 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import pytest
+import shutil
+import subprocess
+import sys
+from Flux.cli import main
+from Flux.computedroutine import poolContext
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+FONT = os.path.abspath(os.path.join(ROOT, "Rajdhani-Regular.otf"))
+
+
+def test_build_in_worker_processes(tmp_path):
+    inputs = []
+    for name in ("One", "Two"):
+        inputs.append(str(tmp_path / (name + ".otf")))
+        shutil.copy(FONT, inputs[-1])
+    # Workers are spawned, so each one imports flux.py again
+    subprocess.check_call(
+        [sys.executable, "flux.py", "build", "-j2", "-o", str(tmp_path / "out")] + inputs,
+        cwd=ROOT,
+    )
+    assert (tmp_path / "out" / "One.ttf").exists()
+    assert (tmp_path / "out" / "Two.ttf").exists()
+
+
+def test_outputs_must_differ(tmp_path, capsys):
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+        shutil.copy(FONT, str(tmp_path / name))
+    inputs = [str(tmp_path / name / "Rajdhani-Regular.otf") for name in ("a", "b")]
+    with pytest.raises(SystemExit) as e:
+        main(["build", "-o", str(tmp_path / "out")] + inputs)
+    assert e.value.code == 2
+    assert "would both be built to" in capsys.readouterr().err
+    assert not (tmp_path / "out" / "Rajdhani-Regular.ttf").exists()
+
+
+def test_no_pools_within_workers():
+    assert poolContext() is not None
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        assert pool.submit(poolContext).result() is None
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+from fontFeatures import Substitution
+from Flux.computedroutine import ComputedRoutine, ProjectSnapshot, computeWith
+
+
+def plugin(look):
+    # A plugin which looks at some of the project, and counts its runs
+    def rulesFromComputedRoutine(routine):
+        module.runs += 1
+        look(routine.project)
+        return [Substitution([["a"]], [["b"]])]
+    module = SimpleNamespace(runs=0, rulesFromComputedRoutine=rulesFromComputedRoutine)
+    return module
+
+
+def computed(project, name, look):
+    routine = ComputedRoutine(name=name)
+    routine.project = project
+    routine.module = plugin(look)
+    routine.rules
+    return routine
+
+
+def test_changes_invalidate_dependent_routines():
+    project = SimpleNamespace(
+        font={"a": None, "b": None, "c": None},
+        fontfeatures=SimpleNamespace(namedClasses={"vowels": ("a",), "other": ("c",)}),
+        plugins={},
+    )
+    routines = {
+        "some": computed(project, "some", lambda p: (p.font["a"], p.fontfeatures.namedClasses["vowels"])),
+        "glyphs": computed(project, "glyphs", lambda p: list(p.font.keys())),
+        "classes": computed(project, "classes", lambda p: dict(p.fontfeatures.namedClasses.items())),
+    }
+
+    def changed(method, name):
+        for r in routines.values():
+            getattr(r, method)(name)
+        stale = {k for k, r in routines.items() if r.stale}
+        for r in routines.values():
+            r.rules
+        return stale
+
+    assert changed("glyphChanged", "b") == {"glyphs"}
+    assert changed("glyphChanged", "a") == {"some", "glyphs"}
+    assert changed("classChanged", "other") == {"classes"}
+    assert changed("classChanged", "vowels") == {"some", "classes"}
+    assert [r.module.runs for r in routines.values()] == [3, 3, 3]
+
+
+def test_installed_rules_keep_dependencies():
+    project = SimpleNamespace(
+        font={"a": None, "b": None},
+        fontfeatures=SimpleNamespace(namedClasses={"vowels": ("a",)}),
+        plugins={},
+    )
+    module = plugin(lambda p: ("a" in p.font, p.fontfeatures.namedClasses["vowels"]))
+    snapshot = ProjectSnapshot(project.font.keys(), project.fontfeatures.namedClasses, {})
+    routine = ComputedRoutine(name="some")
+    routine.project = project
+    routine.module = module
+    assert routine.install(*computeWith(snapshot, "", "some", 0, {}, module=module))
+    assert not routine.stale
+    routine.glyphChanged("b")
+    routine.classChanged("other")
+    assert not routine.stale
+    routine.classChanged("vowels")
+    assert routine.stale
@@ -0,0 +1,83 @@
+from Flux.glyphpredicates import GlyphIndex, GlyphClassPredicate
+
+
+class Glyph(dict):
+    def __init__(self, metrics=None, components=()):
+        super().__init__(metrics or {})
+        self.components = [Component(c) for c in components]
+
+
+class Component:
+    def __init__(self, baseGlyph):
+        self.baseGlyph = baseGlyph
+
+
+class Cache:
+    def metrics(self, font, glyphname, memo):
+        return font[glyphname]
+
+    def save(self):
+        pass
+
+
+def index(font):
+    return GlyphIndex(font, Cache())
+
+
+def test_names():
+    font = {g: Glyph() for g in ["a", "a.sc", "ab", "b", "b.sc", "ba", "aé"]}
+    i = index(font)
+    assert i.toNames(i.beginning("a")) == ["a", "a.sc", "ab", "aé"]
+    assert i.toNames(i.beginning("a.")) == ["a.sc"]
+    assert i.toNames(i.beginning("c")) == []
+    assert i.toNames(i.ending(".sc")) == ["a.sc", "b.sc"]
+    assert i.toNames(i.ending("a")) == ["a", "ba"]
+    assert i.toNames(i.matching(r"^.\.")) == ["a.sc", "b.sc"]
+
+
+def test_metrics():
+    font = {
+        "a": Glyph({"width": 500, "rise": 0}),
+        "b": Glyph({"width": 600, "rise": None}),
+        "c": Glyph({"width": 500, "rise": 10}),
+        "d": Glyph({"width": 700, "rise": -10}),
+    }
+    i = index(font)
+    assert i.toNames(i.compare("width", "<", 600)) == ["a", "c"]
+    assert i.toNames(i.compare("width", "<=", 600)) == ["a", "b", "c"]
+    assert i.toNames(i.compare("width", "=", 500)) == ["a", "c"]
+    assert i.toNames(i.compare("width", ">=", 600)) == ["b", "d"]
+    assert i.toNames(i.compare("width", ">", 600)) == ["d"]
+    assert i.toNames(i.compare("width", "=", 550)) == []
+    # Glyphs without a metric never match
+    assert i.toNames(i.compare("rise", "<=", 10)) == ["a", "c", "d"]
+    predicate = GlyphClassPredicate({"type": "width", "metric": "width", "comparator": ">", "value": "550"})
+    assert i.toNames(predicate.test(i)) == ["b", "d"]
+
+
+def test_forget():
+    font = {"a": Glyph({"width": 500}), "b": Glyph({"width": 600})}
+    i = index(font)
+    assert i.toNames(i.compare("width", ">", 550)) == ["b"]
+    font["a"] = Glyph({"width": 650})
+    i.forget("a")
+    assert i.toNames(i.compare("width", ">", 550)) == ["a", "b"]
+    font["a.alt"] = Glyph({"width": 700})
+    i.forget("a.alt")
+    assert i.toNames(i.beginning("a")) == ["a", "a.alt"]
+    assert i.toNames(i.compare("width", ">", 680)) == ["a.alt"]
+
+
+def test_forget_composites():
+    font = {
+        "A": Glyph({"width": 600}),
+        "acute": Glyph({"width": 0}),
+        "Aacute": Glyph({"width": 600}, ["A", "acute"]),
+        "Aacute.ss01": Glyph({"width": 600}, ["Aacute"]),
+        "B": Glyph({"width": 600}),
+    }
+    i = index(font)
+    for g in font:
+        i.glyphMetrics(g)
+    i.forget("A")
+    assert sorted(i.metrics) == ["B", "acute"]
@@ -0,0 +1,69 @@
+import math
+import Flux.metricscache
+from Flux.glyphpredicates import GlyphIndex
+from Flux.metricscache import MetricsCache, METRICS, glyphHash
+
+
+class Thing:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def glyph(width=500, points=((0, 0), (100, 100)), anchors=(), components=()):
+    return Thing(
+        width=width,
+        contours=[Thing(points=[Thing(x=x, y=y, type="line") for x, y in points])],
+        anchors=[Thing(name=n, x=x, y=y) for n, x, y in anchors],
+        components=[Thing(baseGlyph=c, transformation=(1, 0, 0, 1, 0, 0)) for c in components],
+    )
+
+
+def test_hash():
+    font = {"a": glyph(), "b": glyph(), "acomb": glyph(components=["a"])}
+    before = {g: glyphHash(font, g, {}) for g in font}
+    assert before["a"] == before["b"]
+    font["a"] = glyph(width=600)
+    assert glyphHash(font, "a", {}) != before["a"]
+    # Composites change with their components
+    assert glyphHash(font, "acomb", {}) != before["acomb"]
+    font["b"] = glyph(anchors=[("exit", 500, 10)])  # Anchors give the rise
+    assert glyphHash(font, "b", {}) != before["b"]
+
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / "test.fluxmetrics")
+    cache = MetricsCache(filename)
+    cache.put(b"x" * 20, {"width": 500, "rise": None})
+    cache.save()
+    metrics = MetricsCache(filename).get(b"x" * 20)
+    assert metrics["width"] == 500
+    # Missing metrics go in as NaN and come back as missing
+    assert all(metrics[k] is None for k in METRICS if k != "width")
+    assert MetricsCache(filename).get(b"y" * 20) is None
+
+
+def test_measure_once_and_save_later(tmp_path, monkeypatch):
+    measured = []
+
+    def measure(font, glyphname):
+        measured.append(glyphname)
+        return {k: font[glyphname].width if k == "width" else math.nan for k in METRICS}
+
+    monkeypatch.setattr(Flux.metricscache, "get_glyph_metrics", measure)
+    filename = tmp_path / "test.fluxmetrics"
+    font = {"a": glyph(), "b": glyph(width=700)}
+    index = GlyphIndex(font, MetricsCache(str(filename)))
+    assert index.toNames(index.compare("width", ">", 600)) == ["b"]
+    assert not filename.exists()  # Only saved with the project
+    index.cache.save()
+
+    index = GlyphIndex(font, MetricsCache(str(filename)))
+    index.column("width")
+    assert measured == ["a", "b"]
+    font["a"] = glyph(width=800)
+    index.forget("a")
+    assert index.toNames(index.compare("width", ">", 600)) == ["a", "b"]
+    assert measured == ["a", "b", "a"]
+    # Only the outlines still in the font are kept
+    index.save()
+    assert len(MetricsCache(str(filename)).rows) == 2
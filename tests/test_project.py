@@ -0,0 +1,237 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+import pytest
+import ufoLib2
+from lxml import etree
+from fontFeatures import Routine, Substitution
+from fontTools.designspaceLib import DesignSpaceDocument
+from Flux.computedroutine import ComputedRoutine
+from Flux.glyphactions import GlyphAction
+from Flux.journal import Journal
+from Flux.lazyroutine import SourceChanged
+from Flux.project import FluxProject
+
+FONT = os.path.join(os.path.dirname(__file__), "..", "Rajdhani-Regular.otf")
+
+
+def test_project_is_qt_free():
+    code = "import sys, Flux.project; assert not [m for m in sys.modules if m.startswith('PyQt5')]"
+    subprocess.check_call([sys.executable, "-c", code], cwd=os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_roundtrip(tmp_path):
+    proj = FluxProject.new(os.path.abspath(FONT))
+    filename = str(tmp_path / "test.fluxml")
+    proj.save(filename)
+
+    proj2 = FluxProject(filename)
+    assert [r.name for r in proj2.fontfeatures.routines] == [r.name for r in proj.fontfeatures.routines]
+    assert list(proj2.fontfeatures.features.keys()) == list(proj.fontfeatures.features.keys())
+
+
+def test_incremental_export(tmp_path):
+    proj = FluxProject.new(os.path.abspath(FONT))
+    assert proj.saveOTF(str(tmp_path / "first.ttf"), fea=str(tmp_path / "first.fea")) is None
+    assert "lookup" in (tmp_path / "first.fea").read_text()
+    assert proj.saveOTF(str(tmp_path / "second.ttf")) is None
+    assert proj.compiler.recompiled == []
+
+    routine = [r for r in proj.fontfeatures.routines if r.rules][0]
+    routine.flags = routine.flags ^ 0x8  # toggle IgnoreMarks
+    assert proj.saveOTF(str(tmp_path / "third.ttf")) is None
+    assert routine.name in proj.compiler.recompiled
+    compiled = [c for c in proj.compiler.routines.values() if c.count]
+    assert any(c.lookups()[0].LookupFlag == routine.flags for c in compiled)
+
+    # As the shaping debugger compiles, from a copy on another thread
+    assert proj.compiler.prepare(proj.frozenFeatures()) == proj.compiler.prepare()
+
+
+def test_duplicate_routine_names(tmp_path):
+    proj = FluxProject.new(os.path.abspath(FONT))
+    routines = [r for r in proj.fontfeatures.routines if r.rules]
+    routines[1].name = routines[0].name
+    assert "already been defined" in proj.saveOTF(str(tmp_path / "test.ttf"))
+
+
+def test_lazy_routines(tmp_path):
+    proj = FluxProject.new(os.path.abspath(FONT))
+    filename = str(tmp_path / "test.fluxml")
+    proj.save(filename)
+    rules = [[etree.tostring(r.toXML()) for r in routine.rules] for routine in proj.fontfeatures.routines]
+
+    proj2 = FluxProject(filename)
+    assert not any(r.loaded for r in proj2.fontfeatures.routines)
+    proj2.fontfeatures.routines[0].rules
+    # Saving over the file must not lose routines which haven't been read yet
+    proj2.save(filename)
+    assert [[etree.tostring(r.toXML()) for r in routine.rules] for routine in proj2.fontfeatures.routines] == rules
+
+
+def test_lazy_routines_file_changed(tmp_path):
+    filename = str(tmp_path / "test.fluxml")
+    FluxProject.new(os.path.abspath(FONT)).save(filename)
+    proj = FluxProject(filename)
+    with open(filename, "r+b") as f:  # as another program might
+        f.seek(0)
+        f.write(b"<!-- -->" + f.read())
+    with pytest.raises(SourceChanged):
+        proj.fontfeatures.routines[0].rules
+    with pytest.raises(SourceChanged):
+        proj.save(filename)
+
+
+def test_snapshot(tmp_path):
+    proj = FluxProject.new(os.path.abspath(FONT))
+    proj.debuggingText = "abc"
+    filename = str(tmp_path / "test.fluxml")
+    proj.save(filename, snapshot=True).join()
+    xml = (tmp_path / "test.fluxml").read_bytes()
+    proj.save(filename)
+    assert (tmp_path / "test.fluxml").read_bytes() == xml
+
+    proj.save(filename, snapshot=True).join()
+    proj2 = FluxProject(filename)
+    assert proj2.xml is None  # read from the snapshot
+    assert proj2.debuggingText == "abc"
+    assert etree.tostring(proj2.toXML()) == etree.tostring(proj.toXML())
+
+
+def test_journal(tmp_path):
+    filename = str(tmp_path / "test.fluxml")
+    FluxProject.new(os.path.abspath(FONT)).save(filename)
+    proj = FluxProject(filename)
+    proj.journal = Journal(proj)
+    proj.journal.start()
+    routine = Routine(name="Extra", rules=[Substitution([["a"]], [["b"]])])
+    proj.fontfeatures.routines.insert(0, routine)
+    proj.routinesChanged()
+    routine.rules.append(Substitution([["c"]], [["d"]]))
+    proj.routineChanged(routine)
+    proj.glyphclasses["extra"] = {"type": "manual", "contents": ["a"]}
+    proj.classChanged("extra")
+    # Dropping a routine onto a feature puts the routine itself there
+    feature = list(proj.fontfeatures.features.keys())[0]
+    proj.fontfeatures.features[feature].append(proj.routineRegistry.named("Extra"))
+    proj.routinesChanged()
+    proj.journal.close()
+
+    # As if Flux had gone away without saving
+    proj2 = FluxProject(filename)
+    journal = Journal(proj2)
+    assert journal.hasEntries()
+    assert journal.replay()
+    assert etree.tostring(proj2.toXML()) == etree.tostring(proj.toXML())
+    assert proj2.fontfeatures.namedClasses["extra"] == ("a",)
+    assert proj2.fontfeatures.features[feature][-1].routine is proj2.routineRegistry.named("Extra")
+
+
+def test_journal_unwritable_edit(tmp_path):
+    filename = str(tmp_path / "test.fluxml")
+    FluxProject.new(os.path.abspath(FONT)).save(filename)
+    proj = FluxProject(filename)
+    proj.journal = Journal(proj)
+    proj.journal.start()
+    proj.glyphclasses["first"] = {"type": "manual", "contents": ["a"]}
+    proj.classChanged("first")
+    # A plugin might leave objects of its own in a class or routine
+    proj.glyphclasses["odd"] = {"type": "manual", "contents": ["b"], "plugin": object()}
+    proj.classChanged("odd")
+    routine = Routine(name="Odd", rules=[Substitution([["a"]], [[object()]])])
+    proj.fontfeatures.routines.insert(0, routine)
+    proj.routinesChanged()
+    proj.glyphclasses["later"] = {"type": "manual", "contents": ["c"]}
+    proj.classChanged("later")
+    assert proj.journal.dirty
+    proj.journal.close()
+
+    # What got written up to there can still be recovered
+    proj2 = FluxProject(filename)
+    assert Journal(proj2).replay()
+    assert "first" in proj2.glyphclasses
+    assert "odd" not in proj2.glyphclasses and "later" not in proj2.glyphclasses
+
+
+def test_routine_registry():
+    proj = FluxProject.new(os.path.abspath(FONT))
+    registry = proj.routineRegistry
+    routines = proj.fontfeatures.routines
+    first = routines[0]
+    assert registry.named(first.name) is first
+    assert registry.row(first) == 0
+
+    first.name = "renamed"
+    proj.routineChanged(first)
+    assert registry.named("renamed") is first
+
+    new = Routine(name="added")
+    routines.insert(0, new)
+    assert registry.row(first) == 1
+    assert registry.named("added") is new
+    assert registry.lookups()[0] == "added"
+
+    routines.reverse()  # as a drag and drop would, without telling anyone
+    assert registry.row(new) == len(routines) - 1
+    routines.remove(new)
+    assert registry.named("added") is None
+
+    first.name = "quietly renamed"  # as the compiler does to unnamed routines
+    assert registry.named("quietly renamed") is first
+    assert "quietly renamed" in registry.lookups()
+
+
+def test_classes_see_glyph_actions(tmp_path):
+    filename = str(tmp_path / "test.fluxml")
+    proj = FluxProject.new(os.path.abspath(FONT))
+    proj.glyphactions["a"] = GlyphAction("a", width=4321)
+    proj.glyphclasses["wide"] = {"type": "automatic", "predicates": [
+        {"type": "width", "metric": "width", "comparator": "=", "value": "4321"}
+    ]}
+    proj.save(filename)
+
+    proj2 = FluxProject(filename)
+    assert proj2.fontfeatures.namedClasses["wide"] == ("a",)
+
+
+def test_base_font_follows_masters(tmp_path):
+    doc = DesignSpaceDocument()
+    doc.addAxisDescriptor(name="Weight", tag="wght", minimum=100, default=100, maximum=900)
+    for style, weight in (("Light", 100), ("Bold", 900)):
+        ufo = ufoLib2.Font()
+        ufo.info.familyName, ufo.info.styleName = "T", style
+        ufo.info.unitsPerEm = 1000
+        ufo.newGlyph("a").width = weight
+        filename = str(tmp_path / (style + ".ufo"))
+        ufo.save(filename)
+        doc.addSourceDescriptor(path=filename, styleName=style, location={"Weight": weight})
+    doc.write(str(tmp_path / "T.designspace"))
+    proj = FluxProject.new(str(tmp_path / "T.designspace"))
+    key = proj.compiler.baseFontKey()
+    # Edit a glyph in the second master, behind the designspace's back
+    glif = next((tmp_path / "Bold.ufo" / "glyphs").glob("a*.glif"))
+    os.utime(glif, (os.path.getmtime(glif) + 10,) * 2)
+    assert proj.compiler.baseFontKey() != key
+
+
+def test_class_edits_reach_computed_routines():
+    proj = FluxProject.new(os.path.abspath(FONT))
+    proj.glyphclasses["vowels"] = {"type": "manual", "contents": ["dvA"]}
+    proj.classChanged("vowels")
+    routine = ComputedRoutine(name="fromclass")
+    routine.project = proj
+    routine.module = SimpleNamespace(rulesFromComputedRoutine=lambda r: [
+        Substitution([list(r.project.fontfeatures.namedClasses.get("vowels", ()))], [["dvAA"]])
+    ])
+    proj.fontfeatures.routines.append(routine)
+    assert routine.rules[0].input == [["dvA"]]
+
+    proj.glyphclasses["vowels"]["contents"] = ["dvI", "dvU"]
+    proj.classChanged("vowels")
+    assert routine.rules[0].input == [["dvI", "dvU"]]
+
+    del proj.glyphclasses["vowels"]
+    proj.classChanged("vowels")
+    assert "vowels" not in proj.fontfeatures.namedClasses
+    assert routine.rules[0].input == [[]]
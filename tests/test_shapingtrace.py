@@ -0,0 +1,48 @@
+import copy
+import os
+from babelfont import Babelfont
+from Flux.shapingtrace import ShapingTrace, KEYFRAME_INTERVAL
+from Flux.variations import VariationAwareBuffer, VariationAwareBufferItem
+
+FONT = os.path.join(os.path.dirname(__file__), "..", "Rajdhani-Regular.otf")
+
+
+def contents(buf):
+    return [
+        (
+            i.glyph,
+            getattr(i, "syllable_index", None),
+            i.position.xPlacement or 0,
+            i.position.yPlacement or 0,
+            i.position.xAdvance or 0,
+            i.position.yAdvance or 0,
+        )
+        for i in buf.items
+    ]
+
+
+def test_trace_across_keyframes():
+    font = Babelfont.open(FONT)
+    buf = VariationAwareBuffer(font, glyphs=["dvKA", "dvAA", "dvI", "dvU"])
+    buf.direction = "LTR"
+    trace = ShapingTrace()
+    copies = {}
+    for n in range(KEYFRAME_INTERVAL * 2 + 5):
+        # A routine which changes one glyph's position, and now and then
+        # substitutes or inserts a glyph
+        item = buf.items[n % len(buf.items)]
+        item.position.xPlacement = (item.position.xPlacement or 0) + n
+        item.syllable_index = n % 3
+        if n % 7 == 0:
+            item.glyph = "dvKHA" if item.glyph == "dvKA" else "dvKA"
+        if n == 40:
+            buf.items.insert(1, VariationAwareBufferItem.new_glyph("dvMA", font, buf))
+        step, changed = trace.record(buf)
+        assert changed
+        copies[step] = copy.deepcopy(contents(buf))
+    assert len(trace.keyframes) > 2
+    # Back to front, so we don't just carry on from the last step
+    for step in sorted(copies, reverse=True):
+        assert contents(trace.buffer(step, font)) == copies[step]
+    for step in sorted(copies):
+        assert contents(trace.buffer(step, font)) == copies[step]
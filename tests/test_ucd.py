@@ -0,0 +1,41 @@
+import youseedee
+from Flux.ucd import TABLES, write_tables, load
+
+
+def test_ucd_roundtrip(tmp_path):
+    filename = str(tmp_path / "ucd.bin")
+    write_tables({
+        "ArabicShaping.txt": {1576: ["BEH", "D", "BEH"], 1575: ["ALEF", "R", "ALEF"]},
+        "Scripts.txt": [(1536, 1540, "Arabic"), (0, 31, "Common")],
+    }, filename)
+    tables = load(filename)
+
+    shaping = tables["ArabicShaping.txt"]
+    assert 1575 in shaping
+    assert 1577 not in shaping
+    assert shaping[1576] == ["BEH", "D", "BEH"]
+    assert list(shaping) == [1575, 1576]
+
+    scripts = tables["Scripts.txt"]
+    assert len(scripts) == 2
+    assert scripts[0] == (0, 31, "Common")
+    assert scripts[-1] == (1536, 1540, "Arabic")
+
+
+def test_ucd_data_offline(monkeypatch):
+    def download():
+        raise AssertionError("tried to download the UCD")
+
+    monkeypatch.setattr(youseedee, "ensure_files", download)
+    assert set(youseedee.database) == set(TABLES)
+    ka = youseedee.ucd_data(0x0915)
+    assert ka["Name"] == "DEVANAGARI LETTER KA"
+    assert ka["General_Category"] == "Lo"
+    assert ka["Script"] == "Devanagari"
+    assert ka["Indic_Syllabic_Category"] == "Consonant"
+    assert ka["USE_Category"] == "B"
+    assert youseedee.ucd_data(0x093F)["Indic_Positional_Category"] == "Left"
+    beh = youseedee.ucd_data(0x0628)
+    assert (beh["Joining_Type"], beh["Joining_Group"]) == ("D", "BEH")
+    assert youseedee.ucd_data(0x0301)["Canonical_Combining_Class"] == "230"
+    assert youseedee.ucd_data(0x0028)["Bidi_Mirroring_Glyph"] == "0029"
@@ -0,0 +1,83 @@
+import pytest
+import ufoLib2
+from babelfont.variablefont import VariableFont
+from fontFeatures import ValueRecord
+from fontTools.designspaceLib import DesignSpaceDocument
+from Flux.variations import GlyphInterpolator
+
+
+@pytest.fixture(scope="module")
+def vf(tmp_path_factory):
+    # Two masters, which differ in width, outline and component offset
+    path = tmp_path_factory.mktemp("vf")
+    doc = DesignSpaceDocument()
+    doc.addAxisDescriptor(name="Weight", tag="wght", minimum=100, default=100, maximum=900)
+    for style, weight, scale in (("Light", 100, 1), ("Bold", 900, 3)):
+        ufo = ufoLib2.Font()
+        ufo.info.familyName, ufo.info.styleName = "T", style
+        ufo.info.unitsPerEm = 1000
+        a = ufo.newGlyph("a")
+        a.width = 400 + 100 * scale
+        pen = a.getPen()
+        pen.moveTo((10 * scale, 0))
+        pen.lineTo((10 * scale, 100 * scale))
+        pen.lineTo((200, 100 * scale))
+        pen.closePath()
+        acomb = ufo.newGlyph("acomb")
+        acomb.width = a.width
+        acomb.getPen().addComponent("a", (1, 0, 0, 1, 20 * scale, 0))
+        filename = str(path / (style + ".ufo"))
+        ufo.save(filename)
+        doc.addSourceDescriptor(path=filename, styleName=style, location={"Weight": weight})
+    filename = str(path / "T.designspace")
+    doc.write(filename)
+    return VariableFont(filename)
+
+
+def variableValueRecord(vf, light, bold):
+    vr = ValueRecord(xAdvance=light)
+    vr.masters = {
+        vf.master_order[0]: ValueRecord(xAdvance=light),
+        vf.master_order[1]: ValueRecord(xAdvance=bold),
+    }
+    return vr
+
+
+def test_value_records_at_two_locations(vf):
+    interpolator = GlyphInterpolator(vf)
+    vr = variableValueRecord(vf, 10, 50)
+    # As the shaping thread and the GUI might ask, one after the other
+    for i in range(3):
+        assert interpolator.valueRecord(vr, {"Weight": 100}).xAdvance == pytest.approx(10)
+        assert interpolator.valueRecord(vr, {"Weight": 500}).xAdvance == pytest.approx(30)
+    vr.masters[vf.master_order[1]].xAdvance = 90
+    interpolator.forgetValueRecord(vr)
+    assert interpolator.valueRecord(vr, {"Weight": 500}).xAdvance == pytest.approx(50)
+    assert interpolator.valueRecord(vr, {"Weight": 100}).xAdvance == pytest.approx(10)
+
+
+def test_interpolation_matches_babelfont(vf):
+    interpolator = GlyphInterpolator(vf)
+
+    def expected(attribute):
+        return {
+            master: tuple(attribute(vf.masters[master]))
+            for master in vf.master_order
+        }
+
+    for weight in (100, 300, 500, 900):
+        location = {"Weight": weight}
+        normalized = vf.normalize(location)
+        points = expected(lambda m: [coord for c in m["a"].contours for p in c.points for coord in (p.x, p.y)])
+        assert interpolator.glyphPoints("a", normalized).flatten() == pytest.approx(
+            vf.interpolate_tuples(points, location)
+        )
+        transformations = expected(lambda m: [v for c in m["acomb"].components for v in c.transformation])
+        assert interpolator.componentTransformations("acomb", normalized).flatten() == pytest.approx(
+            vf.interpolate_tuples(transformations, location)
+        )
+        for glyph in ("a", "acomb"):
+            widths = {master: vf.masters[master][glyph].width for master in vf.master_order}
+            assert interpolator.advanceWidth(glyph, location) == pytest.approx(
+                vf.interpolate_tuples(widths, location)
+            )